@@ -4,6 +4,9 @@ from audioop import add
 from io import IncrementalNewlineDecoder
 import random
 import math
+import heapq
+import bisect
+from collections import deque
 import time
 from enum import Enum
 from unicodedata import decimal
@@ -15,6 +18,19 @@ N_ONE_CLK_G = 24
 N_GAP_CLK_G = 16
 N_FIN_CLK_G = 40
 
+# Endeavor transfer ticks of a 64 bit word, indexed by its number of high bits
+TRANSFER_TICKS_TABLE = tuple(
+    n * N_ONE_CLK_G + (64 - n) * N_ZER_CLK_G + 63 * N_GAP_CLK_G + N_FIN_CLK_G for n in range(65)
+)
+_TRANSFER_TICKS_ARRAY = np.array(TRANSFER_TICKS_TABLE, dtype=np.int64)
+_POPCOUNT_8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.int64)
+
+# fixed transfer ticks used for register words
+REG_TRANSFER_TICKS = 1700
+
+# replays of more times than this are vectorized, see replay_times
+REPLAY_VECTOR_TIMES = 32
+
 ## helper functions
 def PrintFifoInfo(asic):
     print("\033[4m" + f"asic ({asic.row},{asic.col}) Local Fifo" + "\033[0m")
@@ -37,6 +53,198 @@ def PrintFifoInfo(asic):
     print("\n")
 
 
+def pack_words(wordType, row, col, timeStamps, channelMasks):
+    """
+    vectorized version of QPByte.Pack for data words, returns a uint64 array
+    of the words from (row, col) with the given timeStamps and channelMasks
+    """
+    head = (wordType.value & 0xF) << 56 | (int(row or 0) & 0xF) << 36 | (int(col or 0) & 0xF) << 32
+    words = np.asarray(timeStamps).astype(np.uint64) & np.uint64(0xFFFFFFFF)
+    words |= (np.asarray(channelMasks).astype(np.uint64) & np.uint64(0xFFFF)) << np.uint64(40)
+    words |= np.uint64(head)
+    return words
+
+
+def channel_masks(channels, nHits):
+    """
+    vectorized channel masks of nHits injected hits. channels is either None for
+    the default channels 1, 3 and 8, an integer array of masks, or a ragged list
+    of the channels hit by each hit.
+    """
+    if channels is None:
+        return np.full(nHits, 0x1 << 1 | 0x1 << 3 | 0x1 << 8, dtype=np.int64)
+    assert len(channels) == nHits, "Injected Times and Channels must be same length"
+    if isinstance(channels, np.ndarray) and channels.ndim == 1 and np.issubdtype(channels.dtype, np.integer):
+        return channels.astype(np.int64)
+
+    # OR every channel bit into the mask of the hit it belongs to
+    lengths = np.fromiter((len(c) for c in channels), dtype=np.int64, count=nHits)
+    flat = np.fromiter((ch for c in channels for ch in c), dtype=np.int64, count=int(lengths.sum()))
+    masks = np.zeros(nHits, dtype=np.int64)
+    np.bitwise_or.at(masks, np.repeat(np.arange(nHits), lengths), np.left_shift(1, flat))
+    return masks
+
+
+def poisson_hits(rng, rates, startTime, endTime):
+    """
+    Poisson hits of independent streams, each with its own rate in Hz, between
+    startTime and endTime. Exponential inter-arrival times of every stream are
+    drawn with one call of the numpy Generator rng, streams which outlast their
+    draws continue in another call.
+
+    returns the stream index and time of every hit, sorted by stream then time
+    """
+    rates = np.asarray(rates, dtype=np.float64)
+    start = np.broadcast_to(np.asarray(startTime, dtype=np.float64), rates.shape).copy()
+    streams, times = [], []
+    active = np.flatnonzero((rates > 0) & (start < endTime))
+    while len(active) > 0:
+        # enough draws that most streams reach endTime, the rest continue in
+        # another, much smaller, call
+        mean = float(np.max(rates[active] * (endTime - start[active])))
+        nDraws = int(mean + 2 * math.sqrt(mean)) + 2
+        intervals = rng.standard_exponential(size=(len(active), nDraws))
+        intervals /= rates[active, None]
+        hitTimes = np.cumsum(intervals, axis=1, out=intervals)
+        hitTimes += start[active, None]
+        inWindow = hitTimes < endTime
+        rows, cols = np.nonzero(inWindow)
+        streams.append(active[rows])
+        times.append(hitTimes[rows, cols])
+
+        more = inWindow[:, -1]
+        start[active[more]] = hitTimes[more, -1]
+        active = active[more]
+
+    if not streams:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    if len(streams) == 1:
+        return streams[0], times[0]
+
+    # every call continues later in time, so a stable sort by stream is enough
+    streams, times = np.concatenate(streams), np.concatenate(times)
+    order = np.argsort(streams, kind="stable")
+    return streams[order], times[order]
+
+
+def group_hits(owners, ticks, times, channels):
+    """
+    group hits of the same owner on the same clock tick into a single hit with
+    a channel mask. returns the owner, earliest time and channel mask of every
+    group, sorted by owner then time
+    """
+    if len(owners) == 0:
+        return owners, times, np.zeros(0, dtype=np.int64)
+
+    # sort on a single (owner, tick) key when it fits in an int64
+    firstTick = ticks.min()
+    nTicks = int(ticks.max() - firstTick) + 1
+    if (int(owners.max()) + 1) * nTicks < 2**62:
+        order = np.argsort(owners.astype(np.int64) * nTicks + (ticks - firstTick), kind="stable")
+    else:
+        order = np.lexsort((ticks, owners))
+    owners, ticks, times, channels = owners[order], ticks[order], times[order], channels[order]
+
+    first = np.ones(len(owners), dtype=bool)
+    first[1:] = (owners[1:] != owners[:-1]) | (ticks[1:] != ticks[:-1])
+    starts = np.flatnonzero(first)
+    masks = np.bitwise_or.reduceat(np.left_shift(1, channels.astype(np.int64)), starts)
+    return owners[starts], np.minimum.reduceat(times, starts), masks
+
+
+def hit_windows(hits, window):
+    """
+    split the (asicX, asicY, times[, channels]) hits of a tiledf into the
+    (windowEnd, chunks) windows read by QpixAsicArray.StreamHits, each window
+    seconds long. chunks are the (asicX, asicY, times, masks) of every ASIC with
+    hits in the window.
+    """
+    asics = []
+    for hit in hits:
+        times = np.asarray(hit[2], dtype=np.float64)
+        masks = channel_masks(hit[3] if len(hit) > 3 else None, len(times))
+        order = np.argsort(times, kind="stable")
+        asics.append((hit[0], hit[1], times[order], masks[order]))
+    lastTime = max((times[-1] for _, _, times, _ in asics if len(times) > 0), default=-math.inf)
+
+    starts = [0] * len(asics)
+    windowEnd = window
+    while True:
+        chunks = []
+        for i, (asicX, asicY, times, masks) in enumerate(asics):
+            stop = int(np.searchsorted(times, windowEnd, side="left"))
+            if stop > starts[i]:
+                chunks.append((asicX, asicY, times[starts[i]:stop], masks[starts[i]:stop]))
+                starts[i] = stop
+        yield windowEnd, chunks
+        if windowEnd > lastTime:
+            return
+        windowEnd += window
+
+
+def _popcount(words):
+    """
+    number of high bits of every word of an array of 64 bit words
+    """
+    words = np.ascontiguousarray(words, dtype=np.uint64)
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words)
+    return _POPCOUNT_8[words.view(np.uint8)].reshape(words.shape + (8,)).sum(axis=-1)
+
+
+def transfer_ticks(words):
+    """
+    vectorized Endeavor transfer ticks of an array of packed 64 bit words,
+    see QPByte.Pack and pack_words. A QPByte is costed from its fields when it
+    is built, so these are its transferTicks as long as its fields fit in the
+    packed word and its channel mask was set when it was built. Hits read by
+    QPixAsic._ReadHits are costed before their mask is set, as the words of
+    pack_words with channelMasks=0.
+    """
+    return _TRANSFER_TICKS_ARRAY[_popcount(words)]
+
+
+def replay_times(absTimeNow, relTimeNow, tOsc, times):
+    """
+    vectorized QPixAsic.ReplayTimes of a clock with period tOsc, at absTimeNow
+    and relTimeNow. returns the new absTimeNow and relTimeNow, the ticks added,
+    and the times still to be replayed one at a time.
+
+    The cycles of every time are predicted with exact arithmetic, the relative
+    times are their running sum in the order ReplayTimes adds them, and every
+    cycle is then checked against the float clock of ReplayTimes. Float rounding
+    can make a prediction wrong, the times from the first wrong one are left to
+    the caller.
+    """
+    times = np.asarray(times, dtype=np.float64)
+
+    # only times past the current time move the clock
+    if times.max() <= absTimeNow:
+        return absTimeNow, relTimeNow, 0, times[:0]
+    times = times[times > np.maximum.accumulate(np.concatenate(([absTimeNow], times[:-1])))]
+
+    # a time in tick floor(g) of the clock moves it to the next tick, one more
+    # if the clock is already past the time: the previous time was in the same
+    # tick, or a tick ahead of it and the clock was past that one too
+    ticks = (times - relTimeNow) / tOsc
+    tick = np.floor(ticks)
+    gap = np.diff(tick, prepend=np.nan)
+    ahead = np.where(gap == 0, 1.0, 0.0)
+    ahead[0] = ticks[0] < 0
+    carry = np.where(gap == 1, 0, np.arange(len(times)))
+    ahead = ahead[np.maximum.accumulate(carry)]
+    clock = tick + 1 + ahead
+    cycles = np.diff(clock, prepend=0.0)
+
+    # relTimeNow before every time, added one cycle at a time as ReplayTimes does
+    relTimes = np.cumsum(np.concatenate(([relTimeNow], cycles * tOsc)))
+    wrong = np.flatnonzero(np.trunc((times - relTimes[:-1]) / tOsc) + 1 != cycles)
+    n = wrong[0] if len(wrong) > 0 else len(times)
+    if n == 0:
+        return absTimeNow, relTimeNow, 0, times
+    return float(times[n - 1]), float(relTimes[n]), int(cycles[:n].sum()), times[n:]
+
+
 class QPException(Exception):
     pass
 
@@ -119,6 +327,42 @@ class AsicConfig:
     SendRemote = False
 
 
+class _QPRegFields:
+    """
+    Register request / response members of a QPByte. These are only allocated
+    for REGREQ and REGRESP words, plain DATA words never carry them.
+    """
+
+    __slots__ = ("Dest", "OpWrite", "OpRead", "XDest", "YDest", "ReqID", "config")
+
+    def __init__(self):
+        self.Dest = False
+        self.OpWrite = False
+        self.OpRead = False
+        self.XDest = None
+        self.YDest = None
+        self.ReqID = -1
+        self.config = None
+
+
+def _regField(name):
+    """
+    property accessing the lazily allocated register member name of a QPByte
+    """
+
+    def fget(self):
+        if self._reg is None:
+            raise AttributeError(f"{self.wordType} word has no register field {name}")
+        return getattr(self._reg, name)
+
+    def fset(self, value):
+        if self._reg is None:
+            self._reg = _QPRegFields()
+        setattr(self._reg, name, value)
+
+    return property(fget, fset)
+
+
 class QPByte:
     """
     This struct-style class stores no more than the 64 bit information transfered
@@ -139,14 +383,31 @@ class QPByte:
         timeStamp   : 32 bit time stamp
         channelList : 16 bit channel map
       data        : extra value for simulation
+      transferTicks : Endeavor transfer ticks of the word, by default costed
+                      from its fields
 
     NOTE: refactored PixelHit object! Data that are transferred are Bytes~ NOT
     'hits'. A hit is always a time stamp, but what is transferred is the more
     generic byte.
 
     NOTE: 2 bits are currently reserved, and formating is defined in QpixPkg.vhd
+
+    NOTE: QPBytes use __slots__ to keep memory per word small. The register
+    members are only allocated for REGREQ / REGRESP words, and Pack() returns
+    the 64 bit word as it is formatted in QpixPkg.vhd.
     """
 
+    __slots__ = ("wordType", "originRow", "originCol", "data", "timeStamp",
+                 "channelMask", "transferTicks", "_reg")
+
+    Dest = _regField("Dest")
+    OpWrite = _regField("OpWrite")
+    OpRead = _regField("OpRead")
+    XDest = _regField("XDest")
+    YDest = _regField("YDest")
+    ReqID = _regField("ReqID")
+    config = _regField("config")
+
     def __init__(
         self,
         wordType,
@@ -162,6 +423,7 @@ class QPByte:
         OpRead=False,
         OpWrite=False,
         config=AsicConfig(AsicDirMask.North, 1.5e4),
+        transferTicks=None,
     ):
 
         if not isinstance(wordType, AsicWord):
@@ -170,20 +432,21 @@ class QPByte:
         self.wordType = wordType
         self.originRow = originRow
         self.originCol = originCol
-        self.SrcDaq = bool(originCol is None and originRow is None)
         self.data = data
         self.timeStamp = timeStamp
         self.channelMask = None
+        self._reg = None
 
         # if the wordType is a reg request, then build destination members
         if self.wordType == AsicWord.REGREQ:
-            self.Dest = Dest
-            self.OpWrite = OpWrite
-            self.OpRead = OpRead
-            self.XDest = XDest
-            self.YDest = YDest
-            self.ReqID = ReqID
-            self.config = config
+            reg = self._reg = _QPRegFields()
+            reg.Dest = Dest
+            reg.OpWrite = OpWrite
+            reg.OpRead = OpRead
+            reg.XDest = XDest
+            reg.YDest = YDest
+            reg.ReqID = ReqID
+            reg.config = config
         elif self.wordType == AsicWord.REGRESP:
             self.config = config
         else:
@@ -193,7 +456,7 @@ class QPByte:
                     self.channelMask |= 0x1 << ch
 
         # calculate the transfer ticks we need at the creation of the byte
-        self.transferTicks = self._TransferTicks()
+        self.transferTicks = self._TransferTicks() if transferTicks is None else transferTicks
 
     def __repr__(self):
         """
@@ -202,32 +465,67 @@ class QPByte:
         msg = f"({self.originRow},{self.originCol}): {self.wordType}  - {self.data}"
         return msg
 
+    @property
+    def SrcDaq(self):
+        return self.originCol is None and self.originRow is None
+
     def AddChannel(self, channel):
         self.channelMask |= 0x1 << channel
 
+    def Pack(self):
+        """
+        returns the 64 bit integer word transferred for this byte, using the
+        fQpixRecordToByte / fQpixRegToByte formats in QpixPkg.vhd:
+          63-60 reserved, 59-56 word type, 39-36 x, 35-32 y
+          data words    : 55-40 channel mask, 31-0 timestamp
+          register words: 55 OpWrite, 54 OpRead, 53 Dest, 52-49 ReqID, 48 SrcDaq
+        """
+        wordType = self.wordType.value if isinstance(self.wordType, AsicWord) else int(self.wordType)
+        if self._reg is None or self.wordType == AsicWord.REGRESP:
+            x, y = self.originRow, self.originCol
+        else:
+            x, y = self._reg.XDest, self._reg.YDest
+        word = (wordType & 0xF) << 56
+        word |= (int(x or 0) & 0xF) << 36
+        word |= (int(y or 0) & 0xF) << 32
+
+        if self._reg is None:
+            word |= (int(self.channelMask or 0) & 0xFFFF) << 40
+            word |= int(self.timeStamp or 0) & 0xFFFFFFFF
+        else:
+            reg = self._reg
+            word |= bool(reg.OpWrite) << 55
+            word |= bool(reg.OpRead) << 54
+            word |= bool(reg.Dest) << 53
+            word |= (int(reg.ReqID) & 0xF) << 49
+            word |= self.SrcDaq << 48
+        return word
+
+    @staticmethod
+    def Unpack(word):
+        """
+        build a DATA or EVTEND QPByte back from a 64 bit word made by Pack()
+        """
+        byte = QPByte(AsicWord((word >> 56) & 0xF), (word >> 36) & 0xF, (word >> 32) & 0xF,
+                      timeStamp=word & 0xFFFFFFFF)
+        byte.channelMask = (word >> 40) & 0xFFFF
+        byte.transferTicks = byte._TransferTicks()
+        return byte
+
     def _TransferTicks(self):
         """
         Function returns number of transfer ticks (based on Endeavor protocol)
-        that should be held to send this byte across
+        that should be held to send this byte across. The cost only depends on
+        the number of high bits of the fields of the word.
         """
         if self.channelMask is None or self.timeStamp is None:
-            return 1700
+            return REG_TRANSFER_TICKS
         else:
-
-            highBits = bin(int(self.channelMask)).count("1")
-            highBits += bin(int(self.timeStamp)).count("1")
-            highBits += bin(int(self.originCol)).count("1")
-            highBits += bin(int(self.originRow)).count("1")
-            highBits += bin(int(self.wordType.value)).count("1")
-
-            N_BITS = 64
-            lowBits = N_BITS - highBits
-            num_gap = (N_BITS - 1) * N_GAP_CLK_G
-
-            num_ones = highBits * N_ONE_CLK_G
-            num_zeros = lowBits * N_ZER_CLK_G
-            num_data = num_ones + num_zeros
-            return num_data + num_gap + N_FIN_CLK_G
+            # the fields side by side in one word, wide enough that none of them
+            # is truncated as in Pack(), so a single popcount counts them all
+            word = abs(int(self.timeStamp)) << 64 | self.channelMask << 32
+            word |= self.originRow << 16 | self.originCol << 4 | self.wordType.value
+            return TRANSFER_TICKS_TABLE[word.bit_count()]
 
 
 class QPFifo:
@@ -236,10 +534,13 @@ class QPFifo:
 
     A FIFO can only do two things: Read and Write. Therefore, there should only
     be two implemented public functions for this class: Read and Write.
+
+    Data are stored in a deque so that both Read and Write are O(1), no matter
+    how deep the FIFO grows.
     """
 
     def __init__(self, maxDepth=256):
-        self._data = []
+        self._data = deque()
         self._maxSize = 0
         self._curSize = 0
         self._maxDepth = maxDepth
@@ -280,11 +581,77 @@ class QPFifo:
         """
         if self._curSize > 0:
             self._curSize -= 1
-            return self._data.pop(0)
+            return self._data.popleft()
         else:
             return None
 
 
+class StateRecorder:
+    """
+    Columnar record of the FSM state transitions of an ASIC: the AsicState value,
+    relative time and absolute time of every transition, kept in growable int8
+    and float64 numpy buffers instead of a list of tuples.
+
+    ARGS:
+      mode - "full" (default) records every transition, "ring" only the last
+             size transitions, and "off" none
+      size - number of transitions kept by a "ring" record
+    """
+
+    __slots__ = ("mode", "size", "_states", "_relTimes", "_absTimes", "_n")
+
+    def __init__(self, mode="full", size=1024):
+        assert mode in ("full", "ring", "off"), f"unknown state record mode {mode}"
+        assert mode != "ring" or size > 0, "a ring state record needs a size"
+        self.mode = mode
+        self.size = size
+        capacity = size if mode == "ring" else 16 if mode == "full" else 0
+        self._states = np.zeros(capacity, dtype=np.int8)
+        self._relTimes = np.zeros(capacity)
+        self._absTimes = np.zeros(capacity)
+        # transitions recorded so far, including the ones a ring has dropped
+        self._n = 0
+
+    def append(self, state, relTime, absTime):
+        """
+        record a transition into state at relTime and absTime
+        """
+        if self.mode == "off":
+            return
+        i = self._n
+        if self.mode == "ring":
+            i %= self.size
+        elif i == len(self._states):
+            # double the buffers, so appends are amortized O(1)
+            self._states = np.concatenate((self._states, np.zeros(i, dtype=np.int8)))
+            self._relTimes = np.concatenate((self._relTimes, np.zeros(i)))
+            self._absTimes = np.concatenate((self._absTimes, np.zeros(i)))
+        self._states[i] = state.value
+        self._relTimes[i] = relTime
+        self._absTimes[i] = absTime
+        self._n += 1
+
+    def __len__(self):
+        return min(self._n, len(self._states))
+
+    def to_arrays(self):
+        """
+        the recorded (states, relTimes, absTimes) in the order they happened,
+        with states the AsicState values. Views of the buffers unless a ring
+        has wrapped around.
+        """
+        n = len(self)
+        if self._n <= len(self._states):
+            return self._states[:n], self._relTimes[:n], self._absTimes[:n]
+        start = self._n % self.size
+        return tuple(np.roll(a, -start) for a in (self._states, self._relTimes, self._absTimes))
+
+    def __eq__(self, other):
+        if not isinstance(other, StateRecorder):
+            return NotImplemented
+        return all(np.array_equal(a, b) for a, b in zip(self.to_arrays(), other.to_arrays()))
+
+
 class ProcItem:
     """
     Process item controlled by ProcQueue.
@@ -293,15 +660,53 @@ class ProcItem:
     QPByte, a QPByte object
     inTime, time that the data would be received, or that the sending asic completes sending QPByte
     command, flag to determine how individual ASIC receiving data should behave
+
+    ASIC state handlers emit ProcItems with Acquire, which reuses items from the
+    free list of the ProcQueue of their array, refilled by its PopQueue, so that
+    a word crossing the array doesn't allocate a new item on every hop.
     """
 
-    def __init__(self, asic, dir, QPByte, inTime, command=None):
+    __slots__ = ("asic", "dir", "QPByte", "inTime", "command", "_pool")
+
+    def __init__(self, asic, dir, QPByte, inTime, command=None, pool=None):
         self.asic = asic
         self.dir = dir
         self.QPByte = QPByte
         self.inTime = inTime
         self.command = command
-        self._nextItem = None
+        # free list this item is released to, None if it is never recycled
+        self._pool = pool
+
+    @staticmethod
+    def Acquire(pool, asic, dir, QPByte, inTime, command=None):
+        """
+        return a ProcItem from the free list pool, only allocating a new one if
+        the free list is empty. Items acquired without a pool are never recycled.
+        """
+        if pool:
+            item = pool.pop()
+            item.asic = asic
+            item.dir = dir
+            item.QPByte = QPByte
+            item.inTime = inTime
+            item.command = command
+            return item
+        return ProcItem(asic, dir, QPByte, inTime, command, pool)
+
+    def Release(self):
+        """
+        place this item back onto its free list, it must not be used afterwards
+        """
+        if self._pool is not None:
+            self.asic = None
+            self.QPByte = None
+            self._pool.append(self)
+
+    def __getitem__(self, i):
+        """
+        allow a ProcItem to be indexed like an (asic, dir, QPByte, inTime, command) tuple
+        """
+        return (self.asic, self.dir, self.QPByte, self.inTime, self.command)[i]
 
     def __gt__(self, otherItem):
         """
@@ -319,51 +724,65 @@ class ProcQueue:
     ProcQueue class is the main class which defines the simulation flow.
 
     It is designed to store ProcItem class objects, which are the basic unit of an ASIC transaction.
+
+    Items are kept on a binary heap keyed by (inTime, seq), where seq is a
+    monotonic insertion counter. Items with equal inTimes are therefore popped
+    in the order they were added, which keeps the simulation deterministic.
+
+    NOTE: while recycle is set, a popped ProcItem of the queue's free list is
+    released back to it on the next call to PopQueue, and must not be used
+    after that. Items the queue didn't acquire are never released.
     """
 
     def __init__(self, procItem=None):
-        self._curItem = procItem
+        self._heap = []
+        self._seq = 0
         self._entries = 0
+        self._lastItem = None
+        # free list of the items of this queue, and of the ASICs feeding it
+        self._pool = []
+        self.recycle = True
         # keep track of how many items this has queue has processed
         self.processed = 0
+        if procItem is not None:
+            self._AddQueueItem(procItem)
 
     def AddQueueItem(self, asic, dir, QPByte, inTime, command=None):
         """
-        refactor
+        build a ProcItem from the transaction and place it onto the queue
         """
-        procItem = ProcItem(asic, dir, QPByte, inTime, command)
-        self._AddQueueItem(procItem)
+        procItem = ProcItem.Acquire(self._pool, asic, dir, QPByte, inTime, command)
+        return self._AddQueueItem(procItem)
+
+    def AddProcItem(self, procItem):
+        """
+        place a ProcItem emitted by an ASIC directly onto the queue
+        """
+        return self._AddQueueItem(procItem)
 
     def _AddQueueItem(self, procItem):
         """
-        include a new process item, inserting into list at appropriate time
+        include a new process item, O(log n) in the number of queued items
         """
-        newItem = procItem
-        curItem = self._curItem
+        heapq.heappush(self._heap, (procItem.inTime, self._seq, procItem))
+        self._seq += 1
         self._entries += 1
-
-        if curItem is None:
-            self._curItem = newItem
-        elif curItem > newItem:
-            h = self._curItem
-            self._curItem = newItem
-            self._curItem._nextItem = h
-        else:
-            while newItem > curItem and curItem._nextItem is not None:
-                curItem = curItem._nextItem
-            newItem._nextItem = curItem._nextItem
-            curItem._nextItem = newItem
-
         return self._entries
 
     def PopQueue(self):
-        if self._curItem is None:
+        """
+        remove and return the ProcItem with the earliest inTime
+        """
+        if self._lastItem is not None:
+            if self.recycle and self._lastItem._pool is self._pool:
+                self._lastItem.Release()
+            self._lastItem = None
+        if not self._heap:
             return None
         self.processed += 1
         self._entries -= 1
-        data = self._curItem
-        self._curItem = self._curItem._nextItem
-        return data
+        self._lastItem = heapq.heappop(self._heap)[2]
+        return self._lastItem
 
     def SortQueue(self):
         """
@@ -374,6 +793,105 @@ class ProcQueue:
     def Length(self):
         return self._entries
 
+    def __getstate__(self):
+        """
+        pickled without the last popped item, which is only kept to be released
+        """
+        state = self.__dict__.copy()
+        state["_lastItem"] = None
+        return state
+
+
+class LaneProcQueue(ProcQueue):
+    """
+    Alternative ProcQueue scheduler which keeps one FIFO lane per directed link,
+    keyed by the receiving ASIC and the direction the data comes from. The DAQ
+    commands issued by QpixAsicArray enter on the DaqNode link into the first
+    ASIC and share its lane.
+
+    Every word sent along a connection arrives in nondecreasing time order, since
+    AsicConnections.connection.send serializes txBusy. Therefore only the head of
+    each lane needs to be on the heap: inserts are O(1) and pops are O(log links)
+    rather than O(log words). Items are popped in the same (inTime, seq) order as
+    ProcQueue.
+    """
+
+    def __init__(self, procItem=None):
+        self._lanes = {}
+        super().__init__(procItem)
+
+    def _AddQueueItem(self, procItem):
+        """
+        append the process item to the tail of its lane
+        """
+        key = (id(procItem.asic), procItem.dir)
+        entry = (procItem.inTime, self._seq, procItem)
+        self._seq += 1
+        self._entries += 1
+
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = deque()
+
+        if not lane or entry >= lane[-1]:
+            lane.append(entry)
+            if len(lane) == 1:
+                heapq.heappush(self._heap, (entry[0], entry[1], key))
+        else:
+            # out of order on this lane, shouldn't happen for link traffic but
+            # keep the lane sorted anyway. A new head gets its own heap entry,
+            # the old one goes stale and is skipped in PopQueue
+            bisect.insort(lane, entry)
+            if lane[0] is entry:
+                heapq.heappush(self._heap, (entry[0], entry[1], key))
+
+        return self._entries
+
+    def PopQueue(self):
+        """
+        remove and return the ProcItem with the earliest inTime across all lanes
+        """
+        if self._lastItem is not None:
+            if self.recycle and self._lastItem._pool is self._pool:
+                self._lastItem.Release()
+            self._lastItem = None
+        while self._heap:
+            _, seq, key = heapq.heappop(self._heap)
+            lane = self._lanes[key]
+            # skip stale heap entries
+            if not lane or lane[0][1] != seq:
+                continue
+            _, _, procItem = lane.popleft()
+            if lane:
+                heapq.heappush(self._heap, (lane[0][0], lane[0][1], key))
+            self.processed += 1
+            self._entries -= 1
+            self._lastItem = procItem
+            return procItem
+        return None
+
+    def __getstate__(self):
+        """
+        lanes are keyed by id(asic), which doesn't survive pickling. Only the
+        non empty lanes are kept, and their keys and heap entries are rebuilt
+        from their items by __setstate__.
+        """
+        state = super().__getstate__()
+        state["_lanes"] = [lane for lane in self._lanes.values() if lane]
+        state["_heap"] = None
+        return state
+
+    def __setstate__(self, state):
+        lanes = state.pop("_lanes")
+        self.__dict__.update(state)
+        self._lanes = {}
+        self._heap = []
+        for lane in lanes:
+            key = (id(lane[0][2].asic), lane[0][2].dir)
+            self._lanes[key] = lane
+            self._heap.append((lane[0][0], lane[0][1], key))
+        heapq.heapify(self._heap)
+
 
 class QPixAsic:
     """
@@ -392,12 +910,14 @@ class QPixAsic:
     col           - y position within array
     transferTicks - number of clock cycles governed in a transaction, which is determined by Endeavor protocol parameters
     debugLevel    - float flag which has print statements, > 0 values will cause prints
+    stateRecord   - StateRecorder mode of state_times, "full", "ring" or "off"
+    stateRingSize - number of transitions kept by a "ring" state_times
     ## AsicConfig members
     timeout       - clock cycles that ASIC will remote in transmit remote state
     pTimeout      - clock cycles that ASIC will collect before entering transmit local state
     ## tracking params
     state         - AsicState Enum class, based on QpixRoute.vhd FSM states
-    state_times   - list of tuples that store transition times of ASIC states based on the
+    state_times   - StateRecorder of the transition times of ASIC states based on the
     ## Buffers
     _localFifo   - QPFifo class to manage Read and Write of local data
     _remoteFifo  - QPFifo list of four QPFifo class' to manage write of remote ASIC data / transactions
@@ -417,6 +937,8 @@ class QPixAsic:
         transferTicks=1700,
         debugLevel=0,
         pTimeout=25e6,
+        stateRecord="full",
+        stateRingSize=1024,
     ):
         # basic asic parameters
         self.fOsc = fOsc
@@ -440,7 +962,8 @@ class QPixAsic:
         self.relTicksNow = 0
 
         self.state = AsicState.Idle
-        self.state_times = [(self.state, self.relTimeNow, self._absTimeNow)]
+        self.state_times = StateRecorder(stateRecord, stateRingSize)
+        self.state_times.append(self.state, self.relTimeNow, self._absTimeNow)
 
         # daq node Configuration
         self.isDaqNode = isDaqNode
@@ -452,6 +975,8 @@ class QPixAsic:
         self.connections = self.AsicConnections(self.transferTime)
         self._localFifo = QPFifo(maxDepth=256)
         self._remoteFifo = QPFifo(maxDepth=256)
+        # free list of the ProcQueue this ASIC's items go to, see ProcItem.Acquire
+        self._itemPool = None
 
         # additional / debug
         self._debugLevel = debugLevel
@@ -461,6 +986,12 @@ class QPixAsic:
         # useful things for InjectHits
         self._times = []
         self._channels = []
+        # arrays _times and _channels are views of while hits are appended,
+        # filled up to _hitEnd, see _AppendHits
+        self._hitBuffer = None
+        self._hitEnd = 0
+        # optional callback, told whenever the next hit time in self._times changes
+        self._onNextHit = None
 
     def __repr__(self):
         self.PrintStatus()
@@ -502,7 +1033,7 @@ class QPixAsic:
             self.timeoutStart = self._absTimeNow
         if self.state != newState:
             self.state = newState
-            self.state_times.append((self.state, self.relTimeNow, self._absTimeNow))
+            self.state_times.append(self.state, self.relTimeNow, self._absTimeNow)
 
     def PrintStatus(self):
         if self._debugLevel > 0:
@@ -575,7 +1106,7 @@ class QPixAsic:
                     destAsic = self.connections[i].asic
                     fromDir = AsicDirMask((i + 2) % 4)
                     sendT = self.UpdateTime(finishTime, i, isTx=True)
-                    outList.append((destAsic, fromDir, byteOut, sendT))
+                    outList.append(ProcItem.Acquire(self._itemPool, destAsic, fromDir, byteOut, sendT))
 
                 # if it's not a read or a write, it's a command interrogation
                 else:
@@ -609,7 +1140,8 @@ class QPixAsic:
                     transactionCompleteTime = inTime + inByte.transferTicks * self.tOsc
                     sendT = self.UpdateTime(transactionCompleteTime, i, isTx=True)
                     outList.append(
-                        (
+                        ProcItem.Acquire(
+                            self._itemPool,
                             connection.asic,
                             AsicDirMask((i + 2) % 4),
                             inByte,
@@ -624,76 +1156,39 @@ class QPixAsic:
 
         return outList
 
-    def _GeneratePoissonHits(self, targetTime):
-        """
-        Generate Poisson hits for the time step ##
-        Distribution of inter-arrival times can be modeled by throwing
-        p = Uniform(0,1) and feeding it to -ln(1.0 - p)/aveRate
-        General strategy for moving forward to some timestep is:
-          for each channel:
-            currentTime = now
-            while currentTime < targetTime:
-              generate nextHitTime from distribution above
-              if currentTime + nextHitTime < targetTime:
-                Calculate number of ticks for timestamp and add it to the current queue
-              else:
-                this is last hit for this pixel, add the next time to the alternate queue
-          Sort the overall list by timestamp
-          foreach unique entry in the timestamp list, create a hit with proper parameters,
-          add it to the queue (A or B)
-        """
-        # print(f'Generating Poisson Hits for ({self.row}, {self.col}) at target time {targetTime}')
-        newHits = []
-
-        for ch in range(self.nPixels):
-            currentTime = self.lastAbsHitTime[ch]
-            while currentTime < targetTime:
-
-                # generate a posion distribution of absolute / reletive times
-                p = random.random()  # prints random real between 0 and 1
-                nextAbsHitTime = currentTime + (
-                    -math.log(1.0 - p) / self.randomRate
-                )  # math.log is the natural log
-                nextRelHitTime = int(math.floor(nextAbsHitTime / self.tOsc))
-
-                # if hit happens before target time, add a new hit to the list
-                if nextAbsHitTime < targetTime:
-                    newHits.append([ch, nextRelHitTime])
-                    currentTime = nextAbsHitTime
-                    self.lastAbsHitTime[ch] = currentTime
-                elif nextAbsHitTime > targetTime:
-                    currentTime = targetTime
-                    self.lastAbsHitTime[ch] = targetTime
-
-        if not newHits:
-            return 0
-
-        # sort the new hits by time, group the channels with the same hit time, then add
-        # them into the FIFO
-        newHits.sort(key=lambda x: x[1], reverse=False)
-        prevByte = QPByte(
-            AsicWord.DATA, self.row, self.col, newHits[0][1], [newHits[0][0]]
-        )
+    def _GeneratePoissonHits(self, targetTime, rng=None):
+        """
+        Generate Poisson hits for every channel from its last generated hit time
+        up to targetTime, at randomRate per channel. Inter-arrival times of all
+        channels are drawn at once from the numpy Generator rng, hits on the same
+        clock tick are grouped into one channel mask and injected with InjectHits,
+        where _ReadHits picks them up.
 
-        # check to see if the hit time of the every new hit after the first is
-        # the same as the first hit time, then check with second hit, then third ...
-        for ch, timestamp in newHits[1:]:
-            if timestamp == prevByte.timestamp:
-                prevByte.AddChannel(ch)
-            else:
-                self._localFifo.Write(prevByte)
-                prevByte = QPByte(AsicWord.DATA, self.row, self.col, timestamp, [ch])
+        returns the number of channel hits generated
+        """
+        if rng is None:
+            rng = np.random.default_rng(random.getrandbits(64))
+        rates = np.full(self.nPixels, self.randomRate)
+        channels, times = poisson_hits(rng, rates, self.lastAbsHitTime, targetTime)
+        self.lastAbsHitTime = [max(t, targetTime) for t in self.lastAbsHitTime]
+        if len(times) == 0:
+            return 0
 
-        # write in the last byte
-        self._localFifo.Write(prevByte)
-        return len(newHits)
+        ticks = ((times - self._startTime) / self.tOsc).astype(np.int64) + 1
+        _, hitTimes, masks = group_hits(np.zeros(len(times), dtype=np.int64), ticks, times, channels)
+        self.InjectHits(hitTimes, masks)
+        return len(times)
 
     def InjectHits(self, times, channels=None):
         """
         user function to place all injected times and channels into asic specific
         time and channel arrays
 
-        then sort each according to time
+        times    - hit times, in any order
+        channels - None for the default channels, an integer array of channel
+                   masks, or a list of the channels hit by each hit
+
+        the new hits are sorted and merged into the already sorted remaining hits
         """
         if self._debugLevel > 0:
             print(f"injecting {len(times)} hits for ({self.row}, {self.col})")
@@ -702,32 +1197,55 @@ class QPixAsic:
         if len(times) == 0:
             return
 
-        # place all of the injected times and channels into self._times and self._channels
-        # times = times.round(decimals=14)
-        # for ind, j in enumerate(times):
-        #   if j in self._times:
-        #     times[ind]+=self.tOsc
-        if not isinstance(self._times, list):
-            self._times = list(self._times)
-        self._times.extend(times)
-
-        # include default channels
-        if channels is None:
-            channels = [[1, 3, 8]] * len(times)
-        assert len(channels) == len(
-            times
-        ), "Injected Times and Channels must be same length"
-        if not isinstance(self._channels, list):
-            self._channels = list(self._channels)
-        self._channels.extend(channels)
-
-        # sort the times and channels
-        # zip outputs tuples, so turn times and channels if more hits injected
-        times, channels = zip(*sorted(zip(self._times, self._channels)))
-
-        # construct the channel byte here, once
-        self._channels = np.array([np.sum([0x1 << ch for ch in c]) for c in channels])
-        self._times = np.array(times)
+        # construct the channel masks here, once. times is copied, since the
+        # stored hits are made read only
+        times = np.array(times, dtype=np.float64)
+        masks = channel_masks(channels, len(times))
+        if np.any(times[1:] < times[:-1]):
+            order = np.argsort(times, kind="stable")
+            times, masks = times[order], masks[order]
+
+        # merge into the remaining hits, new hits go after remaining ones at the same time
+        if len(self._times) == 0 or times[0] >= self._times[-1]:
+            self._AppendHits(times, masks)
+        else:
+            insertAt = np.searchsorted(self._times, times, side="right")
+            self._times = np.insert(self._times, insertAt, times)
+            self._channels = np.insert(self._channels, insertAt, masks)
+            self._hitBuffer = None
+
+        # _ReadHits only moves views forward along these, so they're never written
+        self._times.flags.writeable = False
+        self._channels.flags.writeable = False
+        if self._onNextHit is not None:
+            self._onNextHit(self)
+
+    def _AppendHits(self, times, masks):
+        """
+        append sorted hits after the remaining ones. The remaining hits are views
+        of a buffer with room for more hits, which only the new hits are written
+        to. A full buffer is replaced by one twice the size of the remaining and
+        new hits, so appending costs O(k) amortized for k hits.
+        """
+        nLeft, nNew = len(self._times), len(times)
+        buffer = self._hitBuffer
+        # _times may have been set without the buffer, or copied from it
+        if buffer is not None and (getattr(self._times, "base", None) is not buffer[0]
+                                   or getattr(self._channels, "base", None) is not buffer[1]):
+            buffer = None
+        if buffer is None or self._hitEnd + nNew > len(buffer[0]):
+            size = 2 * (nLeft + nNew)
+            newTimes, newMasks = np.empty(size, dtype=np.float64), np.empty(size, dtype=masks.dtype)
+            newTimes[:nLeft] = self._times
+            newMasks[:nLeft] = self._channels
+            buffer, self._hitEnd = (newTimes, newMasks), nLeft
+            self._hitBuffer = buffer
+
+        start, end = self._hitEnd - nLeft, self._hitEnd + nNew
+        buffer[0][self._hitEnd:end] = times
+        buffer[1][self._hitEnd:end] = masks
+        self._times, self._channels = buffer[0][start:end], buffer[1][start:end]
+        self._hitEnd = end
 
     def _ReadHits(self, targetTime):
         """
@@ -741,21 +1259,32 @@ class QPixAsic:
         """
         if len(self._times) > 0 and targetTime > self._times[0]:
 
-            # index times and channels such that they are within last asic hit time and target time
-            TimesIndex = np.less_equal(self._times, targetTime)
-            readTimes = self._times[TimesIndex]
-            readChannels = self._channels[TimesIndex]
+            # times are sorted, so the hits up to target time are the first nRead,
+            # read as views of the injected arrays without copying them
+            nRead = int(np.searchsorted(self._times, targetTime, side="right"))
+            readTimes = self._times[:nRead]
+            readChannels = self._channels[:nRead]
+
+            # timestamps (as CalcTicks) of all read hits at once
+            timeStamps = ((readTimes - self._startTime) / self.tOsc).astype(np.int64) + 1
+
+            # the transfer ticks of a hit are those of its word before the
+            # channel mask is set, see QPByte._TransferTicks
+            fixedBits = (int(self.row) << 16 | int(self.col) << 4 | AsicWord.DATA.value).bit_count()
+            ticks = _TRANSFER_TICKS_ARRAY[_popcount(timeStamps) + fixedBits]
 
             newhitcount = 0
-            for inTime, ch in zip(readTimes, readChannels):
-                prevByte = QPByte(AsicWord.DATA, self.row, self.col, self.CalcTicks(inTime), data=inTime)
+            for inTime, ts, ch, tt in zip(readTimes.tolist(), timeStamps.tolist(), readChannels.tolist(), ticks.tolist()):
+                prevByte = QPByte(AsicWord.DATA, self.row, self.col, ts, data=inTime, transferTicks=tt)
                 prevByte.channelMask = ch
                 self._localFifo.Write(prevByte)
                 newhitcount += 1
 
             # the times and channels we have are everything else that's left
-            self._times = self._times[~TimesIndex]
-            self._channels = self._channels[~TimesIndex]
+            self._times = self._times[nRead:]
+            self._channels = self._channels[nRead:]
+            if self._onNextHit is not None:
+                self._onNextHit(self)
 
             return newhitcount
 
@@ -811,6 +1340,41 @@ class QPixAsic:
             self._changeState(AsicState.Idle)
             return []
 
+    def WakeTime(self):
+        """
+        Returns the time after which a call to Process must be made for this ASIC
+        to do anything other than move forward in time. Process(targetTime) with
+        targetTime <= WakeTime() only updates the time of the ASIC, so those calls
+        can be skipped and replayed later as UpdateTime(targetTime) calls.
+
+        ASICs with something to do return their current time, since Process does
+        nothing for targets in the past. ASICs which will only wait for a received
+        byte return inf.
+        """
+        if self.isDaqNode:
+            return math.inf
+
+        # commands are cleared on the next call
+        if self._command == "Calibrate" or self._command == "Interrogate":
+            return self._absTimeNow
+
+        wake = math.inf
+        if self.config.EnablePush:
+            if len(self._times) > 0:
+                wake = self._times[0]
+        elif self.config.SendRemote and self._remoteFifo._curSize > 0:
+            return self._absTimeNow
+
+        if self.state == AsicState.Idle:
+            pass
+        elif self.state == AsicState.TransmitRemote or self.state == AsicState.TransmitRemoteFull:
+            if self.timeout() or self._remoteFifo._curSize > 0:
+                return self._absTimeNow
+            wake = min(wake, self.timeoutStart + self.config.timeout * self.tOsc)
+        else:
+            return self._absTimeNow
+        return max(wake, self._absTimeNow)
+
     def _processMeasuringState(self, targetTime):
         """
         Function simulates the IDLE state with QpixRoute.vhd. In this case the only
@@ -831,9 +1395,10 @@ class QPixAsic:
         transactionCompleteTime = self._absTimeNow + self.tOsc + respByte.transferTicks
         sendT = self.UpdateTime(transactionCompleteTime, self.config.DirMask.value, isTx=True)
         self._changeState(AsicState.Idle)
-        return [(
+        return [ProcItem.Acquire(
+                self._itemPool,
                 self.connections[self.config.DirMask.value].asic,
-                (self.config.DirMask.value + 2) % 4,
+                AsicDirMask((self.config.DirMask.value + 2) % 4),
                 respByte,
                 sendT,
             )]
@@ -850,7 +1415,8 @@ class QPixAsic:
             transactionCompleteTime = self._absTimeNow + self.tOsc * hit.transferTicks
             i = self.config.DirMask.value
             sendT = self.UpdateTime(transactionCompleteTime, i, isTx=True)
-            localTransfers.append((
+            localTransfers.append(ProcItem.Acquire(
+                    self._itemPool,
                     self.connections[i].asic,
                     AsicDirMask((i + 2) % 4),
                     hit,
@@ -874,7 +1440,8 @@ class QPixAsic:
         # after sending the word we go to the Transmit remote state
         self._changeState(AsicState.TransmitRemote)
 
-        return [(
+        return [ProcItem.Acquire(
+                self._itemPool,
                 self.connections[self.config.DirMask.value].asic,
                 AsicDirMask((self.config.DirMask.value + 2) % 4),
                 finishByte,
@@ -911,7 +1478,8 @@ class QPixAsic:
                 hit = self._remoteFifo.Read()
                 i = self.config.DirMask.value
                 sendT = self.UpdateTime(transactionCompleteTime, i, isTx=True)
-                hitlist.append((
+                hitlist.append(ProcItem.Acquire(
+                        self._itemPool,
                         self.connections[i].asic,
                         AsicDirMask((i + 2) % 4),
                         hit,
@@ -975,6 +1543,27 @@ class QPixAsic:
 
         return transT
 
+    def ReplayTimes(self, times):
+        """
+        same as calling UpdateTime(absTime) for every absTime of times in order,
+        used to catch up the Process calls skipped by the wake engine. Long replays
+        are done with replay_times.
+        """
+        if len(times) > REPLAY_VECTOR_TIMES:
+            self._absTimeNow, self.relTimeNow, ticks, times = replay_times(
+                self._absTimeNow, self.relTimeNow, self.tOsc, times)
+            self.relTicksNow += ticks
+        if isinstance(times, np.ndarray):
+            times = times.tolist()
+        absTimeNow, relTimeNow, relTicksNow, tOsc = self._absTimeNow, self.relTimeNow, self.relTicksNow, self.tOsc
+        for absTime in times:
+            if absTime > absTimeNow:
+                cycles = int((absTime - relTimeNow) / tOsc) + 1
+                absTimeNow = absTime
+                relTimeNow += cycles * tOsc
+                relTicksNow += cycles
+        self._absTimeNow, self.relTimeNow, self.relTicksNow = absTimeNow, relTimeNow, relTicksNow
+
     class AsicConnections():
 
         def __init__(self, tt):
@@ -1153,6 +1742,6 @@ class DaqNode(QPixAsic):
         def Read(self) -> DaqData:
             if self._curSize > 0:
                 self._curSize -= 1
-                return self._data.pop(0)
+                return self._data.popleft()
             else:
                 return None
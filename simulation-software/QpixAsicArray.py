@@ -1,8 +1,17 @@
-from QpixAsic import QPByte, QPixAsic, ProcQueue, DaqNode, AsicWord, AsicState, AsicConfig, AsicDirMask
+from QpixAsic import QPByte, QPixAsic, ProcQueue, LaneProcQueue, DaqNode, AsicWord, AsicState, AsicConfig, AsicDirMask
+from QpixAsic import poisson_hits, group_hits
+from QpixParallel import ParallelEngine
+from QpixTileFile import TileFile
+from QpixProfiler import PhaseProfiler
+from QpixFifoSampler import FifoSampler
 import matplotlib.pyplot as plt
 import random
 import math
 import time
+from time import perf_counter_ns
+import heapq
+import io
+import pickle
 import numpy as np
 
 ## helper functions
@@ -138,35 +147,18 @@ def viewAsicState(qparray, time_begin=-100e-9, time_end=300e-6, ordering="Normal
             dAsics = sorted([a for a in qparray if a.row+a.col == i], reverse=True)
             asics.extend(dAsics)
 
-    # unpack the data into arrays of states and times
-    states = [[] for i in range(len(asics))]
-    relTimes = [[] for i in range(len(asics))]
-    for i, asic in enumerate(asics):
-        for (state, _, relTime) in asic.state_times:
-            states[i].append(state)
-            relTimes[i].append(relTime)
-
     # make the graph 
     fig, ax = plt.subplots(figsize=(15, 0.2*(qparray._ncols * qparray._nrows)))
     ax.set_ylim(0.5, len(asics)+3)
 
-    # repack the data into a viewable format for barh
-    i = 1
-    for asic_states, asic_relTimes in zip(states[:], relTimes[:]):
-        asic_state_widths = []
-        state_colors = []
-        cur_state = asic_states[0]
-        cur_time = asic_relTimes[0]
-        for state, time in zip(asic_states, asic_relTimes):
-            # we've moved to a new state at this time
-            if state != cur_state:
-                asic_state_widths.append((cur_time, time-cur_time))
-                state_colors.append(color_mapping[cur_state])
-                cur_state = state
-                cur_time = time
+    # every recorded transition is a change of state, so each ASIC spends the
+    # time until its next transition in the recorded state
+    for i, asic in enumerate(asics, start=1):
+        states, _, times = asic.state_times.to_arrays()
+        asic_state_widths = np.column_stack((times[:-1], np.diff(times)))
+        state_colors = [f"C{state}" for state in states[:-1].tolist()]
         ax.broken_barh(asic_state_widths, (i, 0.50),
                         facecolors=state_colors)
-        i += 1
 
     ax.grid(True)
     ax.set_yticks([i+1.15 for i in range(len(asics))], labels=[f"({asic.row}, {asic.col})" for asic in asics])
@@ -282,6 +274,70 @@ def PrintTransactMap(qparray, silent=False):
 
 ## end helper functions
 
+class _NodePickler(pickle.Pickler):
+    """
+    pickles every reference to one of nodes, the ASICs and DaqNode of an array,
+    as its index. Pickling the node objects themselves would recurse through
+    their connections across the whole array.
+    """
+    def __init__(self, file, nodes):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self._nodes = {id(node): i for i, node in enumerate(nodes)}
+
+    def persistent_id(self, obj):
+        if isinstance(obj, QPixAsic):
+            return self._nodes[id(obj)]
+        return None
+
+
+class _NodeUnpickler(pickle.Unpickler):
+    """
+    unpickles the node indices of _NodePickler as the nodes
+    """
+    def __init__(self, file, nodes):
+        super().__init__(file)
+        self._nodes = nodes
+
+    def persistent_load(self, pid):
+        return self._nodes[pid]
+
+
+def _observer(event, obj, asic, inner, callbacks):
+    """
+    wrapper of the method inner of obj, asic or one of its FIFOs, which calls
+    the callbacks of event as QpixAsicArray.Subscribe describes
+    """
+    if event == "state":
+        def changeState(newState):
+            oldState = asic.state
+            inner(newState)
+            if asic.state != oldState:
+                for callback in callbacks:
+                    callback(asic, oldState, asic.state)
+        return changeState
+    if event in ("send", "receive", "daq"):
+        def withItem(item):
+            for callback in callbacks:
+                callback(item)
+            return inner(item)
+        return withItem
+    fifo = obj
+    if event == "fifoWrite":
+        def write(data):
+            size = inner(data)
+            for callback in callbacks:
+                callback(asic, fifo, data)
+            return size
+        return write
+    def read():
+        data = inner()
+        if data is not None:
+            for callback in callbacks:
+                callback(asic, fifo, data)
+        return data
+    return read
+
+
 class QpixAsicArray():
     """
     Class purpose is to streamline creation of a digital asic array tile for the
@@ -292,15 +348,34 @@ class QpixAsicArray():
       nPixs=16    - number of channels for each ASIC
       fNominal    - Default clock frequency (default ~50 MHz)
       pctSpread   - std distribution of ASIC clocks (default 5%)
-      deltaT      - stepping interval for the simulation
+      deltaT      - stepping interval for the simulation, or the largest step with
+                    adaptive stepping (None for no limit)
       timeEpsilon - stepping time interval for simulation (default 1e-6)
       debug       - debug level, values >= 0 produce text output (default 0)
       tiledf      - tuple of asic hits to load into the array, tile dataframe is created from radiogenicNB
       RouteState  - string or None type member to define current routing method of Array
       push_state  - enable flag that is sent to ASICs within the array enabling push
+      scheduler   - "heap" (default) single ProcQueue heap of all words, or "lanes" to
+                    keep one FIFO lane per directed link merged by LaneProcQueue
+      engine      - "sweep" (default) processes every ASIC on every step, "wake" only
+                    processes ASICs whose QPixAsic.WakeTime is due, and "parallel"
+                    splits the array into regions simulated by worker processes,
+                    see QpixParallel.ParallelEngine
+      workers     - number of regions and worker processes of the parallel engine
+      stepping    - "fixed" (default) moves Process forward by deltaT when nothing
+                    happens, "adaptive" jumps to the next hit or timeout instead
+      stateRecord - how the ASICs record their state transitions, see StateRecorder:
+                    "full" (default), "ring" for the last stateRingSize, or "off"
+      profile     - time the phases of Process and the ASIC state handlers into the
+                    QpixProfiler.PhaseProfiler profiler (default False)
+      fifoInterval - simulated time between the fifoSamples samples of the FIFO depths
+                     of every ASIC taken by the QpixFifoSampler.FifoSampler
+                     fifoSampler, None (default) for no sampling
     """
     def __init__(self, nrows, ncols, nPixs=16, fNominal=30e6, pctSpread=0.05, deltaT=1e-5, timeEpsilon=1e-6,
-                timeout=1.5e4, hitsPerSec = 20./1., debug=0.0, tiledf=None):
+                timeout=1.5e4, hitsPerSec = 20./1., debug=0.0, tiledf=None, scheduler="heap", engine="sweep",
+                stepping="fixed", workers=None, stateRecord="full", stateRingSize=1024,
+                profile=False, fifoInterval=None, fifoSamples=1024):
 
         # if we have a tiledf to construct an array, then the size is determined by the tile
         if tiledf is not None:
@@ -322,19 +397,64 @@ class QpixAsicArray():
         self.send_remote = False
 
         # the array also manages all of the processing queue times to use
-        self._queue = ProcQueue()
+        assert scheduler in ("heap", "lanes"), f"unknown scheduler {scheduler}"
+        self._queue = LaneProcQueue() if scheduler == "lanes" else ProcQueue()
         self._timeEpsilon = timeEpsilon
+        assert stepping in ("fixed", "adaptive"), f"unknown stepping {stepping}"
+        assert deltaT is not None or stepping == "adaptive", "fixed stepping needs a deltaT"
+        self._adaptive = stepping == "adaptive"
         self._deltaT = deltaT
-        self._deltaTick = self.fNominal * self._deltaT
+        self._deltaTick = self.fNominal * self._deltaT if deltaT is not None else None
 
          # Make the array and connections
-        self._asics = self._makeArray(timeout=timeout, randomRate=hitsPerSec)
+        self._asics = self._makeArray(timeout=timeout, randomRate=hitsPerSec,
+                                      stateRecord=stateRecord, stateRingSize=stateRingSize)
         self._daqNode = DaqNode(fOsc = self.fNominal, nPixels = 0, debugLevel=self._debugLevel, timeout=timeout, randomRate=hitsPerSec)
 
         self._asics[0][0].connections[AsicDirMask.West.value].asic = self._daqNode
 
+        # the nodes emit their items from the free list of the queue, see ProcItem.Acquire
+        for node in [asic for asic in self] + [self._daqNode]:
+            node._itemPool = self._queue._pool
+
         self._alert = 0
 
+        # event driven engine bookkeeping, see _WakeProcessArray
+        assert engine in ("sweep", "wake", "parallel"), f"unknown engine {engine}"
+        assert (workers is not None) == (engine == "parallel"), "workers is only used by the parallel engine"
+        self._wake = engine == "wake"
+        self._asicList = [asic for asic in self]
+        self._workers = workers
+        self._parallel = ParallelEngine(self, workers) if engine == "parallel" else None
+        self._asicIndex = {id(asic): i for i, asic in enumerate(self._asicList)}
+        self._ResetWake()
+        self._wakeDirty = True
+
+        # the wake engine keys pushing ASICs by their next injected hit, which
+        # the ASICs report whenever it changes, see _PushDue
+        for asic in self._asicList:
+            asic._onNextHit = self._UpdateNextHit
+
+        # Poisson background, generated up to _bgTime, see GenerateBackground
+        self._bgTime = 0
+        self._bgRng = None
+
+        # windowed hit source of StreamHits, every hit before _hitHorizon is injected
+        self._hitSource = None
+        self._hitHorizon = math.inf
+
+        # callbacks of every event with subscribers, and the methods they replaced, see Subscribe
+        self._observers = {}
+        self._hooks = {}
+
+        assert not profile or engine in ("sweep", "wake"), "only the sweep and wake engines are profiled"
+        self.profiler = PhaseProfiler(self) if profile else None
+
+        # FIFO depths are sampled every time Process passes _sampleNext
+        assert fifoInterval is None or engine in ("sweep", "wake"), "only the sweep and wake engines are sampled"
+        self.fifoSampler = FifoSampler(self, fifoInterval, fifoSamples) if fifoInterval is not None else None
+        self._sampleNext = self.fifoSampler.times[0] if fifoInterval is not None else math.inf
+
         # load in hits if we're creating an array based on tiledf data
         if tiledf is not None:
             self._InjectHits(tiledf["hits"])
@@ -352,7 +472,7 @@ class QpixAsicArray():
         assert row <= self._nrows - 1, "not enough rows in that array" 
         return self._asics[int(row)]
 
-    def _makeArray(self, timeout, randomRate):
+    def _makeArray(self, timeout, randomRate, stateRecord="full", stateRingSize=1024):
         """
         helper function designed to construct QPix asic values within array type
         """
@@ -361,7 +481,8 @@ class QpixAsicArray():
         for i in range(self._nrows):
             for j in range(self._ncols):
                 frq = random.gauss(self.fNominal,self.fNominal*self.pctSpread)
-                matrix[i].append(QPixAsic(frq, self._nPixs, row=i, col=j, debugLevel=self._debugLevel, timeout=timeout, randomRate=randomRate))
+                matrix[i].append(QPixAsic(frq, self._nPixs, row=i, col=j, debugLevel=self._debugLevel, timeout=timeout,
+                                          randomRate=randomRate, stateRecord=stateRecord, stateRingSize=stateRingSize))
                 
                 if self._debugLevel > 0:
                     print(f"Created ASIC at row {i} col {j} with frq: {frq:.2f}")
@@ -471,6 +592,18 @@ class QpixAsicArray():
         """
 
         # add the initial broadcast to the queue
+        self._Request(command, byte)
+
+        # move the Array forward in time
+        self.Process(timeEnd)
+
+        return self._queue.processed
+
+    def _Request(self, command=None, byte=None):
+        """
+        queue the DaqNode request of _Command at the current time, a broadcast
+        REGREQ with command unless a byte is given
+        """
         if byte is None:
             ReqID = self._daqNode._reqID
             request = QPByte(AsicWord.REGREQ, None, None, timeStamp=self._tickNow, ReqID=ReqID)
@@ -479,11 +612,6 @@ class QpixAsicArray():
             request = byte
         self._queue.AddQueueItem(self[0][0], AsicDirMask(3), request, self._timeNow, command=command)
 
-        # move the Array forward in time
-        self.Process(timeEnd)
-
-        return self._queue.processed
-
     def _ProcessArray(self, nextTime):
         """
         move all processing of the array up to absTime
@@ -498,9 +626,214 @@ class QpixAsicArray():
                     somethingToDo = True
                     for item in newProcessItems:
                         processed += 1
-                        self._queue.AddQueueItem(*item)
+                        self._queue.AddProcItem(item)
         return processed
 
+    def _ResetWake(self):
+        """
+        rebuild the wake heap from every ASIC's WakeTime, and clear the record of
+        skipped sweeps. Needed when ASICs were changed outside of Process, which
+        the array marks with _wakeDirty.
+        """
+        self._wakeDirty = False
+        self._wakeVersion = [0] * len(self._asicList)
+        self._wakeHeap = [(asic.WakeTime(), i, 0) for i, asic in enumerate(self._asicList)]
+        heapq.heapify(self._wakeHeap)
+        # times of the sweeps since every ASIC was last caught up, the first
+        # _sweepCount of the _sweepTimes buffer. Every ASIC has seen the sweeps
+        # before _wakeSweep[i]
+        self._sweepTimes = np.empty(self._SWEEP_BUFFER)
+        self._sweepCount = 0
+        self._wakeSweep = [0] * len(self._asicList)
+        # sweeps recorded for the push steps only apply to the ASICs they step,
+        # _pushStepped[i] is whether ASIC i is still stepped in this Process call
+        self._sweepEvery = np.empty(self._SWEEP_BUFFER, dtype=bool)
+        self._pushStepped = [True] * len(self._asicList)
+
+    def _WakeSchedule(self, asic):
+        """
+        register the next time asic needs to be processed
+        """
+        i = self._asicIndex.get(id(asic))
+        if i is None:
+            return
+        self._wakeVersion[i] += 1
+        heapq.heappush(self._wakeHeap, (asic.WakeTime(), i, self._wakeVersion[i]))
+
+    def _CatchUp(self, asic):
+        """
+        bring asic forward through all of the sweeps it skipped. Skipped sweeps were
+        never due for asic, so they only moved it forward in time. Every one of them
+        added ticks to the ASIC's clock, so they are replayed in order.
+        """
+        i = self._asicIndex.get(id(asic))
+        if i is None:
+            return
+        n = self._sweepCount
+        k = self._wakeSweep[i]
+        if k < n:
+            times = self._sweepTimes[k:n]
+            if not self._pushStepped[i]:
+                times = times[self._sweepEvery[k:n]]
+            asic.ReplayTimes(times)
+            self._wakeSweep[i] = n
+
+    def _CatchUpAll(self):
+        if self._sweepCount == 0:
+            return
+        for asic in self._asicList:
+            self._CatchUp(asic)
+        self._sweepCount = 0
+        self._wakeSweep = [0] * len(self._asicList)
+
+    # initial size of the sweep buffers, see _ResetWake
+    _SWEEP_BUFFER = 1024
+
+    # passes of _WakeProcessArray so far, which orders the words of the regions
+    # of the parallel engine
+    _sweepPass = 0
+
+    def _ReserveSweeps(self, nSweeps):
+        """
+        make room for nSweeps more sweeps in the sweep buffers, first dropping the
+        sweeps every ASIC has already seen, then doubling the buffers if needed
+        """
+        if self._sweepCount + nSweeps <= len(self._sweepTimes):
+            return
+        seen = min(self._wakeSweep, default=self._sweepCount)
+        count = self._sweepCount - seen
+        size = len(self._sweepTimes)
+        while count + nSweeps > size // 2:
+            size *= 2
+        times, every = np.empty(size), np.empty(size, dtype=bool)
+        times[:count] = self._sweepTimes[seen:self._sweepCount]
+        every[:count] = self._sweepEvery[seen:self._sweepCount]
+        self._sweepTimes, self._sweepEvery, self._sweepCount = times, every, count
+        self._wakeSweep = [k - seen for k in self._wakeSweep]
+
+    def _RecordSweep(self, nextTime, seen, every=True):
+        """
+        record a sweep of the array to nextTime, which the ASIC indices in seen
+        have already been processed to. Sweeps which are not for every ASIC only
+        apply to the ASICs of _pushStepped.
+        """
+        self._ReserveSweeps(1)
+        n = self._sweepCount
+        self._sweepTimes[n] = nextTime
+        self._sweepEvery[n] = every
+        self._sweepCount = n = n + 1
+        for i in seen:
+            self._wakeSweep[i] = n
+
+    def _RecordSweeps(self, times):
+        """
+        record sweeps of the array to each of times, which no ASIC was due for
+        """
+        self._ReserveSweeps(len(times))
+        n = self._sweepCount
+        self._sweepTimes[n:n + len(times)] = times
+        self._sweepEvery[n:n + len(times)] = True
+        self._sweepCount = n + len(times)
+
+    def _WakeProcessArray(self, nextTime):
+        """
+        event driven version of _ProcessArray. Only ASICs with a WakeTime before
+        nextTime are processed, in the same array order and passes as _ProcessArray.
+        The sweep is recorded for the others so they can be caught up when needed.
+        """
+        processed = 0
+        somethingToDo = True
+        while somethingToDo:
+            somethingToDo = False
+            self._sweepPass += 1
+
+            # find every ASIC that is due, skipping outdated heap entries
+            due = []
+            while self._wakeHeap and self._wakeHeap[0][0] < nextTime:
+                _, i, version = heapq.heappop(self._wakeHeap)
+                if version == self._wakeVersion[i]:
+                    due.append(i)
+            due.sort()
+
+            for i in due:
+                asic = self._asicList[i]
+                self._CatchUp(asic)
+                newProcessItems = asic.Process(nextTime)
+                self._WakeSchedule(asic)
+                if newProcessItems:
+                    somethingToDo = True
+                    for item in newProcessItems:
+                        processed += 1
+                        self._queue.AddProcItem(item)
+
+        # record the sweep. Only the ASICs processed in the final pass have seen
+        # all of it, the rest would have been moved forward by the later passes
+        self._RecordSweep(nextTime, due)
+        return processed
+
+    def _UpdateNextHit(self, asic):
+        """
+        called by an ASIC whenever its next injected hit time changes, which is its
+        WakeTime in the push state
+        """
+        if self._wake:
+            self._WakeSchedule(asic)
+        elif self._parallel is not None:
+            # the workers of the parallel engine need the new hits
+            self._wakeDirty = True
+
+    def _PushDue(self, targetTime):
+        """
+        returns the ASICs stepped in the push state, in array order, which have
+        something to do at targetTime. The others would only be moved forward in
+        time, which is recorded as a sweep once the step is processed.
+        """
+        due, notStepped = [], []
+        while self._wakeHeap and self._wakeHeap[0][0] < targetTime:
+            entry = heapq.heappop(self._wakeHeap)
+            i, version = entry[1], entry[2]
+            if version == self._wakeVersion[i]:
+                if self._pushStepped[i]:
+                    due.append(i)
+                else:
+                    notStepped.append(entry)
+        # ASICs no longer stepped are still due for the next sweep
+        for entry in notStepped:
+            heapq.heappush(self._wakeHeap, entry)
+        due.sort()
+        return [self._asicList[i] for i in due]
+
+    def _PushNarrow(self):
+        """
+        stop stepping the ASICs without hits left in the push state, as the
+        _procAsics of Process. They are first caught up with the steps so far.
+        """
+        for i, asic in enumerate(self._asicList):
+            if self._pushStepped[i] and len(asic._times) == 0:
+                self._CatchUp(asic)
+                self._pushStepped[i] = False
+
+    def _NextEventTime(self):
+        """
+        earliest QPixAsic.WakeTime of the ASICs the next step will process, the
+        next time any of them has something to do other than moving forward in time
+        """
+        return min((asic.WakeTime() for asic in self._procAsics), default=math.inf)
+
+    def _NextStepTime(self, timeEnd, eventTime=None):
+        """
+        adaptive stepping, the array time of the next step is the earliest of the
+        next event, one deltaT and timeEnd. Steps are processed timeEpsilon before
+        the array time, so the step lands 2*timeEpsilon after the event to be sure
+        it is in the past. eventTime is the next event, by default _NextEventTime.
+        """
+        if eventTime is None:
+            eventTime = self._NextEventTime()
+        nextTime = max(eventTime + 2 * self._timeEpsilon, self._timeNow + self._timeEpsilon)
+        if self._deltaT is not None:
+            nextTime = min(nextTime, self._timeNow + self._deltaT)
+        return min(nextTime, timeEnd)
+
     def Process(self, timeEnd):
         """
         Main logic function to move the all ASICs within the Array forward in
@@ -510,24 +843,61 @@ class QpixAsicArray():
         timeEnd - 'absolute' time to move Array to. If Array is already at this
                    time, this function will do nothing
         """
+        if self._parallel is not None:
+            self._parallel.Process(timeEnd)
+            return
+
+        profiler = self.profiler
+        if profiler is not None:
+            start = perf_counter_ns()
+
         steps = 0
         PROCITEM = 0
         self._procAsics = [asic for asic in self]
+        if self._wake:
+            processArray = self._WakeProcessArray
+            if self._wakeDirty:
+                self._ResetWake()
+            self._CatchUpAll()
+            self._pushStepped = [True] * len(self._asicList)
+        else:
+            processArray = self._ProcessArray
         while(self._timeNow < timeEnd):
 
+            if self._timeNow >= self._hitHorizon:
+                self._PullHits(self._timeNow)
             dT = self._timeNow - self._timeEpsilon
-            for asic in self._procAsics:
+            if dT >= self._sampleNext:
+                self._sampleNext = self.fifoSampler.Sample(dT)
+
+            # the wake engine only processes the pushing ASICs with a hit to read
+            wakePush = self._wake and self.push_state
+            stepAsics = self._PushDue(dT) if wakePush else self._procAsics
+
+            if profiler is not None:
+                t0 = perf_counter_ns()
+            for asic in stepAsics:
+                if self._wake:
+                    self._CatchUp(asic)
                 newProcessItems = asic.Process(dT)
+                if self._wake:
+                    self._WakeSchedule(asic)
                 if newProcessItems:
                     self._alert = 1 # this is not really a problem
                     for item in newProcessItems:
-                        self._queue.AddQueueItem(*item)
+                        self._queue.AddProcItem(item)
+            if wakePush:
+                self._RecordSweep(dT, [self._asicIndex[id(asic)] for asic in stepAsics], every=False)
+            if profiler is not None:
+                profiler.Add("step", t0)
 
             # process transactions
             while(self._queue.Length() > 0):
 
                 if self._debugLevel > 0:
                     print(f"step-{steps} | time-{self._timeNow} | process size-{self._queue.Length()}")
+                    if self._wake:
+                        self._CatchUpAll()
                     for asic in self:
                         print(f"\t({asic.row}, {asic.col}): {asic.state} - {asic.relTicksNow}")
 
@@ -536,23 +906,35 @@ class QpixAsicArray():
                 nextItem = self._queue.PopQueue()
                 asic = nextItem.asic
                 hitTime = nextItem.inTime
+                if hitTime >= self._hitHorizon:
+                    self._PullHits(hitTime)
+                if hitTime - self._timeEpsilon >= self._sampleNext:
+                    self._sampleNext = self.fifoSampler.Sample(hitTime - self._timeEpsilon)
 
-                p1 = self._ProcessArray(hitTime-self._timeEpsilon)
+                p1 = processArray(hitTime-self._timeEpsilon)
 
                 # ASIC to receive data
+                if self._wake:
+                    self._CatchUp(asic)
                 newProcessItems = asic.ReceiveByte(nextItem)
+                if self._wake:
+                    self._WakeSchedule(asic)
                 if newProcessItems:
                     for item in newProcessItems:
-                        self._queue.AddQueueItem(*item)
+                        self._queue.AddProcItem(item)
 
                 # ASICs to catch up to this time, and to send data
-                p1 = self._ProcessArray(hitTime)
+                p1 = processArray(hitTime)
 
                 # Speed up logic! What kinds of ASIC configuration can generate a 
                 # byte transfer via processing only
                 if self._queue._entries == 0:
+                    if profiler is not None:
+                        t0 = perf_counter_ns()
                     if self.push_state == True:
                         self._procAsics = [asic for asic in self if len(asic._times) > 0]
+                        if self._wake:
+                            self._PushNarrow()
                     else:
                         self._procAsics = [asic for asic in self if (
                                     asic.state == AsicState.Finish or
@@ -563,10 +945,29 @@ class QpixAsicArray():
                                         asic.config.SendRemote == True
                                         )))
                                 ] 
-
-            self._timeNow = self[0][0]._absTimeNow if self._timeNow < self[0][0]._absTimeNow else self._timeNow + self._deltaT
+                    if profiler is not None:
+                        profiler.Add("narrow", t0)
+
+            if self._wake:
+                self._CatchUp(self[0][0])
+            if self._timeNow < self[0][0]._absTimeNow:
+                self._timeNow = self[0][0]._absTimeNow
+            elif self._adaptive:
+                # hits of windows not read yet could be the next event
+                nextTime = self._NextStepTime(timeEnd)
+                while nextTime >= self._hitHorizon:
+                    self._PullHits(nextTime)
+                    nextTime = self._NextStepTime(timeEnd)
+                self._timeNow = nextTime
+            else:
+                self._timeNow = self._timeNow + self._deltaT
             self._tickNow = int(self._timeNow * self.fNominal) + 1
 
+        if self._wake:
+            self._CatchUpAll()
+        if profiler is not None:
+            profiler.Add("process", start)
+
         return
 
     def SetPushState(self, enabled=True, transact=False):
@@ -597,6 +998,7 @@ class QpixAsicArray():
         assert isinstance(enabled, bool), "must supply boolean state to enable to ASICs"
 
         self.send_remote = enabled
+        self._wakeDirty = True
 
         for asic in self:
             config = asic.config
@@ -633,6 +1035,7 @@ class QpixAsicArray():
                         if false, will automagically update asic configs
         '''
         self.RouteState = route
+        self._wakeDirty = True
         if timeout is None:
             timeout = self[0][0].config.timeout
         if route == None:
@@ -669,6 +1072,175 @@ class QpixAsicArray():
         else:
             print("WARNING: unknown route state passed!", self.RouteState)
 
+    def GenerateBackground(self, timeEnd, window=1.0, rng=None):
+        """
+        Inject Poisson background hits into every ASIC, at each ASIC's randomRate
+        per pixel, from the end of the last generated background up to timeEnd.
+
+        Each window draws the inter-arrival times of every channel of every ASIC
+        with one call of a numpy Generator. Hits of an ASIC on the same clock tick
+        are grouped into one channel mask, and injected with InjectHits.
+
+        ARGS:
+            timeEnd - time to generate the background up to
+            window  - longest time generated at once, bounds the memory used
+            rng     - optional numpy Generator, by default one is seeded from
+                      np.random on first use
+        """
+        if rng is not None:
+            self._bgRng = rng
+        elif self._bgRng is None:
+            self._bgRng = np.random.default_rng(np.random.randint(2**31))
+
+        asics = self._asicList
+        nPixels = np.array([asic.nPixels for asic in asics])
+        rates = np.repeat([asic.randomRate for asic in asics], nPixels)
+        asicOf = np.repeat(np.arange(len(asics)), nPixels)
+        channelOf = np.concatenate([np.arange(n) for n in nPixels])
+        startTimes = np.array([asic._startTime for asic in asics])
+        tOscs = np.array([asic.tOsc for asic in asics])
+
+        windows = []
+        while self._bgTime < timeEnd:
+            windowEnd = min(self._bgTime + window, timeEnd)
+            streams, times = poisson_hits(self._bgRng, rates, self._bgTime, windowEnd)
+            self._bgTime = windowEnd
+
+            # clock ticks as QPixAsic.CalcTicks, to group hits as the ASIC would
+            owners = asicOf[streams]
+            ticks = ((times - startTimes[owners]) / tOscs[owners]).astype(np.int64) + 1
+            windows.append(group_hits(owners, ticks, times, channelOf[streams]))
+        if not windows:
+            return
+
+        # windows follow each other in time, so a stable sort keeps each ASIC's
+        # hits in order for a single InjectHits call per ASIC
+        owners, times, masks = (np.concatenate(w) for w in zip(*windows))
+        if len(windows) > 1:
+            order = np.argsort(owners, kind="stable")
+            owners, times, masks = owners[order], times[order], masks[order]
+        bounds = np.searchsorted(owners, np.arange(len(asics) + 1))
+        for i in np.flatnonzero(np.diff(bounds)):
+            asics[i].InjectHits(times[bounds[i]:bounds[i + 1]], masks[bounds[i]:bounds[i + 1]])
+
+    def StreamHits(self, source):
+        """
+        Read hits from source one time window at a time, as Process reaches each
+        window, instead of injecting every hit before the run. Only the hits of
+        about one window are held at once, however long the run is.
+
+        source is an iterable of (windowEnd, chunks) windows in time order, see
+        QpixAsic.hit_windows. chunks are (asicX, asicY, times, channels) tuples
+        of every hit before windowEnd not in an earlier window, with channels as
+        for QPixAsic.InjectHits. Windows are read up to the current time straight
+        away. Only the sweep and wake engines read hit sources.
+        """
+        assert self._parallel is None, "only the sweep and wake engines read hit sources"
+        self._hitSource = iter(source)
+        self._hitHorizon = -math.inf
+        self._PullHits(self._timeNow)
+
+    def _PullHits(self, targetTime):
+        """
+        inject the windows of the hit source until every hit up to targetTime is
+        injected
+        """
+        while self._hitHorizon <= targetTime:
+            window = next(self._hitSource, None)
+            if window is None:
+                self._hitSource = None
+                self._hitHorizon = math.inf
+                return
+            windowEnd, chunks = window
+            assert windowEnd > self._hitHorizon, "hit windows out of order"
+            for asicX, asicY, times, channels in chunks:
+                self._asics[asicX][asicY].InjectHits(times, channels)
+            self._hitHorizon = windowEnd
+
+            # pushing ASICs with new hits are stepped again
+            if self.push_state and chunks:
+                self._PushRestep([self._asics[asicX][asicY] for asicX, asicY, _, _ in chunks])
+
+    def _PushRestep(self, asics):
+        """
+        step the pushing asics again, as the ASICs with hits left in _procAsics
+        """
+        stepped = set(id(asic) for asic in self._procAsics)
+        stepped.update(id(asic) for asic in asics)
+        self._procAsics = [asic for asic in self if id(asic) in stepped]
+        if self._wake:
+            for asic in asics:
+                i = self._asicIndex[id(asic)]
+                if not self._pushStepped[i]:
+                    self._CatchUp(asic)
+                    self._pushStepped[i] = True
+
+    # events of Subscribe
+    EVENTS = ("state", "send", "receive", "fifoWrite", "fifoRead", "daq")
+
+    def Subscribe(self, event, callback):
+        """
+        Call callback on every event of the simulation, one of:
+          "state"     - callback(asic, oldState, newState) after every FSM transition
+          "send"      - callback(item) for every word sent, the ProcItem of the
+                        receiving ASIC, before it is queued
+          "receive"   - callback(item) before an ASIC receives the word of item
+          "fifoWrite" - callback(asic, fifo, data) after data is written to the
+                        local or remote FIFO of asic
+          "fifoRead"  - callback(asic, fifo, data) after data is read from a FIFO
+          "daq"       - callback(item) before the DaqNode receives the word of item
+
+        The times of an event are the current times of asic and item.inTime.
+        Items aren't reused while the array has subscribers, so callbacks may
+        keep them.
+
+        The methods behind an event are only wrapped while it has subscribers,
+        so runs without subscribers run the same code as without this API. Only
+        the sweep and wake engines call subscribers.
+        """
+        assert event in self.EVENTS, f"unknown event {event}"
+        assert self._parallel is None, "only the sweep and wake engines call subscribers"
+        if event not in self._observers:
+            self._observers[event] = []
+            self._hooks[event] = []
+            for obj, name, asic in self._HookTargets(event):
+                self._hooks[event].append((obj, name, vars(obj).get(name)))
+                setattr(obj, name, _observer(event, obj, asic, getattr(obj, name), self._observers[event]))
+        self._observers[event].append(callback)
+        self._queue.recycle = False
+
+    def Unsubscribe(self, event, callback):
+        """
+        stop calling callback on event, removing the hooks of the event once it
+        has no subscribers left
+        """
+        callbacks = self._observers[event]
+        callbacks.remove(callback)
+        if not callbacks:
+            del self._observers[event]
+            # put back the profiler's wrappers, or the class methods
+            for obj, name, previous in self._hooks.pop(event):
+                if previous is None:
+                    delattr(obj, name)
+                else:
+                    setattr(obj, name, previous)
+        self._queue.recycle = not self._observers
+
+    def _HookTargets(self, event):
+        """
+        (object, method name, ASIC) of every method wrapped for event
+        """
+        if event == "state":
+            return [(asic, "_changeState", asic) for asic in self._asicList]
+        if event == "send":
+            return [(self._queue, "_AddQueueItem", None)]
+        if event == "receive":
+            return [(asic, "ReceiveByte", asic) for asic in self._asicList]
+        if event == "daq":
+            return [(self._daqNode, "ReceiveByte", self._daqNode)]
+        name = "Write" if event == "fifoWrite" else "Read"
+        return [(fifo, name, asic) for asic in self._asicList for fifo in (asic._localFifo, asic._remoteFifo)]
+
     def _InjectHits(self, dataframeHits):
         """
         InjectHits reads in output from tiledf created in radiogenicNB.ipynb. 
@@ -683,6 +1255,111 @@ class QpixAsicArray():
             times = np.asarray(times)
             self._asics[asicX][asicY].InjectHits(times)
 
+    @classmethod
+    def fromTileFile(cls, path, **kwargs):
+        """
+        Build an array from a binary tile file, see QpixTileFile, with kwargs as
+        for the constructor. The hits of every ASIC are views of the memory
+        mapped file, so building the array only reads the header and offsets.
+        """
+        tile = TileFile(path)
+        array = cls(tile.nrows, tile.ncols, **kwargs)
+        for asic in array:
+            asic._times, asic._channels = tile.hits(asic.row, asic.col)
+            array._UpdateNextHit(asic)
+        return array
+
+    # array members rebuilt by restore instead of being checkpointed
+    _NOT_CHECKPOINTED = ("_asicIndex", "_parallel")
+
+    def _Pickle(self, obj):
+        """
+        pickle obj with every reference to a node of the array as its index, for
+        _Unpickle of a copy of the array
+        """
+        blob = io.BytesIO()
+        _NodePickler(blob, [asic for asic in self] + [self._daqNode]).dump(obj)
+        return blob.getvalue()
+
+    def _Unpickle(self, blob):
+        """
+        unpickle a blob of _Pickle, with the node indices as the nodes of this array
+        """
+        return _NodeUnpickler(io.BytesIO(blob), [asic for asic in self] + [self._daqNode]).load()
+
+    def _DumpNodes(self, nodes):
+        """
+        pickle the state of nodes, some of the ASICs and DaqNode of the array, for
+        _LoadNodes of a copy of the array
+        """
+        allNodes = [asic for asic in self] + [self._daqNode]
+        index = {id(node): i for i, node in enumerate(allNodes)}
+        return self._Pickle(
+            [(index[id(node)], {k: v for k, v in node.__dict__.items() if k not in ("_onNextHit", "_itemPool")})
+             for node in nodes])
+
+    def _LoadNodes(self, blob):
+        """
+        load the node states of _DumpNodes into the same nodes of this array
+        """
+        allNodes = [asic for asic in self] + [self._daqNode]
+        for i, nodeState in self._Unpickle(blob):
+            allNodes[i].__dict__.update(nodeState)
+
+    def checkpoint(self):
+        """
+        Capture the full simulation state of the array as a binary blob: the FSM
+        state, times, FIFOs and remaining injected hits of every ASIC, the links,
+        the ProcQueue, the DaqNode buffer and the engine bookkeeping, along with
+        the random and np.random states. QpixAsicArray.restore builds a new array
+        from the blob, which continues exactly as this array would.
+        """
+        assert self._hitSource is None, "can't checkpoint an array reading a hit source"
+        assert not self._observers, "can't checkpoint an array with subscribers"
+        assert self.profiler is None, "can't checkpoint a profiled array"
+        assert self.fifoSampler is None, "can't checkpoint a sampled array"
+        nodes = self._asicList + [self._daqNode]
+        state = {
+            "array": {k: v for k, v in self.__dict__.items() if k not in self._NOT_CHECKPOINTED},
+            "nodes": [{k: v for k, v in node.__dict__.items() if k != "_onNextHit"} for node in nodes],
+            "random": random.getstate(),
+            "npRandom": np.random.get_state(),
+        }
+        # the node types go first, so that restore can create the nodes to link
+        blob = io.BytesIO()
+        pickle.dump([type(node) for node in nodes], blob, protocol=pickle.HIGHEST_PROTOCOL)
+        _NodePickler(blob, nodes).dump(state)
+        return blob.getvalue()
+
+    @classmethod
+    def restore(cls, blob, rng=True):
+        """
+        Build a new array from a blob of QpixAsicArray.checkpoint. The array is
+        independent of the checkpointed one, so one checkpoint can be restored
+        any number of times to branch a simulation.
+        ARGS:
+            blob - bytes returned by checkpoint
+            rng  - if true (default), also restore the random and np.random states
+        """
+        blob = io.BytesIO(blob)
+        nodes = [nodeType.__new__(nodeType) for nodeType in pickle.load(blob)]
+        state = _NodeUnpickler(blob, nodes).load()
+        for node, nodeState in zip(nodes, state["nodes"]):
+            node.__dict__.update(nodeState)
+            node._onNextHit = None
+
+        array = cls.__new__(cls)
+        array.__dict__.update(state["array"])
+        array._asicIndex = {id(asic): i for i, asic in enumerate(array._asicList)}
+        array._parallel = ParallelEngine(array, array._workers) if array._workers is not None else None
+        for asic in array._asicList:
+            asic._onNextHit = array._UpdateNextHit
+
+        if rng:
+            random.setstate(state["random"])
+            np.random.set_state(state["npRandom"])
+        return array
+
 
 
 if __name__ == "__main__":
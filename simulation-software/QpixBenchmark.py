@@ -0,0 +1,988 @@
+#!/usr/bin/python3
+
+## Micro-benchmarks for the data structures used by the simulation.
+## Run all of them with:
+##   python QpixBenchmark.py
+## or select specific ones by name:
+##   python QpixBenchmark.py procqueue
+
+import sys
+import gc
+import time
+import random
+import math
+import tracemalloc
+from QpixAsic import ProcQueue, ProcItem, QPFifo, QPByte, AsicWord, AsicConfig, AsicDirMask
+from QpixAsic import N_ZER_CLK_G, N_ONE_CLK_G, N_GAP_CLK_G, N_FIN_CLK_G
+from QpixAsic import QPixAsic, pack_words, transfer_ticks
+from QpixAsicArray import QpixAsicArray
+from QpixTrace import TraceExporter
+import numpy as np
+
+
+class _LinkedItem(ProcItem):
+    """
+    ProcItem with the singly linked next pointer used by the original
+    ProcQueue implementation.
+    """
+
+    __slots__ = ("_nextItem",)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._nextItem = None
+
+
+class _LinkedProcQueue:
+    """
+    The original linked list ProcQueue, kept only as a reference point for
+    benchProcQueue.
+    """
+
+    def __init__(self):
+        self._curItem = None
+        self._entries = 0
+        self.processed = 0
+
+    def AddQueueItem(self, asic, dir, QPByte, inTime, command=None):
+        newItem = _LinkedItem(asic, dir, QPByte, inTime, command)
+        curItem = self._curItem
+        self._entries += 1
+
+        if curItem is None:
+            self._curItem = newItem
+        elif curItem > newItem:
+            h = self._curItem
+            self._curItem = newItem
+            self._curItem._nextItem = h
+        else:
+            while newItem > curItem and curItem._nextItem is not None:
+                curItem = curItem._nextItem
+            newItem._nextItem = curItem._nextItem
+            curItem._nextItem = newItem
+
+        return self._entries
+
+    def PopQueue(self):
+        if self._curItem is None:
+            return None
+        self.processed += 1
+        self._entries -= 1
+        data = self._curItem
+        self._curItem = self._curItem._nextItem
+        return data
+
+    def Length(self):
+        return self._entries
+
+
+def _timeQueue(queue, depth, nOps):
+    """
+    fill queue up to depth, then time nOps steady state enqueue / dequeue pairs.
+    The newly added items land in a random position relative to what is stored.
+    returns (ns per enqueue, ns per dequeue)
+    """
+    for _ in range(depth):
+        queue.AddQueueItem(None, None, None, random.random())
+
+    times = [random.random() for _ in range(nOps)]
+    tAdd, tPop = 0, 0
+    for t in times:
+        t0 = time.perf_counter_ns()
+        queue.AddQueueItem(None, None, None, t)
+        t1 = time.perf_counter_ns()
+        item = queue.PopQueue()
+        t2 = time.perf_counter_ns()
+        tAdd += t1 - t0
+        tPop += t2 - t1
+        # keep the queue depth constant with a later item
+        queue.AddQueueItem(None, None, None, item.inTime + random.random())
+    return tAdd / nOps, tPop / nOps
+
+
+def benchProcQueue(depths=(10, 100, 1000, 10000), nOps=2000):
+    """
+    enqueue / dequeue cost of the heap ProcQueue against the original linked
+    list as a function of queue depth.
+    """
+    random.seed(2)
+    print("ProcQueue enqueue/dequeue cost (ns/op) vs. queue depth")
+    print(f"{'depth':>8} | {'list add':>10} {'list pop':>10} | {'heap add':>10} {'heap pop':>10}")
+    for depth in depths:
+        lAdd, lPop = _timeQueue(_LinkedProcQueue(), depth, nOps)
+        hAdd, hPop = _timeQueue(ProcQueue(), depth, nOps)
+        print(f"{depth:>8} | {lAdd:>10.0f} {lPop:>10.0f} | {hAdd:>10.0f} {hPop:>10.0f}")
+
+
+class _ListFifo(QPFifo):
+    """
+    QPFifo backed by the original list storage, where every Read is a
+    list.pop(0). Kept only as a reference point for benchQPFifo.
+    """
+
+    def __init__(self, maxDepth=256):
+        super().__init__(maxDepth)
+        self._data = []
+
+    def Read(self):
+        if self._curSize > 0:
+            self._curSize -= 1
+            return self._data.pop(0)
+        else:
+            return None
+
+
+def _timeFifo(fifo, depth, nOps, word):
+    """
+    fill fifo up to depth, then time nOps steady state Write / Read pairs.
+    returns (Write + Read pairs per second)
+    """
+    for _ in range(depth):
+        fifo.Write(word)
+
+    t0 = time.perf_counter_ns()
+    for _ in range(nOps):
+        fifo.Write(word)
+        fifo.Read()
+    t1 = time.perf_counter_ns()
+    return nOps / (t1 - t0) * 1e9
+
+
+def benchQPFifo(depths=(1, 256, 100000), nOps=20000):
+    """
+    write / read throughput of the deque QPFifo against the original list QPFifo
+    as a function of the number of words stored in the FIFO.
+    """
+    word = QPByte(AsicWord.DATA, 0, 0, timeStamp=1, channelList=[1])
+    print("QPFifo Write+Read throughput (pairs/s) vs. FIFO depth")
+    print(f"{'depth':>8} | {'list':>12} | {'deque':>12}")
+    for depth in depths:
+        lRate = _timeFifo(_ListFifo(), depth, nOps, word)
+        dRate = _timeFifo(QPFifo(), depth, nOps, word)
+        print(f"{depth:>8} | {lRate:>12.3g} | {dRate:>12.3g}")
+
+
+
+class _DictQPByte:
+    """
+    The original dict based QPByte, kept only as a reference point for
+    benchQPByte.
+    """
+
+    def __init__(self, wordType, originRow, originCol, timeStamp=None, channelList=None,
+                 data=None, XDest=None, YDest=None, Dest=False, ReqID=-1, OpRead=False,
+                 OpWrite=False, config=AsicConfig(AsicDirMask.North, 1.5e4)):
+        self.wordType = wordType
+        self.originRow = originRow
+        self.originCol = originCol
+        self.SrcDaq = bool(originCol is None and originRow is None)
+        self.data = data
+        self.timeStamp = timeStamp
+        self.channelMask = None
+
+        if self.wordType == AsicWord.REGREQ:
+            self.Dest = Dest
+            self.OpWrite = OpWrite
+            self.OpRead = OpRead
+            self.XDest = XDest
+            self.YDest = YDest
+            self.ReqID = ReqID
+            self.config = config
+        elif self.wordType == AsicWord.REGRESP:
+            self.config = config
+        else:
+            self.channelMask = 0
+            if channelList is not None:
+                for ch in channelList:
+                    self.channelMask |= 0x1 << ch
+
+        self.transferTicks = self._TransferTicks()
+
+    def _TransferTicks(self):
+        if self.channelMask is None or self.timeStamp is None:
+            return 1700
+        highBits = bin(int(self.channelMask)).count("1")
+        highBits += bin(int(self.timeStamp)).count("1")
+        highBits += bin(int(self.originCol)).count("1")
+        highBits += bin(int(self.originRow)).count("1")
+        highBits += bin(int(self.wordType.value)).count("1")
+        lowBits = 64 - highBits
+        return highBits * N_ONE_CLK_G + lowBits * N_ZER_CLK_G + 63 * N_GAP_CLK_G + N_FIN_CLK_G
+
+
+def _measureWords(cls, nWords):
+    """
+    build nWords DATA words of type cls.
+    returns (bytes per word, words constructed per second)
+    """
+    timeStamps = [random.randrange(2**32) for _ in range(nWords)]
+
+    tracemalloc.start()
+    words = [cls(AsicWord.DATA, 3, 5, timeStamp=t, channelList=[1, 3, 8], data=1e-3) for t in timeStamps]
+    mem, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del words
+
+    # best of a few repeats, without the garbage collector getting in the way
+    best = None
+    gc.disable()
+    for _ in range(3):
+        t0 = time.perf_counter_ns()
+        words = [cls(AsicWord.DATA, 3, 5, timeStamp=t, channelList=[1, 3, 8], data=1e-3) for t in timeStamps]
+        t1 = time.perf_counter_ns()
+        del words
+        best = t1 - t0 if best is None else min(best, t1 - t0)
+    gc.enable()
+    return mem / nWords, nWords / best * 1e9
+
+
+def benchQPByte(nWords=100000):
+    """
+    memory per DATA word and construction rate of the __slots__ QPByte against
+    the original dict based QPByte.
+    """
+    random.seed(2)
+    print(f"QPByte memory and construction rate for {nWords} DATA words")
+    print(f"{'class':>8} | {'bytes/word':>10} | {'words/s':>10}")
+    for name, cls in (("dict", _DictQPByte), ("slots", QPByte)):
+        mem, rate = _measureWords(cls, nWords)
+        print(f"{name:>8} | {mem:>10.0f} | {rate:>10.3g}")
+
+
+
+def benchTransferTicks(nWords=100000):
+    """
+    cost of computing the Endeavor transfer ticks of DATA words, with the
+    original five popcounts per word, the table driven QPByte cost of one
+    popcount per packed word and the vectorized transfer_ticks.
+    """
+    random.seed(2)
+    timeStamps = [random.randrange(2**32) for _ in range(nWords)]
+    masks = [random.randrange(2**16) for _ in range(nWords)]
+    words = []
+    for cls in (_DictQPByte, QPByte):
+        clsWords = [cls(AsicWord.DATA, 3, 5, timeStamp=t) for t in timeStamps]
+        for word, mask in zip(clsWords, masks):
+            word.channelMask = mask
+        words.append(clsWords)
+
+    print(f"Transfer tick cost (ns/word) for {nWords} DATA words")
+    t0 = time.perf_counter_ns()
+    for word in words[0]:
+        word._TransferTicks()
+    t1 = time.perf_counter_ns()
+    for word in words[1]:
+        word._TransferTicks()
+    t2 = time.perf_counter_ns()
+    transfer_ticks(pack_words(AsicWord.DATA, 3, 5, np.array(timeStamps), np.array(masks)))
+    t3 = time.perf_counter_ns()
+    print(f"{'original':>12} | {(t1 - t0) / nWords:>8.1f}")
+    print(f"{'table':>12} | {(t2 - t1) / nWords:>8.1f}")
+    print(f"{'vectorized':>12} | {(t3 - t2) / nWords:>8.1f}")
+
+
+
+def _interrogateTile(nrows=10, ncols=14, nHits=20, nInt=4, int_prd=0.05, **kwargs):
+    """
+    seeded snake routed interrogation of a tile, with nHits random hits per ASIC
+    """
+    random.seed(2)
+    np.random.seed(2)
+    tile = QpixAsicArray(nrows, ncols, **kwargs)
+    tile.Route("snake", transact=False)
+    for asic in tile:
+        asic.InjectHits(np.sort(np.random.uniform(1e-9, nInt * int_prd, nHits)))
+    for _ in range(nInt):
+        tile.Interrogate(int_prd)
+    return tile
+
+
+def benchProcItemAlloc():
+    """
+    ProcItem allocations and traced memory of a 10x14 snake route interrogation,
+    with and without recycling ProcItems through the free list.
+    """
+    init, release = ProcItem.__init__, ProcItem.Release
+    created = [0]
+
+    def countingInit(self, *args, **kwargs):
+        created[0] += 1
+        init(self, *args, **kwargs)
+
+    def noRelease(self):
+        pass
+
+    print("ProcItem allocations for a 10x14 snake interrogation")
+    print(f"{'mode':>10} | {'items':>8} | {'allocated':>10} | {'peak MB':>8} | {'time s':>8}")
+    ProcItem.__init__ = countingInit
+    try:
+        for mode in ("no reuse", "free list"):
+            ProcItem.Release = noRelease if mode == "no reuse" else release
+            created[0] = 0
+            tracemalloc.start()
+            t0 = time.perf_counter()
+            tile = _interrogateTile()
+            t1 = time.perf_counter()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"{mode:>10} | {tile._queue.processed:>8} | {created[0]:>10} | {peak / 1e6:>8.2f} | {t1 - t0:>8.2f}")
+    finally:
+        ProcItem.__init__, ProcItem.Release = init, release
+
+
+
+def benchWakeEngine(sizes=((10, 14), (16, 16), (24, 24))):
+    """
+    wall time of snake interrogations with the sweep engine, which processes every
+    ASIC on every step, against the event driven wake engine.
+    """
+    print("QpixAsicArray.Process wall time (s) of a snake interrogation")
+    print(f"{'array':>8} | {'items':>8} | {'sweep':>8} | {'wake':>8}")
+    for nrows, ncols in sizes:
+        times = []
+        for engine in ("sweep", "wake"):
+            t0 = time.perf_counter()
+            tile = _interrogateTile(nrows, ncols, nHits=5, nInt=2, engine=engine)
+            times.append(time.perf_counter() - t0)
+        print(f"{nrows:>3}x{ncols:<4} | {tile._queue.processed:>8} | {times[0]:>8.2f} | {times[1]:>8.2f}")
+
+
+def benchCheckpoint(prefixes=(1, 4, 16)):
+    """
+    wall time of branching a 10x14 interrogation after a prefix of interrogations,
+    by replaying the prefix against restoring a checkpoint taken after it.
+    """
+    print("10x14 tile, wall time (s) of a branch point and checkpoint size")
+    print(f"{'prefix':>6} | {'replay':>8} | {'checkpoint':>10} | {'restore':>8} | {'MB':>6}")
+    for prefix in prefixes:
+        t0 = time.perf_counter()
+        tile = _interrogateTile(10, 14, nHits=20, nInt=prefix)
+        t1 = time.perf_counter()
+        blob = tile.checkpoint()
+        t2 = time.perf_counter()
+        QpixAsicArray.restore(blob)
+        t3 = time.perf_counter()
+        print(f"{prefix:>6} | {t1 - t0:>8.3f} | {t2 - t1:>10.3f} | {t3 - t2:>8.3f} | {len(blob) / 1e6:>6.2f}")
+
+
+def benchForkSweep(nPoints=16, ncpu=4, nHits=500):
+    """
+    startup time per sweep point of QpixMPAnalysis, reading the tiledf JSON and
+    building the 10x14 tile in every point as runTile does, against forking every
+    point from one tile built before the sweep with forkSweep.
+    """
+    import json
+    import os
+    import tempfile
+    from functools import partial
+    import QpixMPAnalysis
+
+    random.seed(2)
+    np.random.seed(2)
+    tiledf = {"nrows": 10, "ncols": 14,
+              "hits": [(i, j, np.sort(np.random.uniform(0, 10, nHits)).tolist())
+                       for i in range(10) for j in range(14)]}
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+        json.dump(tiledf, f)
+    try:
+        t0 = time.perf_counter()
+        for _ in range(nPoints):
+            tile = QpixMPAnalysis._readTile(f.name, deltaT=20e-6)
+        build = (time.perf_counter() - t0) / nPoints
+
+        def routed(tile):
+            tile.Route("snake", transact=False)
+            return tile.RouteState
+        _, startups = QpixMPAnalysis.forkSweep(partial(routed, tile), [()] * nPoints, ncpu)
+        fork = sum(startups) / len(startups)
+    finally:
+        os.remove(f.name)
+
+    print(f"sweep point startup of a 10x14 tile with {nHits} hits per ASIC")
+    print(f"{'rebuild (s)':>12} | {'fork (s)':>10} | {'saving (s)':>10}")
+    print(f"{build:>12.4f} | {fork:>10.4f} | {build - fork:>10.4f}")
+
+
+def benchDetector(nTiles=(8, 32, 128), ncpu=4, nHits=20):
+    """
+    QpixMPAnalysis.runDetector over more and more 10x14 tiles, with nHits random
+    hits per ASIC. The largest resident size of the parent and of any worker
+    should not grow with the number of tiles.
+    """
+    import resource
+    from functools import partial
+    import QpixMPAnalysis
+
+    print(f"runDetector of 10x14 tiles with {nHits} hits per ASIC, {ncpu} workers")
+    print(f"{'tiles':>6} | {'time s':>8} | {'parent MB':>9} | {'worker MB':>9}")
+    run = partial(QpixMPAnalysis.pullRun, r="left", t=15e3, periods=(0.5, 5), int_time=1)
+    for n in nTiles:
+        np.random.seed(2)
+        catalog = [{"tileN": i, "tileX": i % 12, "tileY": i // 12, "nrows": 10, "ncols": 14,
+                    "hits": [(r, c, np.sort(np.random.uniform(0, 1, nHits)).tolist())
+                             for r in range(10) for c in range(14)]} for i in range(n)]
+        t0 = time.perf_counter()
+        QpixMPAnalysis.runDetector(catalog, run, ncpu=ncpu, int_time=1)
+        t1 = time.perf_counter()
+        parent = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+        worker = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1e3
+        print(f"{n:>6} | {t1 - t0:>8.2f} | {parent:>9.1f} | {worker:>9.1f}")
+
+
+def benchTileFile(nHits=(500, 5000), nLoads=5):
+    """
+    time to build the 10x14 tile of QpixMPAnalysis from its tiledf json, as
+    runTile and pushTile did, against memory mapping the same tile converted
+    into a binary tile file
+    """
+    import os
+    import json
+    import tempfile
+    import QpixMPAnalysis
+    import QpixTileFile
+
+    print(f"10x14 tile build time (s), {nLoads} builds")
+    print(f"{'hits/asic':>9} | {'json MB':>7} | {'tile MB':>7} | {'json':>8} | {'mmap':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        jsonPath, tilePath = os.path.join(tmp, "tile.json"), os.path.join(tmp, "tile.qpt")
+        for n in nHits:
+            np.random.seed(2)
+            tiledf = {"nrows": 10, "ncols": 14,
+                      "hits": [(i, j, np.sort(np.random.uniform(0, 10, n)).tolist())
+                               for i in range(10) for j in range(14)]}
+            with open(jsonPath, "w") as f:
+                json.dump(tiledf, f)
+            QpixTileFile.convert_tiledf(jsonPath, tilePath)
+
+            t0 = time.perf_counter()
+            for _ in range(nLoads):
+                QpixMPAnalysis._readTile(jsonPath, deltaT=20e-6)
+            t1 = time.perf_counter()
+            for _ in range(nLoads):
+                QpixMPAnalysis._readTile(tilePath, deltaT=20e-6)
+            t2 = time.perf_counter()
+            print(f"{n:>9} | {os.path.getsize(jsonPath) / 1e6:>7.2f} | {os.path.getsize(tilePath) / 1e6:>7.2f} | "
+                  f"{(t1 - t0) / nLoads:>8.4f} | {(t2 - t1) / nLoads:>8.4f}")
+
+
+def benchParallel(nrows=32, ncols=32, workers=(1, 2, 4, 8, 16), nInt=8):
+    """
+    strong scaling of the parallel engine, wall time of the same nInt snake
+    interrogations of one tile split into more and more regions, against the
+    serial wake engine. The workers are forked by the first interrogation and
+    kept for the others. The cpu time of the parent and its workers shows the
+    work the regions add over the serial engine. The DAQ output must be the same for every run.
+    """
+    import os
+
+    def cpuTime():
+        t = os.times()
+        return t.user + t.system + t.children_user + t.children_system
+
+    t0, c0 = time.perf_counter(), cpuTime()
+    serial = _interrogateTile(nrows, ncols, nHits=5, nInt=nInt, engine="wake")
+    tSerial, cSerial = time.perf_counter() - t0, cpuTime() - c0
+    daq = [(d.daqT, d.row, d.col) for d in serial._daqNode._localFifo._data]
+
+    print(f"parallel engine strong scaling, {nrows}x{ncols} snake, {nInt} interrogations, "
+          f"{serial._queue.processed} items, {os.cpu_count()} cpus")
+    print(f"{'workers':>8} | {'grid':>6} | {'time s':>8} | {'cpu s':>8} | {'speedup':>8}")
+    print(f"{'serial':>8} | {'':>6} | {tSerial:>8.2f} | {cSerial:>8.2f} | {1:>8.2f}")
+    for n in workers:
+        t0, c0 = time.perf_counter(), cpuTime()
+        tile = _interrogateTile(nrows, ncols, nHits=5, nInt=nInt, engine="parallel", workers=n)
+        t = time.perf_counter() - t0
+        # the cpu time of the workers is only counted once they are joined
+        tile._parallel.Close()
+        c = cpuTime() - c0
+        assert [(d.daqT, d.row, d.col) for d in tile._daqNode._localFifo._data] == daq, "different DAQ output"
+        grid = "x".join(str(g) for g in tile._parallel.grid)
+        print(f"{n:>8} | {grid:>6} | {t:>8.2f} | {c:>8.2f} | {tSerial / t:>8.2f}")
+
+
+def _pushTile(nrows, ncols, nHits, endTime=0.1, **kwargs):
+    """
+    seeded snake routed tile stepped forward in the push state like
+    QpixMPAnalysis.pushTile, with nHits random hits per ASIC
+    """
+    random.seed(2)
+    np.random.seed(2)
+    tile = QpixAsicArray(nrows, ncols, deltaT=20e-6, **kwargs)
+    tile.Route("snake", transact=False)
+    for asic in tile:
+        asic.InjectHits(np.sort(np.random.uniform(1e-9, endTime, nHits)))
+    tile.SetPushState(enabled=True, transact=False)
+    curT = 0
+    while curT < endTime:
+        curT += tile._deltaT
+        tile.Process(curT)
+    return tile
+
+
+def benchPushStep(sizes=((10, 14), (24, 24)), hits=(1, 4)):
+    """
+    wall time of push state tiles stepped every 20 us for 0.1 s. The sweep engine
+    processes every ASIC with hits left on every step, the wake engine only the
+    ASICs with matured hits.
+    """
+    print("push state wall time (s), 5000 steps of 20 us")
+    print(f"{'array':>8} | {'hits':>5} | {'items':>8} | {'sweep':>8} | {'wake':>8}")
+    for nrows, ncols in sizes:
+        for nHits in hits:
+            times, outputs = [], []
+            for engine in ("sweep", "wake"):
+                t0 = time.perf_counter()
+                tile = _pushTile(nrows, ncols, nHits, engine=engine)
+                times.append(time.perf_counter() - t0)
+                outputs.append([(d.daqT, d.row, d.col) for d in tile._daqNode._localFifo._data])
+            assert outputs[0] == outputs[1], "engines produced different DAQ output"
+            print(f"{nrows:>3}x{ncols:<4} | {nHits:>5} | {tile._queue.processed:>8} | "
+                  f"{times[0]:>8.2f} | {times[1]:>8.2f}")
+
+
+def benchAdaptiveStep(endTime=1.0, nHits=10):
+    """
+    wall time of the QpixMPAnalysis.pushTile scenario, a 10x14 pushing tile with
+    deltaT=20e-6, on seeded uniform hits. Fixed stepping processes the array
+    every deltaT, adaptive stepping jumps to the next hit or timeout, either
+    capped at deltaT or not.
+    """
+    print(f"pushTile scenario wall time (s), 10x14 tile, {nHits} hits per ASIC over {endTime} s")
+    print(f"{'engine':>6} | {'stepping':>8} | {'daq words':>9} | {'time s':>8}")
+    for engine in ("sweep", "wake"):
+        for stepping, deltaT in (("fixed", 20e-6), ("capped", 20e-6), ("adaptive", None)):
+            random.seed(2)
+            np.random.seed(2)
+            tile = QpixAsicArray(10, 14, deltaT=deltaT, engine=engine,
+                                 stepping="fixed" if stepping == "fixed" else "adaptive")
+            tile.Route("snake", transact=False)
+            for asic in tile:
+                asic.InjectHits(np.sort(np.random.uniform(1e-9, endTime, nHits)))
+            tile.SetPushState(enabled=True, transact=False)
+            t0 = time.perf_counter()
+            if stepping == "fixed":
+                curT = 0
+                while curT < endTime:
+                    curT += tile._deltaT
+                    tile.Process(curT)
+            else:
+                tile.IdleFor(endTime)
+            t1 = time.perf_counter()
+            print(f"{engine:>6} | {stepping:>8} | {len(tile._daqNode._localFifo._data):>9} | {t1 - t0:>8.2f}")
+
+
+class _MaskReadAsic(QPixAsic):
+    """
+    QPixAsic with the original _ReadHits, which masks and copies every
+    remaining hit on each read. Kept only as a reference point for benchReadHits.
+    """
+
+    def _ReadHits(self, targetTime):
+        if len(self._times) > 0 and targetTime > self._times[0]:
+            TimesIndex = np.less_equal(self._times, targetTime)
+            readTimes = self._times[TimesIndex]
+            readChannels = self._channels[TimesIndex]
+            timeStamps = ((readTimes - self._startTime) / self.tOsc).astype(np.int64) + 1
+            ticks = transfer_ticks(pack_words(AsicWord.DATA, self.row, self.col, timeStamps, 0))
+            newhitcount = 0
+            for inTime, ts, ch, tt in zip(readTimes.tolist(), timeStamps.tolist(), readChannels.tolist(), ticks.tolist()):
+                prevByte = QPByte(AsicWord.DATA, self.row, self.col, ts, data=inTime, transferTicks=tt)
+                prevByte.channelMask = ch
+                self._localFifo.Write(prevByte)
+                newhitcount += 1
+            self._times = self._times[~TimesIndex]
+            self._channels = self._channels[~TimesIndex]
+            return newhitcount
+        return 0
+
+
+def benchReadHits(nHits=(1000, 10000, 100000), nReads=10000, endTime=10.0):
+    """
+    time spent in _ReadHits reading nHits uniform hits over endTime in nReads
+    evenly spaced reads, masking every remaining hit against a searchsorted cursor.
+    """
+    print(f"_ReadHits time (s) for {nReads} reads over {endTime} s")
+    print(f"{'hits':>8} | {'mask':>8} | {'cursor':>8}")
+    readTimes = np.linspace(0, endTime, nReads + 1)[1:].tolist()
+    for n in nHits:
+        hits = np.sort(np.random.default_rng(2).uniform(0, endTime, n))
+        times = []
+        for asicType in (_MaskReadAsic, QPixAsic):
+            asic = asicType(row=0, col=0)
+            asic.InjectHits(hits)
+            t0 = time.perf_counter()
+            for t in readTimes:
+                asic._ReadHits(t)
+            times.append(time.perf_counter() - t0)
+            assert asic._localFifo._totalWrites == n
+        print(f"{n:>8} | {times[0]:>8.3f} | {times[1]:>8.3f}")
+
+
+class _ZipSortAsic(QPixAsic):
+    """
+    QPixAsic with the original InjectHits, which sorts zipped python lists and
+    builds every channel mask in python. Kept only as a reference point for
+    benchInjectHits.
+    """
+
+    def InjectHits(self, times, channels=None):
+        if not isinstance(self._times, list):
+            self._times = list(self._times)
+        self._times.extend(times)
+        if channels is None:
+            channels = [[1, 3, 8]] * len(times)
+        if not isinstance(self._channels, list):
+            self._channels = list(self._channels)
+        self._channels.extend(channels)
+        times, channels = zip(*sorted(zip(self._times, self._channels)))
+        self._channels = np.array([np.sum([0x1 << ch for ch in c]) for c in channels])
+        self._times = np.array(times)
+
+
+def benchInjectHits(nHits=(1000, 10000, 100000), chunk=1000):
+    """
+    time to inject nHits uniform hits with ragged channel lists in a single call,
+    and for the merged injection to stream them in as shuffled chunks, or as
+    sorted chunks appended after the remaining hits. The
+    original InjectHits can't inject twice, since it reads its own masks back
+    as channel lists.
+    """
+    print(f"InjectHits time (s), chunks of {chunk} hits")
+    print(f"{'hits':>8} | {'zip sort':>8} | {'merge':>8} | {'chunked':>8} | {'appended':>8}")
+    rng = np.random.default_rng(2)
+    for n in nHits:
+        hits = rng.uniform(0, 10, n)
+        channels = [list(rng.choice(16, 3, replace=False)) for _ in range(n)]
+        times = []
+        for asicType in (_ZipSortAsic, QPixAsic):
+            asic = asicType(row=0, col=0)
+            t0 = time.perf_counter()
+            asic.InjectHits(hits, channels)
+            times.append(time.perf_counter() - t0)
+        single = asic
+
+        asic = QPixAsic(row=0, col=0)
+        t0 = time.perf_counter()
+        for i in range(0, n, chunk):
+            asic.InjectHits(hits[i:i + chunk], channels[i:i + chunk])
+        times.append(time.perf_counter() - t0)
+        assert np.array_equal(np.sort(single._times), asic._times)
+
+        order = np.argsort(hits, kind="stable")
+        sortedHits, sortedChannels = hits[order], [channels[i] for i in order]
+        asic = QPixAsic(row=0, col=0)
+        t0 = time.perf_counter()
+        for i in range(0, n, chunk):
+            asic.InjectHits(sortedHits[i:i + chunk], sortedChannels[i:i + chunk])
+        times.append(time.perf_counter() - t0)
+        assert np.array_equal(single._times, asic._times)
+        print(f"{n:>8} | {times[0]:>8.3f} | {times[1]:>8.3f} | {times[2]:>8.3f} | {times[3]:>8.3f}")
+
+
+def _loopPoissonTimes(asic, targetTime):
+    """
+    the python loop of the original QPixAsic._GeneratePoissonHits, one
+    random.random() per hit per channel, kept only as a reference point for
+    benchBackground. Returns the number of hits drawn.
+    """
+    nHits = 0
+    for ch in range(asic.nPixels):
+        currentTime = asic.lastAbsHitTime[ch]
+        while currentTime < targetTime:
+            p = random.random()
+            nextAbsHitTime = currentTime + (-math.log(1.0 - p) / asic.randomRate)
+            if nextAbsHitTime < targetTime:
+                nHits += 1
+                currentTime = nextAbsHitTime
+            else:
+                currentTime = targetTime
+        asic.lastAbsHitTime[ch] = targetTime
+    return nHits
+
+
+def benchBackground(nrows=100, ncols=100, windows=(0.1, 1.0)):
+    """
+    time to generate a 20 Hz per pixel Poisson background on a 100x100 array,
+    with the python loop of the original generator against
+    QpixAsicArray.GenerateBackground
+    """
+    random.seed(2)
+    np.random.seed(2)
+    tile = QpixAsicArray(nrows, ncols, hitsPerSec=20.)
+    print(f"20 Hz/pixel background on a {nrows}x{ncols} array, time (s)")
+    print(f"{'window s':>8} | {'loop':>8} | {'numpy':>8} | {'hits':>9}")
+    for window in windows:
+        t0 = time.perf_counter()
+        for asic in tile:
+            asic.lastAbsHitTime = [tile._bgTime] * asic.nPixels
+            _loopPoissonTimes(asic, tile._bgTime + window)
+        t1 = time.perf_counter()
+        nBefore = sum(len(asic._times) for asic in tile)
+        tile.GenerateBackground(tile._bgTime + window)
+        t2 = time.perf_counter()
+        nHits = sum(len(asic._times) for asic in tile) - nBefore
+        print(f"{window:>8} | {t1 - t0:>8.2f} | {t2 - t1:>8.2f} | {nHits:>9}")
+
+
+def _uniformWindows(rng, nrows, ncols, rate, window, timeEnd):
+    """
+    hit source of uniform hits at rate per ASIC, drawn one window at a time
+    """
+    windowEnd = window
+    while windowEnd - window < timeEnd:
+        chunks = []
+        for i in range(nrows):
+            for j in range(ncols):
+                chunks.append((i, j, np.sort(rng.uniform(windowEnd - window, windowEnd, rng.poisson(rate * window))), None))
+        yield windowEnd, chunks
+        windowEnd += window
+
+
+def _heldHits(tile):
+    """
+    bytes of the hit arrays held by the ASICs of tile, read views included
+    """
+    held = 0
+    for asic in tile:
+        for a in (asic._times, asic._channels):
+            if isinstance(a, np.ndarray):
+                held += (a.base if a.base is not None else a).nbytes
+    return held
+
+
+def benchStreamHits(nrows=4, ncols=4, rate=1000., durations=(1, 4), window=0.1, interval=0.1):
+    """
+    largest memory held by the injected hit arrays of a pull run, injecting every
+    hit before the run against QpixAsicArray.StreamHits of window long windows,
+    for longer and longer runs
+    """
+    print(f"{nrows}x{ncols} array, {rate:.0f} hits/s per ASIC, {interval} s interrogations")
+    print(f"{'run s':>6} | {'inject MB':>9} | {'stream MB':>9} | {'inject s':>8} | {'stream s':>8}")
+    for duration in durations:
+        held, times = [], []
+        for stream in (False, True):
+            random.seed(2)
+            source = _uniformWindows(np.random.default_rng(2), nrows, ncols, rate, window, duration)
+            t0 = time.perf_counter()
+            tile = QpixAsicArray(nrows, ncols, deltaT=1e-4, engine="wake", stepping="adaptive")
+            if stream:
+                tile.StreamHits(source)
+            else:
+                for windowEnd, chunks in source:
+                    for asicX, asicY, hitTimes, channels in chunks:
+                        tile[asicX][asicY].InjectHits(hitTimes, channels)
+            tile.Route("left", transact=False)
+            maxHeld = _heldHits(tile)
+            for _ in range(int(round(duration / interval))):
+                tile.Interrogate(interval)
+                maxHeld = max(maxHeld, _heldHits(tile))
+            times.append(time.perf_counter() - t0)
+            held.append(maxHeld / 1e6)
+        print(f"{duration:>6} | {held[0]:>9.3f} | {held[1]:>9.3f} | {times[0]:>8.2f} | {times[1]:>8.2f}")
+
+
+def benchStateRecord(endTime=1.0, nHits=200):
+    """
+    memory of the recorded state transitions of a 10x14 pushing tile, and its
+    wall time, for every StateRecorder mode. The list of tuples column is the
+    size of the same transitions kept as the (AsicState, relTime, absTime)
+    tuples state_times used to hold.
+    """
+    from QpixAsic import AsicState
+    print(f"10x14 push tile, {nHits} hits per ASIC over {endTime} s")
+    print(f"{'record':>6} | {'transitions':>11} | {'record MB':>9} | {'tuples MB':>9} | {'time s':>8}")
+    for mode in ("full", "ring", "off"):
+        random.seed(2)
+        np.random.seed(2)
+        tile = QpixAsicArray(10, 14, deltaT=20e-6, engine="wake", stepping="adaptive", stateRecord=mode)
+        tile.Route("snake", transact=False)
+        for asic in tile:
+            asic.InjectHits(np.sort(np.random.uniform(1e-9, endTime, nHits)))
+        tile.SetPushState(enabled=True, transact=False)
+        t0 = time.perf_counter()
+        tile.IdleFor(endTime)
+        t1 = time.perf_counter()
+
+        records = [asic.state_times for asic in tile]
+        nBytes = sum(r._states.nbytes + r._relTimes.nbytes + r._absTimes.nbytes for r in records)
+        tracemalloc.start()
+        tuples = [list(zip([AsicState(s) for s in states.tolist()], relTimes.tolist(), absTimes.tolist()))
+                  for states, relTimes, absTimes in (r.to_arrays() for r in records)]
+        tupleBytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del tuples
+        print(f"{mode:>6} | {sum(len(r) for r in records):>11} | {nBytes / 1e6:>9.3f} | "
+              f"{tupleBytes / 1e6:>9.3f} | {t1 - t0:>8.2f}")
+
+
+def benchObservers(nrows=10, ncols=10, nHits=100, repeats=7):
+    """
+    wall time of the same interrogated tile never subscribed to, subscribed to
+    every event and unsubscribed again before the run, and with a subscriber on
+    every event, the median of repeats interleaved runs
+    """
+    def noop(*args):
+        pass
+
+    def run(mode):
+        random.seed(2)
+        np.random.seed(2)
+        tile = QpixAsicArray(nrows, ncols, deltaT=1e-5, engine="wake")
+        tile.Route("left", timeout=1.5e6, transact=False)
+        for asic in tile:
+            asic.InjectHits(np.sort(np.random.uniform(1e-9, 0.2, nHits)))
+        if mode != "never":
+            for event in QpixAsicArray.EVENTS:
+                tile.Subscribe(event, noop)
+        if mode == "removed":
+            for event in QpixAsicArray.EVENTS:
+                tile.Unsubscribe(event, noop)
+        t0 = time.perf_counter()
+        for _ in range(4):
+            tile.Interrogate(0.05)
+        return time.perf_counter() - t0
+
+    modes = ("never", "removed", "noop")
+    times = {mode: [] for mode in modes}
+    for _ in range(repeats):
+        for mode in modes:
+            times[mode].append(run(mode))
+    print(f"{nrows}x{ncols} tile, 4 left interrogations, median of {repeats} (s)")
+    print(" | ".join(f"{mode:>8}" for mode in modes))
+    print(" | ".join(f"{np.median(times[mode]):>8.3f}" for mode in modes))
+    print(" | ".join(f"{np.std(times[mode]):>8.3f}" for mode in modes) + "  (std)")
+
+
+def benchProfile(nrows=10, ncols=10, nHits=100):
+    """
+    phase breakdown of the profiler of a 10x10 tile with 4 left interrogations,
+    and the wall time of the same run without the profiler
+    """
+    times = []
+    for profile in (False, True):
+        random.seed(2)
+        np.random.seed(2)
+        tile = QpixAsicArray(nrows, ncols, deltaT=1e-5, engine="wake", profile=profile)
+        tile.Route("left", timeout=1.5e6, transact=False)
+        for asic in tile:
+            asic.InjectHits(np.sort(np.random.uniform(1e-9, 0.2, nHits)))
+        t0 = time.perf_counter()
+        for _ in range(4):
+            tile.Interrogate(0.05)
+        times.append(time.perf_counter() - t0)
+
+    print(f"{nrows}x{ncols} tile, 4 left interrogations, {times[0]:.3f} s unprofiled, {times[1]:.3f} s profiled")
+    print(f"{'name':>20} | {'kind':>5} | {'calls':>8} | {'time s':>8} | {'share':>6}")
+    stats = tile.profiler.to_dict()
+    total = stats["process"]["ns"]
+    for name, stat in stats.items():
+        print(f"{name:>20} | {stat['kind']:>5} | {stat['calls']:>8} | {stat['ns'] / 1e9:>8.3f} | "
+              f"{stat['ns'] / total:>6.1%}")
+
+
+def benchTrace(sizes=((10, 10), (16, 16)), nHits=100, bufferSize=4096):
+    """
+    wall time, peak traced memory and trace file size of 4 left interrogations
+    of tiles streamed to a Chrome trace, against the same runs untraced
+    """
+    import os
+    import tempfile
+    path = os.path.join(tempfile.mkdtemp(), "trace.json")
+    print(f"{'tile':>7} | {'untraced s':>10} | {'traced s':>8} | {'peak MB':>7} | {'events':>8} | {'file MB':>7}")
+    for nrows, ncols in sizes:
+        times, peaks = [], []
+        for trace in (False, True):
+            random.seed(2)
+            np.random.seed(2)
+            tile = QpixAsicArray(nrows, ncols, deltaT=1e-5, engine="wake")
+            tile.Route("left", timeout=1.5e6, transact=False)
+            for asic in tile:
+                asic.InjectHits(np.sort(np.random.uniform(1e-9, 0.2, nHits)))
+            tracemalloc.start()
+            t0 = time.perf_counter()
+            if trace:
+                with TraceExporter(tile, path, bufferSize=bufferSize):
+                    for _ in range(4):
+                        tile.Interrogate(0.05)
+            else:
+                for _ in range(4):
+                    tile.Interrogate(0.05)
+            times.append(time.perf_counter() - t0)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        with open(path) as f:
+            events = sum(1 for _ in f) - 2
+        print(f"{nrows:>3}x{ncols:<3} | {times[0]:>10.3f} | {times[1]:>8.3f} | {(peaks[1] - peaks[0]) / 1e6:>7.2f} | "
+              f"{events:>8} | {os.path.getsize(path) / 1e6:>7.2f}")
+    os.remove(path)
+
+
+def benchFifoSampler(nrows=10, ncols=10, nHits=100, intervals=(None, 1e-3, 1e-5), bigSize=(100, 100), nSamples=1000):
+    """
+    wall time of 4 left interrogations of a tile sampled every interval, and the
+    time of one sample of a big array, taken by FifoSampler against a loop over
+    the ASICs reading their FIFOs
+    """
+    print(f"{nrows}x{ncols} tile, 4 left interrogations")
+    print(f"{'interval':>8} | {'samples':>7} | {'time s':>7}")
+    for interval in intervals:
+        random.seed(2)
+        np.random.seed(2)
+        tile = QpixAsicArray(nrows, ncols, deltaT=1e-5, engine="wake", fifoInterval=interval, fifoSamples=25000)
+        tile.Route("left", timeout=1.5e6, transact=False)
+        for asic in tile:
+            asic.InjectHits(np.sort(np.random.uniform(1e-9, 0.2, nHits)))
+        t0 = time.perf_counter()
+        for _ in range(4):
+            tile.Interrogate(0.05)
+        samples = 0 if interval is None else len(tile.fifoSampler)
+        print(f"{str(interval):>8} | {samples:>7} | {time.perf_counter() - t0:>7.3f}")
+
+    tile = QpixAsicArray(*bigSize, fifoInterval=1.0, fifoSamples=nSamples)
+    sampler = tile.fifoSampler
+    t0 = time.perf_counter()
+    for k in range(nSamples):
+        sampler.Sample(k + 0.5)
+    vectorized = (time.perf_counter() - t0) / nSamples
+    local = np.zeros((nSamples,) + bigSize, dtype=np.int32)
+    remote = np.zeros((nSamples,) + bigSize, dtype=np.int32)
+    t0 = time.perf_counter()
+    for k in range(nSamples):
+        local[k] = [[asic._localFifo._curSize for asic in row] for row in tile._asics]
+        remote[k] = [[asic._remoteFifo._curSize for asic in row] for row in tile._asics]
+    looped = (time.perf_counter() - t0) / nSamples
+    print(f"{bigSize[0]}x{bigSize[1]} array, one sample: {vectorized * 1e6:.1f} us sampler, "
+          f"{looped * 1e6:.1f} us per-ASIC loop")
+
+
+BENCHMARKS = {
+    "procqueue": benchProcQueue,
+    "qpfifo": benchQPFifo,
+    "qpbyte": benchQPByte,
+    "transferticks": benchTransferTicks,
+    "procitemalloc": benchProcItemAlloc,
+    "wakeengine": benchWakeEngine,
+    "checkpoint": benchCheckpoint,
+    "forksweep": benchForkSweep,
+    "tilefile": benchTileFile,
+    "parallel": benchParallel,
+    "detector": benchDetector,
+    "pushstep": benchPushStep,
+    "adaptivestep": benchAdaptiveStep,
+    "readhits": benchReadHits,
+    "injecthits": benchInjectHits,
+    "streamhits": benchStreamHits,
+    "staterecord": benchStateRecord,
+    "observers": benchObservers,
+    "profile": benchProfile,
+    "trace": benchTrace,
+    "fifosampler": benchFifoSampler,
+    "background": benchBackground,
+}
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] if len(sys.argv) > 1 else BENCHMARKS.keys()
+    for name in names:
+        BENCHMARKS[name]()
+        print()
@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+
+"""
+Time series of the FIFO depths of a QpixAsicArray, enabled with
+QpixAsicArray(..., fifoInterval=interval) and read from QpixAsicArray.fifoSampler.
+
+The sampler keeps the current local and remote FIFO depth of every ASIC in two
+(nrows, ncols) numpy arrays, updated by the Write and Read of the FIFOs of the
+sampled array only. QpixAsicArray.Process copies them into the preallocated
+sample arrays whenever it passes sample times, so taking a sample doesn't visit
+the ASICs.
+
+A sample at time t holds the depths before the first step or word the array
+processed after t.
+"""
+
+import math
+import numpy as np
+
+
+def _mirrored(fifo, depths, i):
+    """
+    Write and Read of fifo which also keep its depth in depths[i]
+    """
+    write, read = fifo.Write, fifo.Read
+
+    def Write(data):
+        depths[i] = size = write(data)
+        return size
+
+    def Read():
+        data = read()
+        depths[i] = fifo._curSize
+        return data
+    return Write, Read
+
+
+class FifoSampler:
+    """
+    local and remote FIFO depths of every ASIC of array, sampled every interval
+    of simulated time from the current time of the array
+    ARGS:
+      array    - sweep or wake engine QpixAsicArray to sample
+      interval - simulated time between samples
+      nSamples - number of samples, later sample times are not recorded
+    VARS:
+      times         - float64[nSamples], time of every sample
+      local, remote - int32[nSamples, nrows, ncols], depth of the local and remote
+                      FIFO of every ASIC at every sample
+      count         - number of samples taken
+    """
+
+    def __init__(self, array, interval, nSamples=1024):
+        assert interval > 0, "the sampling interval must be positive"
+        assert nSamples > 0, "need at least one sample"
+        shape = (array._nrows, array._ncols)
+        self.interval = interval
+        self.start = array._timeNow
+        self.times = self.start + interval * np.arange(nSamples)
+        self.local = np.zeros((nSamples,) + shape, dtype=np.int32)
+        self.remote = np.zeros((nSamples,) + shape, dtype=np.int32)
+        self.count = 0
+
+        self._local = np.zeros(shape, dtype=np.int32)
+        self._remote = np.zeros(shape, dtype=np.int32)
+        localFlat, remoteFlat = self._local.reshape(-1), self._remote.reshape(-1)
+        for asic in array:
+            i = asic.row * array._ncols + asic.col
+            for fifo, depths in ((asic._localFifo, localFlat), (asic._remoteFifo, remoteFlat)):
+                depths[i] = fifo._curSize
+                fifo.Write, fifo.Read = _mirrored(fifo, depths, i)
+
+    def __len__(self):
+        return self.count
+
+    def Sample(self, t):
+        """
+        record the current depths for every sample time before t not taken yet.
+        Returns the next sample time, inf once every sample is taken.
+        """
+        nSamples = len(self.times)
+        end = min(nSamples, math.ceil((t - self.start) / self.interval))
+        if end > self.count:
+            self.local[self.count:end] = self._local
+            self.remote[self.count:end] = self._remote
+            self.count = end
+        if self.count == nSamples:
+            return math.inf
+        return self.times[self.count]
+
+    def to_arrays(self):
+        """
+        the (times, local, remote) of the samples taken so far
+        """
+        n = self.count
+        return self.times[:n], self.local[:n], self.remote[:n]
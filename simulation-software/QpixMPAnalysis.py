@@ -1,7 +1,13 @@
 import multiprocessing as mp
+import os
+import gc
+import time
+import pickle
+import selectors
+import traceback
 import QpixAsicArray as qparray
 from QpixAsicArray import PrintTransactMap
-from QpixAsic import QPFifo
+from QpixAsic import QPFifo, AsicWord
 import pandas as pd
 
 ## This Script reads in the output of radiogenicNB.ipynb (which reads in output from radiogenic ROOT data)
@@ -10,15 +16,20 @@ import pandas as pd
 MAXTIME = 10 # time to integrate for, or time radiogenic data is based on
 
 DAQ_KEY = "DaqData"
+PROFILE_KEY = "Profile"
+# a tiledf json, or a binary tile file made from it with QpixTileFile.convert_tiledf
 INPUT_FILE = "tiledf05_10x14.json"
 
-def makeData(tile, r, t, int_prd, nHardInt):
+def makeData(tile, r, t, int_prd, nHardInt, profile=False):
     """
     Helper function which will extrct relevant data from a processed tile to a
     serialized, useful format to put onto the mp.queue
 
     This function must be useful to extract for comparative analysis based 
     on either a push or a pull architecture.
+
+    With profile, the data also hold the phase times of the tile's profiler,
+    for a tile built with profile=True.
     """
 
     # memoize lists to input serialized data
@@ -65,32 +76,55 @@ def makeData(tile, r, t, int_prd, nHardInt):
         }
     }
 
+    if profile:
+        assert tile.profiler is not None, "tile was built without a profiler"
+        stats = tile.profiler.to_dict()
+        data[PROFILE_KEY] = {
+            "Route":[r for name in stats],
+            "Timeout":[t for name in stats],
+            "Int_period":[int_prd for name in stats],
+            "nHardInt":[nHardInt for name in stats],
+            "Name":list(stats),
+            "Kind":[stat["kind"] for stat in stats.values()],
+            "Calls":[stat["calls"] for stat in stats.values()],
+            "Time (ns)":[stat["ns"] for stat in stats.values()],
+        }
+
     return data
 
-def pushTile(queue, r, int_time=MAXTIME):
+def pushTile(queue, r, int_time=MAXTIME, engine="sweep", stepping="fixed"):
     """
     Push script to run. should be based on QpixTest format
+
+    engine="wake" and stepping="adaptive" opt in to the event driven engine,
+    where deltaT is only the largest step and the array jumps between hits and
+    timeouts.
     """
     import numpy as np
     np.random.seed(2)
 
-    inFile = INPUT_FILE
-
-    import codecs, json
-    obj_text = codecs.open(inFile, 'r').read()
-    readDF = json.loads(obj_text)
-    tile = qparray.QpixAsicArray(0, 0, tiledf=readDF, deltaT=20e-6)
+    tile = _readTile(INPUT_FILE, deltaT=20e-6, engine=engine, stepping=stepping)
 
     tile.Route(r, transact=False)
     tile.SetPushState(enabled=True, transact=False)
 
+    _pushFor(tile, MAXTIME + 1)
+
+    queue.put(makeData(tile, r, t=0, int_prd=0, nHardInt=0))
+
+def _pushFor(tile, endTime):
+    """
+    move a pushing tile forward to endTime, a deltaT at a time with fixed
+    stepping, or with a single IdleFor with adaptive stepping
+    """
+    if tile._adaptive:
+        tile.IdleFor(endTime - tile._timeNow)
+        return
     curT = 0
-    while curT < MAXTIME + 1:
+    while curT < endTime:
         curT += tile._deltaT
         tile.Process(curT)
 
-    queue.put(makeData(tile, r, t=0, int_prd=0, nHardInt=0))
-
 def runTile(queue, r, t, periods, int_time=MAXTIME):
     """
     basic function to run a tile with an integration period, over a specified time
@@ -101,14 +135,10 @@ def runTile(queue, r, t, periods, int_time=MAXTIME):
     import numpy as np
     np.random.seed(2)
 
-    inFile = INPUT_FILE
     int_prd = periods[0]
     nHardInt = periods[1]
 
-    import codecs, json
-    obj_text = codecs.open(inFile, 'r').read()
-    readDF = json.loads(obj_text)
-    tile = qparray.QpixAsicArray(0, 0, tiledf=readDF, timeout=t, deltaT=20e-6)
+    tile = _readTile(INPUT_FILE, timeout=t, deltaT=20e-6)
 
     # configure other meta cases of the tile
     if t == 0:
@@ -128,6 +158,329 @@ def runTile(queue, r, t, periods, int_time=MAXTIME):
     queue.put(makeData(tile, r, t, int_prd, nHardInt))
 
 
+def forkSweep(run, points, ncpu=20):
+    """
+    Run run(*point) for every point of points, each in a child process forked
+    from this one, with at most ncpu children running at once.
+
+    Children share everything built before the call with this process through
+    copy on write, so a tile built and loaded once here doesn't need to be
+    rebuilt for every point, as runTile and pushTile do. run should only change
+    what its point sweeps. Each result is pickled back through a pipe.
+
+    Returns the results in the order of points, and the startup time of every
+    child, from the fork until run is called.
+    """
+    assert hasattr(os, "fork"), "forkSweep needs os.fork"
+    points = list(points)
+    results, startups = [None] * len(points), [None] * len(points)
+    failures = []
+    selector = selectors.DefaultSelector()
+    running, nextPoint = 0, 0
+
+    # keep the garbage collector away from the shared objects, so that the
+    # children only copy the pages they change
+    gc.freeze()
+    try:
+        while nextPoint < len(points) or running > 0:
+
+            # fill up the running children
+            while nextPoint < len(points) and running < ncpu:
+                readFd, writeFd = os.pipe()
+                forkTime = time.perf_counter()
+                pid = os.fork()
+                if pid == 0:
+                    os.close(readFd)
+                    _forkChild(writeFd, run, points[nextPoint], forkTime)
+                os.close(writeFd)
+                selector.register(readFd, selectors.EVENT_READ, [nextPoint, pid, []])
+                nextPoint += 1
+                running += 1
+
+            # read whatever the children sent, a closed pipe is a finished child
+            for key, _ in selector.select():
+                i, pid, chunks = key.data
+                chunk = os.read(key.fd, 1 << 16)
+                if chunk:
+                    chunks.append(chunk)
+                    continue
+                selector.unregister(key.fd)
+                os.close(key.fd)
+                os.waitpid(pid, 0)
+                running -= 1
+                ok, result, startups[i] = pickle.loads(b"".join(chunks)) if chunks else (False, "no result", None)
+                if ok:
+                    results[i] = result
+                else:
+                    failures.append(f"point {points[i]} failed:\n{result}")
+    finally:
+        gc.unfreeze()
+        selector.close()
+
+    if failures:
+        raise RuntimeError("\n".join(failures))
+    return results, startups
+
+def _forkChild(writeFd, run, point, forkTime):
+    """
+    body of a forkSweep child, which never returns
+    """
+    try:
+        startup = time.perf_counter() - forkTime
+        try:
+            message = (True, run(*point), startup)
+        except Exception:
+            message = (False, traceback.format_exc(), startup)
+        data = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+        with os.fdopen(writeFd, "wb") as pipe:
+            pipe.write(data)
+    finally:
+        os._exit(0)
+
+def _readTile(inFile=INPUT_FILE, **kwargs):
+    """
+    tile built from inFile, either a tiledf json file or a binary tile file of
+    QpixTileFile, which is memory mapped instead of parsed
+    """
+    if not str(inFile).endswith(".json"):
+        return qparray.QpixAsicArray.fromTileFile(inFile, **kwargs)
+    import codecs, json
+    obj_text = codecs.open(inFile, 'r').read()
+    readDF = json.loads(obj_text)
+    return qparray.QpixAsicArray(0, 0, tiledf=readDF, **kwargs)
+
+def pullRun(tile, r, t, periods, int_time=MAXTIME):
+    """
+    the pull run of runTile on an already built tile
+    """
+    int_prd, nHardInt = periods
+
+    if t == 0:
+        tile.SetSendRemote(enabled=True, transact=False)
+    tile.Route(r, timeout=t, transact=False)
+
+    dT, nInt = 0, 0
+    while dT < int_time + int_prd:
+        dT += int_prd
+        tile.Interrogate(int_prd, hard=nInt % nHardInt == 0)
+        nInt += 1
+
+def pushRun(tile, r, int_time=MAXTIME):
+    """
+    the push run of pushTile on an already built tile
+    """
+    tile.Route(r, transact=False)
+    tile.SetPushState(enabled=True, transact=False)
+    _pushFor(tile, int_time + 1)
+
+def _pullPoint(tile, r, t, periods, int_time=MAXTIME):
+    """
+    runTile on an already built tile, for forkSweep
+    """
+    import numpy as np
+    np.random.seed(2)
+    pullRun(tile, r, t, periods, int_time)
+    return makeData(tile, r, t, *periods)
+
+def _pushPoint(tile, r, int_time=MAXTIME):
+    """
+    pushTile on an already built tile, for forkSweep
+    """
+    import numpy as np
+    np.random.seed(2)
+    pushRun(tile, r, int_time)
+    return makeData(tile, r, t=0, int_prd=0, nHardInt=0)
+
+def _saveData(pTiles):
+    """
+    build and save the dataframes of the makeData of every tile
+    """
+    daq_data, profile_data, data = {}, {}, {}
+    for tile in pTiles:
+
+        # remove the daqData and profile keys from this
+        for key, keyData in ((DAQ_KEY, daq_data), (PROFILE_KEY, profile_data)):
+            key_tile = tile.pop(key, None)
+            if key_tile is not None:
+                for k,v in key_tile.items():
+                    if keyData.get(k) is not None:
+                        keyData[k].extend(v) 
+                    else:
+                        keyData[k] = v
+
+        # build the transaction csv
+        for k,v in tile.items():
+            if data.get(k) is not None:
+                data[k].extend(v) 
+            else:
+                data[k] = v
+
+    # create the dataframe from from these dictionaries
+    df = pd.DataFrame.from_dict(data)
+    daq_df = pd.DataFrame.from_dict(daq_data)
+
+    # save the dataframe into a json for safe keeping
+    df.to_csv("output_df.csv")
+    daq_df.to_csv("output_daq_df.csv")
+    if profile_data:
+        pd.DataFrame.from_dict(profile_data).to_csv("output_profile_df.csv")
+
+def forkMain(ncpu=20, engine="sweep", stepping="fixed"):
+    """
+    main, with the pull and push tiles built once and every sweep point forked
+    from them with forkSweep. Every point shares the same ASIC clocks. engine
+    and stepping build the push tile, as in pushTile.
+    """
+    from functools import partial
+
+    # define the ranges of parameters to test
+    int_periods = [0.2, 0.5, 0.75, 1, 2]
+    nHardInt = [5, 10, 20]
+    routes = ["left", "snake"]
+    timeouts = [0, 15e3, 15e4, 15e5]
+    periods = [(i,j) for i in int_periods for j in nHardInt]
+    args = [(i, j, k) for i in routes for j in timeouts for k in periods]
+
+    t0 = time.perf_counter()
+    pullTile = _readTile(deltaT=20e-6)
+    pushTile = _readTile(deltaT=20e-6, engine=engine, stepping=stepping)
+    buildTime = (time.perf_counter() - t0) / 2
+    print(f"begginning processing of {len(args) + len(routes)} tiles.")
+
+    pTiles, startups = forkSweep(partial(_pullPoint, pullTile), args, ncpu)
+    pushTiles, pushStartups = forkSweep(partial(_pushPoint, pushTile), [(r,) for r in routes], ncpu)
+    pTiles += pushTiles
+    startups += pushStartups
+
+    startup = sum(startups) / len(startups)
+    print(f"tile build {buildTime:.3f} s, fork startup {startup * 1e3:.2f} ms, "
+          f"saving {buildTime - startup:.3f} s per sweep point")
+    _saveData(pTiles)
+
+def tileCatalog(df, nrows, ncols):
+    """
+    catalog of every detector tile in df, the reset dataframe of radiogenicNB.ipynb
+    with its tileX, tileY, tileN, AsicX, AsicY and Reset columns.
+
+    Every tile of the catalog is the tiledf of that tile, with the ASICs numbered
+    within the tile, and its tileX, tileY and tileN.
+    """
+    catalog = []
+    for (tileN, tileX, tileY), tdf in df.groupby(["tileN", "tileX", "tileY"]):
+        hits = [[int(x - tileX * nrows), int(y - tileY * ncols), sorted(adf["Reset"].tolist())]
+                for (x, y), adf in tdf.groupby(["AsicX", "AsicY"])]
+        catalog.append({"tileN": int(tileN), "tileX": int(tileX), "tileY": int(tileY),
+                        "nrows": nrows, "ncols": ncols, "hits": hits})
+    return catalog
+
+def tileSummary(tile, int_time=MAXTIME):
+    """
+    reduce a processed tile to the few numbers of its detector summary row: the
+    DAQ word rates over int_time, the largest local and remote FIFO depths, and
+    the readout latency of the data words, from the hit to the DaqNode.
+    """
+    daqNode = tile._daqNode
+    daqFifo = daqNode._localFifo
+    latency = [daqNode._startTime + d.daqT * daqNode.tOsc - d.qbyte.data
+               for d in daqFifo._data if d.wordType == AsicWord.DATA]
+    asics = list(tile)
+
+    return {
+        "nAsics": len(asics),
+        "Hits": sum(asic._localFifo._totalWrites for asic in asics),
+        "DaqWords": daqFifo._totalWrites,
+        "DaqData": daqFifo._dataWords,
+        "DaqRate": daqFifo._totalWrites / int_time,
+        "DataRate": daqFifo._dataWords / int_time,
+        "Local Max": max(asic._localFifo._maxSize for asic in asics),
+        "Remote Max": max(asic._remoteFifo._maxSize for asic in asics),
+        "Latency Mean": sum(latency) / len(latency) if latency else float("nan"),
+        "Latency Max": max(latency, default=float("nan")),
+    }
+
+def _detectorTile(run, tileKwargs, int_time, seed, spec):
+    """
+    build, run and reduce one tile of runDetector in a pool worker
+    """
+    import random
+    import numpy as np
+    random.seed(seed + spec["tileN"])
+    np.random.seed(seed + spec["tileN"])
+
+    tile = qparray.QpixAsicArray(0, 0, tiledf=spec, **tileKwargs)
+    run(tile)
+    summary = {"tileN": spec["tileN"], "tileX": spec["tileX"], "tileY": spec["tileY"]}
+    summary.update(tileSummary(tile, int_time))
+
+    # the ASICs and their connections reference each other, collect the tile
+    # now instead of when the worker next happens to run the collector
+    del tile
+    gc.collect()
+    return summary
+
+def runDetector(catalog, run=None, ncpu=20, int_time=MAXTIME, seed=2, maxtasksperchild=50, **tileKwargs):
+    """
+    Run every tile of catalog, see tileCatalog, as an independent QpixAsicArray
+    across a pool of ncpu processes and aggregate the tiles into a detector
+    summary.
+
+    run(tile) runs a built tile, the pullRun of a left routed tile with a 0.5 s
+    interrogation period by default. tileKwargs build every tile. Every tile is
+    seeded with seed + tileN, so a tile runs the same wherever it is scheduled.
+
+    Workers only send back the tileSummary of each tile and drop the tile before
+    building the next one, and are replaced after maxtasksperchild tiles, so
+    the memory use doesn't grow with the size of the detector.
+
+    Returns the dataframe of the tile summaries, ordered by tileN, and the
+    detector summary dict.
+    """
+    from functools import partial
+
+    if run is None:
+        run = partial(pullRun, r="left", t=15e3, periods=(0.5, 5), int_time=int_time)
+    tileKwargs.setdefault("deltaT", 20e-6)
+    work = partial(_detectorTile, run, tileKwargs, int_time, seed)
+
+    rows = []
+    with mp.Pool(ncpu, maxtasksperchild=maxtasksperchild) as pool:
+        for summary in pool.imap_unordered(work, catalog):
+            rows.append(summary)
+            print(f"Completed tile {summary['tileN']}, {len(rows)} tiles..")
+
+    df = pd.DataFrame(rows).sort_values("tileN").reset_index(drop=True)
+    data = df["DaqData"].sum()
+    detector = {
+        "nTiles": len(df),
+        "nAsics": df["nAsics"].sum(),
+        "Hits": df["Hits"].sum(),
+        "DaqWords": df["DaqWords"].sum(),
+        "DaqRate": df["DaqRate"].sum(),
+        "DataRate": df["DataRate"].sum(),
+        "Max DaqRate": df["DaqRate"].max(),
+        "Local Max": df["Local Max"].max(),
+        "Remote Max": df["Remote Max"].max(),
+        # weight every tile mean by its number of data words
+        "Latency Mean": (df["Latency Mean"] * df["DaqData"]).sum() / data if data else float("nan"),
+        "Latency Max": df["Latency Max"].max(),
+    }
+    return df, detector
+
+def detectorMain(inFile="catalog.json", ncpu=20):
+    """
+    runDetector over the tile catalog stored in inFile, a json list of the
+    tiles of tileCatalog, saving the tile and detector summaries.
+    """
+    import json
+    with open(inFile) as f:
+        catalog = json.load(f)
+    print(f"begginning processing of {len(catalog)} detector tiles.")
+
+    df, detector = runDetector(catalog, ncpu=ncpu)
+    df.to_csv("output_detector_tiles.csv")
+    pd.Series(detector).to_csv("output_detector.csv")
+    return df, detector
+
 def main(seed=2):
     """
     This script should be called and run as an executable.
@@ -179,32 +532,7 @@ def main(seed=2):
 
 
     # build all of the serialized data from the MP outputs
-    daq_data, data = {}, {}
-    for tile in pTiles:
-
-        # remove the daqData key from this
-        daq_tile = tile.pop(DAQ_KEY, None)
-        if daq_tile is not None:
-            for k,v in daq_tile.items():
-                if daq_data.get(k) is not None:
-                    daq_data[k].extend(v) 
-                else:
-                    daq_data[k] = v
-
-        # build the transaction csv
-        for k,v in tile.items():
-            if data.get(k) is not None:
-                data[k].extend(v) 
-            else:
-                data[k] = v
-
-    # create the dataframe from from these dictionaries
-    df = pd.DataFrame.from_dict(data)
-    daq_df = pd.DataFrame.from_dict(daq_data)
-
-    # save the dataframe into a json for safe keeping
-    df.to_csv("output_df.csv")
-    daq_df.to_csv("output_daq_df.csv")
+    _saveData(pTiles)
 
 
 if __name__ == "__main__":
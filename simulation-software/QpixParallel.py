@@ -0,0 +1,731 @@
+#!/usr/bin/python3
+
+"""
+Spatially partitioned parallel engine for QpixAsicArray, selected with
+QpixAsicArray(..., engine="parallel", workers=n).
+
+The array is split into a grid of rectangular regions, one per worker process.
+The workers are forked with a copy of the array by the first call of Process and
+kept for the later calls. Each simulates the ASICs of its region with the "wake"
+engine bookkeeping, keeping its own heap of the words sent to its ASICs. Words
+sent across a region border are exchanged through the parent, which runs the
+conservative synchronization.
+
+A word always takes at least the lookahead to cross a link, the shortest
+Endeavor transfer (TRANSFER_TICKS_TABLE[0] ticks) of the fastest ASIC clock.
+A word received at time t is therefore only forwarded after t + lookahead, and
+an ASIC which is already sending words sends its next one lookahead after its
+current time at the earliest. The parent gathers those bounds after each window
+and lets every region process all of the transactions before the earliest time
+any new word can arrive. Words sent within a window only arrive after it, so
+the regions process the window independently of each other.
+
+The DAQ output is the same as the serial engines, transaction for transaction:
+every region also moves its ASICs to the times of the transactions of the other
+regions, only recording those sweeps while none of its ASICs is due, and the
+parent reproduces the global decisions of QpixAsicArray.Process, the array time,
+the ASICs processed by each step and the push state bookkeeping. Words with the
+same arrival time, which ASICs moved to the same sweep time often send, are
+ordered as the serial engines add them to their queue, see _RegionQueue. In the
+push state the relative clock of an ASIC which timed out can differ from the
+serial engines by the rounding of its last tick: a word sent by another region
+makes the serial sweep repeat and move that ASIC forward once more, which the
+single pass of its region doesn't.
+
+At the end of every call of Process the workers only send back what changed in
+their ASICs, see _Mark, so the array can be read between the calls. Changes to
+the array outside of Process, which the array marks with _wakeDirty, are sent
+to the workers with the next call. The engine is meant for long calls, like
+Interrogate or IdleFor, of large arrays.
+"""
+
+import os
+import enum
+import math
+import heapq
+import itertools
+import traceback
+import weakref
+import multiprocessing
+import numpy as np
+from QpixAsic import ProcItem, AsicState, AsicDirMask, TRANSFER_TICKS_TABLE, REG_TRANSFER_TICKS
+from QpixAsic import QPixAsic, QPFifo, StateRecorder
+
+# node members which stay with their process
+_NOT_SYNCED = ("_onNextHit", "_itemPool")
+
+
+def region_grid(workers, nrows, ncols):
+    """
+    returns the (rows, cols) of the grid of workers regions cutting the fewest
+    links of a nrows x ncols array
+    """
+    grids = [(r, workers // r) for r in range(1, workers + 1)
+             if workers % r == 0 and r <= nrows and workers // r <= ncols]
+    assert grids, f"can't split a {nrows}x{ncols} array into {workers} regions"
+    return min(grids, key=lambda g: (g[0] - 1) * ncols + (g[1] - 1) * nrows)
+
+
+def min_transfer_time(asic):
+    """
+    shortest time asic takes to send any word
+    """
+    return min(TRANSFER_TICKS_TABLE[0], REG_TRANSFER_TICKS, asic.transferTicks) * asic.tOsc
+
+
+def _Transmitting(asic):
+    """
+    whether asic can send a word without receiving one first, the ASICs kept
+    by the steps of QpixAsicArray.Process after its transactions
+    """
+    return (asic.state == AsicState.Finish or
+            asic.state == AsicState.TransmitLocal or
+            (asic._remoteFifo._curSize > 0 and
+                (asic.state == AsicState.TransmitRemote or
+                asic.state == AsicState.TransmitRemoteFull or
+                asic.config.SendRemote == True
+                )))
+
+
+def _Mark(value):
+    """
+    the (kind, value, extra) mark of a member of a node, which _Change compares
+    the member with at the next sync. FIFOs and state records are marked by how
+    much was written to them, lists, sets and injected hits by their length.
+    """
+    if isinstance(value, QPFifo):
+        return "fifo", value, (value._totalWrites, value._curSize)
+    if isinstance(value, StateRecorder):
+        return "record", value, value._n
+    if isinstance(value, (list, set, np.ndarray)):
+        return "sequence", value, len(value)
+    if isinstance(value, QPixAsic.AsicConnections):
+        return "links", value, [vars(link).copy() for link in value.connections]
+    if hasattr(value, "__dict__") and not isinstance(value, enum.Enum):
+        return "object", value, vars(value).copy()
+    return "value", value, None
+
+
+def _IsTail(value, old):
+    """
+    whether the array value is a view of the end of the array old, the hits
+    QPixAsic._ReadHits leaves
+    """
+    if not isinstance(value, np.ndarray) or value.dtype != old.dtype or len(value) > len(old):
+        return False
+    if len(value) == 0:
+        return True
+    offset = (len(old) - len(value)) * old.strides[0]
+    return value.__array_interface__["data"][0] == old.__array_interface__["data"][0] + offset
+
+
+def _Change(value, mark):
+    """
+    the change of a member of a node since its mark, None if it didn't change.
+    FIFOs only send the words written since, state records their new rows,
+    injected hits how many were read and links the members of each link. Lists
+    are only ever appended to.
+    """
+    kind, old, extra = mark
+    if value is not old:
+        if kind == "sequence" and isinstance(old, np.ndarray) and _IsTail(value, old):
+            return "drop", len(old) - len(value)
+        if kind == "value" and type(value) is type(old) and value == old:
+            return None
+        return "set", value
+    if kind == "fifo":
+        writes, size = value._totalWrites - extra[0], value._curSize
+        if writes == 0 and size == extra[1]:
+            return None
+        new = min(writes, size)
+        tail = list(itertools.islice(reversed(value._data), new))[::-1]
+        return "fifo", extra[1] - (size - new), tail, {k: v for k, v in vars(value).items() if k != "_data"}
+    if kind == "record":
+        if value._n == extra:
+            return None
+        if value.mode == "ring" and value._n - extra > value.size:
+            return "set", value
+        rows = np.arange(extra, value._n) % len(value._states)
+        return "rows", value._states[rows], value._relTimes[rows], value._absTimes[rows]
+    if kind == "sequence":
+        if isinstance(value, list) and len(value) > extra:
+            return "extend", value[extra:]
+        return None if len(value) == extra else ("set", value)
+    if kind == "links":
+        links = [vars(link) for link in value.connections]
+        return None if links == extra else ("links", links)
+    if kind == "object":
+        return None if vars(value) == extra else ("set", value)
+    return None
+
+
+def _Apply(node, name, change):
+    """
+    apply a _Change to the member name of node
+    """
+    kind = change[0]
+    if kind == "set":
+        node.__dict__[name] = change[1]
+    elif kind == "drop":
+        node.__dict__[name] = node.__dict__[name][change[1]:]
+    elif kind == "extend":
+        node.__dict__[name].extend(change[1])
+    elif kind == "links":
+        for link, linkState in zip(node.__dict__[name].connections, change[1]):
+            link.__dict__.update(linkState)
+    elif kind == "fifo":
+        fifo = node.__dict__[name]
+        for _ in range(change[1]):
+            fifo._data.popleft()
+        fifo._data.extend(change[2])
+        fifo.__dict__.update(change[3])
+    else:
+        record = node.__dict__[name]
+        for state, relTime, absTime in zip(*(column.tolist() for column in change[1:])):
+            record.append(AsicState(state), relTime, absTime)
+
+
+class _Sync:
+    """
+    marks of the nodes a worker sends back to the array, as of the last sync
+    """
+    def __init__(self, nodes, index):
+        self.nodes = nodes
+        self.index = index
+        self.Mark()
+
+    def Mark(self):
+        self.marks = [{k: _Mark(v) for k, v in node.__dict__.items() if k not in _NOT_SYNCED}
+                      for node in self.nodes]
+
+    def Changes(self):
+        """
+        the (node index, {member: change}) of every node which changed since the
+        last sync, which becomes the new one
+        """
+        changes = []
+        for node, marks in zip(self.nodes, self.marks):
+            nodeChanges = {}
+            for k, v in node.__dict__.items():
+                if k in _NOT_SYNCED:
+                    continue
+                change = _Change(v, marks[k]) if k in marks else ("set", v)
+                if change is not None:
+                    nodeChanges[k] = change
+            if nodeChanges:
+                changes.append((self.index[id(node)], nodeChanges))
+        self.Mark()
+        return changes
+
+
+class _RegionQueue:
+    """
+    stands in for the ProcQueue of a worker's array. Words sent to an ASIC of the
+    region go onto its heap, and words for other regions go to the outbox. No word
+    may arrive before floor, when it is set.
+
+    Words are keyed by (inTime, event, phase, pass, sender, seq), the order the
+    serial engines add them to their queue in: by the transaction of the step
+    they were sent for, the sweep before it, the received word or the sweep after
+    it, the pass of that sweep, and the array index of the sending node. Words
+    with the same arrival time from different regions are then processed in the
+    same order as the serial engines.
+    """
+    def __init__(self, array, region, owner, index, senders):
+        self.heap = []
+        self.outbox = []
+        self.floor = None
+        self._array = array
+        self._region = region
+        self._owner = owner
+        self._index = index
+        self._senders = senders
+        self._seq = 0
+        self._pool = []
+        self.Phase(0, 0)
+
+    def Phase(self, event, phase):
+        """
+        the words from now on are sent for the transaction event of the step, 0
+        for the step itself, in the given phase of it
+        """
+        self._event = event
+        self._phase = phase
+        self._passBase = self._array._sweepPass
+
+    def AddProcItem(self, item):
+        assert self.floor is None or item.inTime >= self.floor, "word sent within the lookahead"
+        sender = self._senders[id(item.asic), item.dir.value]
+        key = (item.inTime, self._event, self._phase, self._array._sweepPass - self._passBase, sender, self._seq)
+        self._seq += 1
+        i = self._index[id(item.asic)]
+        if self._owner[i] == self._region:
+            heapq.heappush(self.heap, (key, item))
+        else:
+            self.outbox.append((key, i, item.dir.value, item.QPByte, item.command))
+            item.Release()
+
+    def Length(self):
+        return len(self.heap)
+
+
+class _Region:
+    """
+    worker side of ParallelEngine. The worker's copy of the array only keeps the
+    ASICs of its region in _asicList, so that the wake engine methods of the
+    array only schedule and catch up those.
+    """
+    def __init__(self, array, region, owner, lookahead):
+        self.array = array
+        self.region = region
+        self.nodes = [asic for asic in array] + [array._daqNode]
+        self.index = {id(node): i for i, node in enumerate(self.nodes)}
+        self.mine = [asic for i, asic in enumerate(self.nodes[:-1]) if owner[i] == region]
+        self.lookahead = lookahead
+        self.leads = [min_transfer_time(asic) for asic in self.mine]
+        self.processed = 0
+        self.lastTime = None
+        # transactions of the step so far, see _RegionQueue
+        self.event = 0
+        synced = self.mine + ([array._daqNode] if owner[-1] == region else [])
+        self.sync = _Sync(synced, self.index)
+
+        array._asicList = self.mine
+        array._asicIndex = {id(asic): i for i, asic in enumerate(self.mine)}
+        array._procAsics = list(self.mine)
+        array._wake = True
+        array._ResetWake()
+        # index of the node sending the words received by a node from a direction
+        senders = {(id(node.connections[d].asic), (d + 2) % 4): i
+                   for i, node in enumerate(self.nodes) for d in range(4) if node.connections[d]}
+        self.queue = array._queue = _RegionQueue(array, region, owner, self.index, senders)
+        for node in self.nodes:
+            node._itemPool = self.queue._pool
+
+    def Begin(self, state, blob):
+        """
+        the start of a call of QpixAsicArray.Process, with the array members of
+        state and, if the array was changed since the last call, the state of
+        every node from _DumpNodes in blob
+        """
+        array = self.array
+        array.__dict__.update(state)
+        if blob is not None:
+            array._LoadNodes(blob)
+            array._ResetWake()
+            self.sync.Mark()
+        array._procAsics = list(self.mine)
+        array._pushStepped = [True] * len(self.mine)
+        self.processed = 0
+
+    def _Add(self, items):
+        for key, i, d, byte, command in items:
+            item = ProcItem.Acquire(self.queue._pool, self.nodes[i], AsicDirMask(d), byte, key[0], command)
+            heapq.heappush(self.queue.heap, (key, item))
+
+    def _Report(self):
+        """
+        the words sent to other regions, the earliest arrival on the heap and the
+        keys of the heap that can be in the next window, and the earliest time
+        an ASIC of the region can send a word without receiving one first
+        """
+        heap = self.queue.heap
+        first = heap[0][0][0] if heap else math.inf
+        keys = [key for key, _ in heap if key[0] < first + self.lookahead]
+        bound = math.inf
+        for asic, lead in zip(self.mine, self.leads):
+            if _Transmitting(asic) or (asic.config.EnablePush and len(asic._times) > 0):
+                bound = min(bound, asic._absTimeNow + lead)
+        outbox, self.queue.outbox = self.queue.outbox, []
+        return outbox, first, keys, bound
+
+    def _Skipped(self, skipped):
+        """
+        the steps at the times of skipped, skipped by the parent, only moved the
+        ASICs of the step forward in time, see End
+        """
+        array = self.array
+        if not skipped:
+            return
+        if array.push_state:
+            for t in skipped:
+                array._RecordSweep(t, [], every=False)
+            return
+        for asic in array._procAsics:
+            array._CatchUp(asic)
+            asic.ReplayTimes(skipped)
+            array._WakeSchedule(asic)
+
+    def Step(self, dT, items, skipped):
+        """
+        the step pass of QpixAsicArray.Process at dT
+        """
+        array = self.array
+        self.dT = dT
+        self._Skipped(skipped)
+        self._Add(items)
+        self.queue.floor = None
+        self.event = 0
+        self.queue.Phase(0, 0)
+        stepAsics = array._PushDue(dT) if array.push_state else array._procAsics
+        for asic in stepAsics:
+            array._CatchUp(asic)
+            newProcessItems = asic.Process(dT)
+            array._WakeSchedule(asic)
+            if newProcessItems:
+                array._alert = 1
+                for item in newProcessItems:
+                    self.queue.AddProcItem(item)
+        if array.push_state:
+            array._RecordSweep(dT, [array._asicIndex[id(asic)] for asic in stepAsics], every=False)
+        return self._Report()
+
+    def Window(self, events, floor, items):
+        """
+        process the transactions at the (inTime, region) events of every region,
+        receiving the words of this one. Returns the report, whether the last
+        sweep sent any word, and whether an ASIC was left in Finish by it
+        """
+        array = self.array
+        self._Add(items)
+        self.queue.floor = floor
+        eps = array._timeEpsilon
+        heap = array._wakeHeap
+        sent = 0
+        k = 0
+        while k < len(events):
+            t, owner = events[k]
+            wake = heap[0][0] if heap else math.inf
+            if owner != self.region and t <= wake:
+                # none of the region's ASICs is due before its next word or wake
+                # time, the sweeps up to then only move them forward in time
+                j = k
+                while j < len(events) and events[j][1] != self.region and events[j][0] <= wake:
+                    j += 1
+                array._RecordSweeps([sweep for t, _ in events[k:j] for sweep in (t - eps, t)])
+                sent = 0
+                self.event += j - k
+                k = j
+                continue
+            k += 1
+            self.event += 1
+
+            # popped before the sweep, which can send words arriving before t
+            if owner == self.region:
+                key, item = heapq.heappop(self.queue.heap)
+                assert key[0] == t, "regions out of order"
+            self.queue.Phase(self.event, 0)
+            array._WakeProcessArray(t - eps)
+            if owner == self.region:
+                asic = item.asic
+                array._CatchUp(asic)
+                self.queue.Phase(self.event, 1)
+                newProcessItems = asic.ReceiveByte(item)
+                array._WakeSchedule(asic)
+                for newItem in newProcessItems:
+                    self.queue.AddProcItem(newItem)
+                item.Release()
+                self.processed += 1
+            self.queue.Phase(self.event, 2)
+            sent = array._WakeProcessArray(t)
+        self.lastTime = events[-1][0]
+        finish = any(asic.state == AsicState.Finish for asic in self.mine)
+        return self._Report(), sent > 0, finish
+
+    def Finish(self):
+        """
+        another word was sent by the last sweep, which makes the serial engines
+        sweep again and send the Finish words of ASICs left in Finish. Those are
+        sent in the passes after the last one of the sweep.
+        """
+        self.array._WakeProcessArray(self.lastTime)
+        return self._Report()
+
+    def End(self, drained):
+        """
+        bookkeeping at the end of a step of QpixAsicArray.Process, returns the
+        time of ASIC (0, 0) if it is in the region, and the next event time, up
+        to which the steps of the region have nothing to process
+        """
+        array = self.array
+        if drained and array.push_state:
+            array._procAsics = [asic for asic in self.mine if len(asic._times) > 0]
+            array._PushNarrow()
+        elif drained:
+            array._procAsics = [asic for asic in self.mine if _Transmitting(asic)]
+
+        first = array[0][0]
+        firstTime = None
+        if id(first) in array._asicIndex:
+            array._CatchUp(first)
+            firstTime = first._absTimeNow
+
+        # the next steps up to the next event only move their ASICs forward in time
+        return firstTime, array._NextEventTime()
+
+    def Done(self, skipped):
+        """
+        catch up every ASIC at the end of a call of QpixAsicArray.Process, and
+        return what changed in the region for the array
+        """
+        array = self.array
+        self._Skipped(skipped)
+        array._CatchUpAll()
+        return {
+            "nodes": array._Pickle(self.sync.Changes()),
+            "processed": self.processed,
+            "alert": array._alert,
+            "procAsics": [self.index[id(asic)] for asic in array._procAsics],
+        }
+
+
+def _work(array, region, owner, lookahead, conn):
+    """
+    worker process of one region, runs the commands of ParallelEngine until it
+    is stopped
+    """
+    try:
+        worker = _Region(array, region, owner, lookahead)
+        while True:
+            try:
+                command, args = conn.recv()
+            except EOFError:
+                break
+            if command == "stop":
+                break
+            elif command == "begin":
+                reply = worker.Begin(*args)
+            elif command == "step":
+                reply = worker.Step(*args)
+            elif command == "window":
+                reply = worker.Window(*args)
+            elif command == "finish":
+                reply = worker.Finish()
+            elif command == "end":
+                reply = worker.End(*args)
+            else:
+                reply = worker.Done(*args)
+            conn.send(("ok", reply))
+    except BaseException:
+        conn.send(("error", traceback.format_exc()))
+    finally:
+        conn.close()
+
+
+def _Stop(pid, procs, conns):
+    """
+    stop the worker processes procs of ParallelEngine, if this is the process
+    pid which forked them and not a copy of it
+    """
+    if os.getpid() != pid:
+        return
+    for conn in conns:
+        try:
+            conn.send(("stop", ()))
+        except OSError:
+            pass
+        conn.close()
+    for proc in procs:
+        proc.join(timeout=10)
+        if proc.is_alive():
+            proc.terminate()
+
+
+class ParallelEngine:
+    """
+    runs QpixAsicArray.Process of array on workers regions, see the module
+    docstring
+    """
+    def __init__(self, array, workers):
+        assert hasattr(os, "fork"), "the parallel engine needs os.fork"
+        self._array = array
+        self.grid = region_grid(workers, array._nrows, array._ncols)
+        rows, cols = self.grid
+        self.workers = rows * cols
+        self._owner = [(asic.row * rows // array._nrows) * cols + asic.col * cols // array._ncols
+                       for asic in array]
+        # the DaqNode is in the region of ASIC (0, 0)
+        self._owner.append(self._owner[0])
+        self.lookahead = min(min_transfer_time(asic) for asic in array)
+        self._nodes = [asic for asic in array] + [array._daqNode]
+        self._index = {id(node): i for i, node in enumerate(self._nodes)}
+        self._conns = None
+
+    def _Start(self):
+        """
+        fork the workers with the current state of the array
+        """
+        array = self._array
+        ctx = multiprocessing.get_context("fork")
+        pipes = [ctx.Pipe() for _ in range(self.workers)]
+        procs = [ctx.Process(target=_work, args=(array, r, self._owner, self.lookahead, pipes[r][1]), daemon=True)
+                 for r in range(self.workers)]
+        for proc in procs:
+            proc.start()
+        self._conns = [parent for parent, _ in pipes]
+        for _, child in pipes:
+            child.close()
+        # the workers hold no reference to the engine, so they are stopped when
+        # it is collected
+        self._stop = weakref.finalize(self, _Stop, os.getpid(), procs, self._conns)
+
+    def Close(self):
+        """
+        stop the workers, the next call of Process forks them again
+        """
+        if self._conns is not None:
+            self._stop()
+            self._conns = None
+
+    def _Call(self, messages):
+        """
+        send each worker its (command, args) message, and return their replies
+        """
+        for conn, message in zip(self._conns, messages):
+            conn.send(message)
+        return [self._Recv(conn) for conn in self._conns]
+
+    @staticmethod
+    def _Recv(conn):
+        try:
+            status, reply = conn.recv()
+        except EOFError:
+            raise RuntimeError("parallel engine worker exited")
+        if status == "error":
+            raise RuntimeError(f"parallel engine worker failed\n{reply}")
+        return reply
+
+    def _Route(self, reports):
+        """
+        collect the reports of the workers, moving their outboxes to _pending
+        """
+        for outbox, _, _, _ in reports:
+            for word in outbox:
+                self._pending[self._owner[word[1]]].append(word)
+        self._reports = reports
+
+    def Process(self, timeEnd):
+        """
+        QpixAsicArray.Process of the array up to timeEnd, run on the workers
+        """
+        array = self._array
+        if array._timeNow >= timeEnd:
+            return
+
+        # requests queued on the array go to the regions of their ASICs
+        self._pending = [[] for _ in range(self.workers)]
+        queued = 0
+        while array._queue.Length() > 0:
+            item = array._queue.PopQueue()
+            i = self._index[id(item.asic)]
+            word = ((item.inTime, -1, queued), i, item.dir.value, item.QPByte, item.command)
+            self._pending[self._owner[i]].append(word)
+            queued += 1
+        array._queue.processed -= queued
+
+        # the workers get the changes made to the array since the last call
+        blob = None
+        if self._conns is None:
+            self._Start()
+        elif array._wakeDirty:
+            blob = array._DumpNodes(self._nodes)
+        array._wakeDirty = False
+        state = {"push_state": array.push_state, "send_remote": array.send_remote, "_alert": array._alert}
+        try:
+            self._Call([("begin", (state, blob))] * self.workers)
+            self._Run(timeEnd)
+            results = self._Call([("done", (self._skipped,))] * self.workers)
+        except BaseException:
+            # the workers were left within the call
+            self.Close()
+            raise
+
+        procAsics = []
+        for result in results:
+            for i, changes in array._Unpickle(result["nodes"]):
+                for name, change in changes.items():
+                    _Apply(self._nodes[i], name, change)
+            array._queue.processed += result["processed"]
+            array._alert = max(array._alert, result["alert"])
+            procAsics += result["procAsics"]
+        array._procAsics = [array._asicList[i] for i in sorted(procAsics)]
+
+    def _Run(self, timeEnd):
+        """
+        the step loop of QpixAsicArray.Process
+        """
+        array = self._array
+        eps = array._timeEpsilon
+        first = self._owner[0]
+        self._skipped = []
+        while array._timeNow < timeEnd:
+            dT = array._timeNow - eps
+            messages = [("step", (dT, words, self._skipped)) for words in self._pending]
+            self._pending = [[] for _ in range(self.workers)]
+            self._skipped = []
+            self._Route(self._Call(messages))
+            drained = self._Drain()
+            ends = self._Call([("end", (drained,))] * self.workers)
+            firstTime = ends[first][0]
+            nextEvent = min(end[1] for end in ends)
+            self._Advance(timeEnd, firstTime, nextEvent)
+
+            # steps with nothing to process in any region only move the array
+            # forward in time, which doesn't need the workers
+            while array._timeNow < timeEnd and array._timeNow - eps <= nextEvent:
+                self._skipped.append(array._timeNow - eps)
+                self._Advance(timeEnd, firstTime, nextEvent)
+
+    def _Advance(self, timeEnd, firstTime, nextEvent):
+        """
+        move the array time forward at the end of a step
+        """
+        array = self._array
+        if array._timeNow < firstTime:
+            array._timeNow = firstTime
+        elif array._adaptive:
+            array._timeNow = array._NextStepTime(timeEnd, nextEvent)
+        else:
+            array._timeNow = array._timeNow + array._deltaT
+        array._tickNow = int(array._timeNow * array.fNominal) + 1
+
+    def _Drain(self):
+        """
+        process windows of transactions until no word is left, returns whether
+        any transaction was processed
+        """
+        eps = self._array._timeEpsilon
+        drained = False
+        while True:
+            keys = [(key, r) for r, report in enumerate(self._reports) for key in report[2]]
+            keys += [(word[0], r) for r, words in enumerate(self._pending) for word in words]
+            if not keys:
+                return drained
+            start = min(keys)[0][0]
+            end = min([start - eps + self.lookahead] + [report[3] for report in self._reports])
+            if end > start:
+                events = sorted(k for k in keys if k[0][0] < end)
+                floor = end
+            else:
+                # a word can be sent before the next transaction, which has to
+                # be processed on its own
+                events = [min(keys)]
+                floor = None
+            events = [(key[0], r) for key, r in events]
+
+            messages = [("window", (events, floor, words)) for words in self._pending]
+            self._pending = [[] for _ in range(self.workers)]
+            replies = self._Call(messages)
+            drained = True
+
+            # ASICs left in Finish by the last sweep send their Finish word in
+            # another sweep if any region sent a word in the last sweep
+            reports = [reply[0] for reply in replies]
+            finish = [r for r, reply in enumerate(replies) if reply[2]]
+            if finish and any(reply[1] for reply in replies):
+                for r in finish:
+                    self._conns[r].send(("finish", ()))
+                for r in finish:
+                    report = self._Recv(self._conns[r])
+                    reports[r] = (reports[r][0] + report[0],) + report[1:]
+            self._Route(reports)
@@ -0,0 +1,100 @@
+#!/usr/bin/python3
+
+"""
+Wall clock profiler of QpixAsicArray.Process, enabled with
+QpixAsicArray(..., profile=True) and read from QpixAsicArray.profiler.
+
+The profiler accumulates time.perf_counter_ns time and call counts of every
+phase of Process and of every QPixAsic state handler. The methods behind them
+are wrapped on the instances of a profiled array only, so arrays without a
+profiler run the same code as before.
+"""
+
+from time import perf_counter_ns
+
+# phases of QpixAsicArray.Process
+PHASES = {
+    "process": "whole Process calls",
+    "step": "the asic.Process(dT) loop at the start of every step",
+    "sweep": "_ProcessArray or _WakeProcessArray sweeps, two per processed item",
+    "receive": "ReceiveByte of the ASICs and the DaqNode",
+    "queue": "insertions into the ProcQueue",
+    "pop": "ProcQueue.PopQueue",
+    "narrow": "rebuilding _procAsics once the queue is empty",
+}
+
+# QPixAsic state handlers, by the name of their method
+HANDLERS = {
+    "_processMeasuringState": "MeasuringState",
+    "_processRegisterResponse": "RegisterResponse",
+    "_processTransmitLocalState": "TransmitLocalState",
+    "_processFinishState": "FinishState",
+    "_processTransmitRemoteState": "TransmitRemoteState",
+}
+
+
+def _timed(inner, stat):
+    """
+    wrapper of inner adding its calls and time to the [calls, ns] of stat
+    """
+    def timed(*args):
+        t0 = perf_counter_ns()
+        result = inner(*args)
+        stat[0] += 1
+        stat[1] += perf_counter_ns() - t0
+        return result
+    return timed
+
+
+class PhaseProfiler:
+    """
+    calls and perf_counter_ns time of the PHASES of QpixAsicArray.Process and of
+    the HANDLERS of its ASICs.
+
+    Times are inclusive: state handlers run within the step and sweep phases,
+    and sweeps, ReceiveByte and the queue within process.
+    """
+
+    def __init__(self, array):
+        self._stats = {name: [0, 0] for name in list(PHASES) + list(HANDLERS.values())}
+
+        # everything but the step and narrow phases, which are part of the body
+        # of Process, is timed by wrapping the methods on the array's instances
+        self._Wrap(array, "_ProcessArray", "sweep")
+        self._Wrap(array, "_WakeProcessArray", "sweep")
+        self._Wrap(array._queue, "_AddQueueItem", "queue")
+        self._Wrap(array._queue, "PopQueue", "pop")
+        self._Wrap(array._daqNode, "ReceiveByte", "receive")
+        for asic in array:
+            self._Wrap(asic, "ReceiveByte", "receive")
+            for method, name in HANDLERS.items():
+                self._Wrap(asic, method, name)
+
+    def _Wrap(self, obj, method, name):
+        setattr(obj, method, _timed(getattr(obj, method), self._stats[name]))
+
+    def Add(self, name, t0):
+        """
+        add a call of phase name, which started at perf_counter_ns t0
+        """
+        stat = self._stats[name]
+        stat[0] += 1
+        stat[1] += perf_counter_ns() - t0
+
+    def Reset(self):
+        for stat in self._stats.values():
+            stat[0] = stat[1] = 0
+
+    def to_dict(self):
+        """
+        {name: {"kind", "calls", "ns"}} of every phase and state handler
+        """
+        return {name: {"kind": "phase" if name in PHASES else "state", "calls": calls, "ns": ns}
+                for name, (calls, ns) in self._stats.items()}
+
+    def to_dataframe(self):
+        """
+        to_dict as a pandas DataFrame indexed by name
+        """
+        import pandas as pd
+        return pd.DataFrame.from_dict(self.to_dict(), orient="index")
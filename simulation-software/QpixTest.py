@@ -1,8 +1,16 @@
 import pytest
 import QpixAsic
 import QpixAsicArray
+import QpixMPAnalysis
+import QpixTileFile
+import QpixTrace
+import json
+import os
 import numpy as np
 import warnings
+import random
+import pandas as pd
+from functools import partial
 np.random.seed(2)
 
 from QpixAsic import AsicWord
@@ -219,6 +227,37 @@ def test_asic_time_update(qpix_asic):
     tAsic.UpdateTime(dT/2)
     assert tAsic._absTimeNow == dT, "update time function not working"
 
+def test_asic_replay_times(qpix_asic):
+    """
+    every UpdateTime call adds at least one tick, and ReplayTimes should count
+    them exactly as the calls would
+    """
+    tAsic = qpix_asic
+    times = [2e-6, 1e-6, 2e-6 + tAsic.tOsc / 8, 2e-6 + tAsic.tOsc / 4, 2e-6 + tAsic.tOsc / 2]
+    start = (tAsic._absTimeNow, tAsic.relTimeNow, tAsic.relTicksNow)
+    for t in times:
+        tAsic.UpdateTime(t)
+    updated = (tAsic._absTimeNow, tAsic.relTimeNow, tAsic.relTicksNow)
+    assert updated[2] > tAsic.CalcTicks(times[-1]), "calls within one clock cycle should add ticks"
+
+    tAsic._absTimeNow, tAsic.relTimeNow, tAsic.relTicksNow = start
+    tAsic.ReplayTimes(times)
+    assert (tAsic._absTimeNow, tAsic.relTimeNow, tAsic.relTicksNow) == updated, "replay differs from UpdateTime"
+
+    # long replays are vectorized, with times in the past, within a clock cycle
+    # and on tick boundaries
+    rng = np.random.default_rng(4)
+    gaps = rng.choice([0, 1e-12, tAsic.tOsc / 3, tAsic.tOsc, 2.5 * tAsic.tOsc, 40 * tAsic.tOsc], 500)
+    times = np.cumsum(gaps) - 3 * tAsic.tOsc + tAsic._absTimeNow
+    times[::7] -= 5 * tAsic.tOsc
+    start = (tAsic._absTimeNow, tAsic.relTimeNow, tAsic.relTicksNow)
+    for t in times.tolist():
+        tAsic.UpdateTime(t)
+    updated = (tAsic._absTimeNow, tAsic.relTimeNow, tAsic.relTicksNow)
+    tAsic._absTimeNow, tAsic.relTimeNow, tAsic.relTicksNow = start
+    tAsic.ReplayTimes(times)
+    assert (tAsic._absTimeNow, tAsic.relTimeNow, tAsic.relTicksNow) == updated, "vectorized replay differs from UpdateTime"
+
 def test_asic_full_readout(qpix_array):
     """
     Full readout test of a remote ASIC within qpix_array, this asserts
@@ -382,6 +421,13 @@ def test_asic_route_left(qpix_array):
                 assert asic.config.DirMask == AsicDirMask.West, f"Row misaligned, should be West"
 
 
+def finish_count(asic):
+    """
+    Helper function counting the transitions of asic into the Finish state
+    """
+    states, _, _ = asic.state_times.to_arrays()
+    return int(np.count_nonzero(states == AsicState.Finish.value))
+
 def ensure_hits(hits, array):
     """
     Helper function that is used on test_daq_read methods to ensure that
@@ -423,9 +469,7 @@ def ensure_hits(hits, array):
     daqHits = array._daqNode._localFifo._dataWords
     evt_end_words = 0
     for asic in array:
-        for (state, _, _) in asic.state_times:
-            if state == AsicState.Finish:
-                evt_end_words += 1
+        evt_end_words += finish_count(asic)
     daq_evt_ends = 0
     for data in array._daqNode._localFifo._data:
         if data.wordType == AsicWord.EVTEND:
@@ -498,9 +542,7 @@ def test_daq_read_data_snake(qpix_array, qpix_hits, int_prd=0.5):
     while asicCnt < rows*cols:
 
         transactions += (cur_asic._localFifo._totalWrites - cur_asic._localFifo._curSize)
-        for (state, _, _) in cur_asic.state_times:
-            if state == AsicState.Finish:
-                transactions += 1
+        transactions += finish_count(cur_asic)
         transactions -= cur_asic._remoteFifo._curSize
 
         asicCnt += 1
@@ -554,9 +596,7 @@ def test_daq_read_data_left(qpix_array, qpix_hits, int_prd=0.5):
                 break
 
             transactions += (cur_asic._localFifo._totalWrites - cur_asic._localFifo._curSize)
-            for(state, _, _) in cur_asic.state_times:
-                if state == AsicState.Finish:
-                    transactions += 1
+            transactions += finish_count(cur_asic)
             transactions -= cur_asic._remoteFifo._curSize
             
             # test transactions for this ASIC
@@ -565,9 +605,7 @@ def test_daq_read_data_left(qpix_array, qpix_hits, int_prd=0.5):
                 if south_asic is not None:
                     transactions += (south_asic._remoteFifo._totalWrites - south_asic._remoteFifo._curSize)
                     transactions += (south_asic._localFifo._totalWrites - south_asic._localFifo._curSize)
-                    for(state, _, _) in south_asic.state_times:
-                        if state == AsicState.Finish:
-                            transactions += 1
+                    transactions += finish_count(south_asic)
 
             frac = f"{transactions}/{next_asic._remoteFifo._totalWrites}"
             msg = f"left trans. cnt error @ ({next_asic.row},{next_asic.col}) {frac}"
@@ -617,6 +655,826 @@ def test_asic_tick_cnt(qpix_array):
         tick = int((inHit - tAsic._startTime)/tAsic.tOsc) + 1
         assert tick == outHit[2].timeStamp, "input timestamp was not calcuated correctly"
 
+def test_proc_queue_order():
+    """
+    ProcQueue should pop items by inTime, and items with equal inTimes in the
+    order they were added
+    """
+    queue = QpixAsic.ProcQueue()
+    inTimes = [3, 1, 2, 1, 0, 2, 1]
+    for i, inTime in enumerate(inTimes):
+        queue.AddQueueItem(None, AsicDirMask.West, None, inTime, command=i)
+    assert queue.Length() == len(inTimes), "queue did not count all entries"
+
+    popped = []
+    while queue.Length() > 0:
+        item = queue.PopQueue()
+        popped.append((item.inTime, item.command))
+    assert popped == sorted((t, i) for i, t in enumerate(inTimes)), "queue popped out of order"
+    assert queue.processed == len(inTimes), "queue did not count processed items"
+    assert queue.PopQueue() is None, "empty queue should return None"
+
+def test_proc_item_reuse():
+    """
+    popped ProcItems should be recycled through the free list of their queue on
+    the next pop, and ASIC emitted items should still index like transaction tuples
+    """
+    queue = QpixAsic.ProcQueue()
+    queue.AddQueueItem(None, AsicDirMask.West, None, 1)
+    queue.AddQueueItem(None, AsicDirMask.West, None, 2)
+    first = queue.PopQueue()
+    assert first.inTime == 1 and first[3] == 1, "ProcItem not indexable"
+    assert len(queue._pool) == 0, "item released before next pop"
+    queue.PopQueue()
+    assert queue._pool == [first], "popped item not released on next pop"
+    queue.AddQueueItem(None, AsicDirMask.East, None, 3)
+    assert len(queue._pool) == 0, "free list not used for new item"
+    assert queue.PopQueue() is first and first.dir == AsicDirMask.East, "free list item not reused"
+    assert QpixAsic.ProcQueue()._pool is not queue._pool, "queues share a free list"
+
+    # items the queue didn't hand out aren't recycled
+    queue.PopQueue()
+    queue._pool.clear()
+    foreign = QpixAsic.ProcItem(None, AsicDirMask.North, None, 4)
+    queue.AddProcItem(foreign)
+    assert queue.PopQueue() is foreign and queue.PopQueue() is None
+    assert queue._pool == [] and foreign.inTime == 4, "item owned by no queue was recycled"
+
+    # the ASICs of an array use the free list of its queue, whose items aren't
+    # reused while the array has subscribers
+    array = QpixAsicArray.QpixAsicArray(2, 2, debug=0.0)
+    assert all(node._itemPool is array._queue._pool for node in list(array) + [array._daqNode])
+    kept = []
+    array.Subscribe("receive", kept.append)
+    array.Interrogate(0.5)
+    assert kept and array._queue._pool == [], "items recycled while subscribed"
+    assert len({id(item) for item in kept}) == len(kept), "subscribed items reused"
+    array.Unsubscribe("receive", kept.append)
+    assert array._queue.recycle, "recycling not restored without subscribers"
+
+
+def test_fifo_bookkeeping():
+    """
+    QPFifo should read out in FIFO order and keep track of sizes and writes
+    """
+    fifo = QpixAsic.QPFifo(maxDepth=4)
+    words = [QpixAsic.QPByte(AsicWord.DATA, 0, 0, timeStamp=i, channelList=[1]) for i in range(6)]
+    for word in words[:3]:
+        fifo.Write(word)
+    assert fifo.Read() is words[0], "fifo did not read first word"
+    for word in words[3:]:
+        fifo.Write(word)
+    assert fifo._curSize == 5 and fifo._maxSize == 5, "fifo sizes not tracked"
+    assert fifo._totalWrites == 6, "fifo writes not tracked"
+    assert fifo._full, "fifo past max depth should be full"
+    assert [fifo.Read() for _ in range(5)] == words[1:], "fifo did not read in order"
+    assert fifo.Read() is None and fifo._curSize == 0, "empty fifo should read None"
+
+
+def test_qpbyte_pack():
+    """
+    QPByte words should pack into the 64 bit format defined in QpixPkg.vhd, and
+    only register words should carry register members
+    """
+    byte = QpixAsic.QPByte(AsicWord.DATA, 3, 5, timeStamp=0xABCD1234, channelList=[0, 4, 15])
+    word = byte.Pack()
+    assert (word >> 56) & 0xF == AsicWord.DATA.value, "incorrect word type bits"
+    assert (word >> 40) & 0xFFFF == 0x8011, "incorrect channel mask bits"
+    assert (word >> 36) & 0xF == 3 and (word >> 32) & 0xF == 5, "incorrect position bits"
+    assert word & 0xFFFFFFFF == 0xABCD1234, "incorrect timestamp bits"
+    assert word >> 60 == 0, "reserved bits should be empty"
+    unpacked = QpixAsic.QPByte.Unpack(word)
+    assert unpacked.Pack() == word, "Unpack did not reverse Pack"
+    assert unpacked.transferTicks == byte.transferTicks, "unpacked transfer ticks differ"
+    assert not hasattr(byte, "__dict__"), "QPByte should not carry a dict"
+    assert not byte.SrcDaq, "data word is not from the DaqNode"
+    with pytest.raises(AttributeError):
+        byte.ReqID
+
+    req = QpixAsic.QPByte(AsicWord.REGREQ, None, None, Dest=True, XDest=1, YDest=2, ReqID=5, OpWrite=True)
+    word = req.Pack()
+    assert req.SrcDaq and req.ReqID == 5, "register request members not stored"
+    assert (word >> 56) & 0xF == AsicWord.REGREQ.value, "incorrect word type bits"
+    assert (word >> 55) & 1 and not (word >> 54) & 1 and (word >> 53) & 1, "incorrect op bits"
+    assert (word >> 49) & 0xF == 5 and (word >> 48) & 1, "incorrect ReqID / SrcDaq bits"
+    assert (word >> 36) & 0xF == 1 and (word >> 32) & 0xF == 2, "incorrect destination bits"
+
+
+def test_transfer_ticks():
+    """
+    table driven transfer ticks should match the Endeavor protocol cost, and the
+    vectorized transfer_ticks should match the ticks of each QPByte
+    """
+    timeStamps = np.random.randint(0, 2**32, 50)
+    masks = np.random.randint(0, 2**16, 50)
+    ticks = QpixAsic.transfer_ticks(QpixAsic.pack_words(AsicWord.DATA, 3, 5, timeStamps, masks))
+    for ts, mask, tick in zip(timeStamps.tolist(), masks.tolist(), ticks.tolist()):
+        byte = QpixAsic.QPByte(AsicWord.DATA, 3, 5, timeStamp=ts, channelList=[ch for ch in range(16) if mask >> ch & 1])
+        highBits = sum(bin(v).count("1") for v in (mask, ts, 3, 5, AsicWord.DATA.value))
+        expected = (highBits * QpixAsic.N_ONE_CLK_G + (64 - highBits) * QpixAsic.N_ZER_CLK_G
+                    + 63 * QpixAsic.N_GAP_CLK_G + QpixAsic.N_FIN_CLK_G)
+        assert byte.transferTicks == expected, "QPByte transfer ticks incorrect"
+        assert tick == expected, "vectorized transfer ticks incorrect"
+
+    # words are costed as they are built, later channels don't change the cost
+    byte = QpixAsic.QPByte(AsicWord.DATA, 0, 0, timeStamp=0)
+    ticks = byte.transferTicks
+    byte.AddChannel(3)
+    assert byte.transferTicks == ticks, "AddChannel changed the transfer ticks"
+
+    # read hits are costed before their channel mask is set
+    asic = QpixAsic.QPixAsic(row=1, col=2)
+    asic.InjectHits([0.001], channels=[[0, 1, 2, 3]])
+    asic._ReadHits(0.002)
+    hit = asic._localFifo.Read()
+    assert hit.channelMask == 0xF, "read hit lost its channels"
+    assert hit.transferTicks == QpixAsic.QPByte(AsicWord.DATA, 1, 2, hit.timeStamp).transferTicks, "read hit costed with its mask"
+
+    # fields are counted whole, even where they don't fit in the packed word
+    for row, col, ts in ((17, 20, 5), (2, 3, 2**40 + 7), (1, 1, -1)):
+        byte = QpixAsic.QPByte(AsicWord.EVTEND, row, col, timeStamp=ts)
+        highBits = sum(bin(v).count("1") for v in (row, col, ts, AsicWord.EVTEND.value))
+        assert byte.transferTicks == QpixAsic.TRANSFER_TICKS_TABLE[highBits], "truncated field in the cost"
+    asic = QpixAsic.QPixAsic(row=17, col=20)
+    asic.InjectHits([0.001, 0.0015])
+    asic._ReadHits(0.002)
+    for hit in (asic._localFifo.Read(), asic._localFifo.Read()):
+        assert hit.transferTicks == QpixAsic.QPByte(AsicWord.DATA, 17, 20, hit.timeStamp).transferTicks, "read hit cost differs"
+
+
+def daq_output(array):
+    """
+    Helper function to summarize everything the DaqNode of array received
+    """
+    return [(d.daqT, d.wordType, d.row, d.col, d.qbyte.timeStamp, d.qbyte.channelMask)
+            for d in array._daqNode._localFifo._data]
+
+def run_seeded_array(seed=3, push=False, endTime=0.05, idle=False, nrows=3, ncols=3, **kwargs):
+    """
+    Helper function which builds a seeded array, 3x3 by default, injects hits and runs it
+    either in the push state or with interrogations. Two calls with the same
+    seed should always produce the same simulation. With idle a pushing array
+    is moved forward with a single IdleFor call instead of a step at a time.
+    """
+    random.seed(seed)
+    np.random.seed(seed)
+    qpa = QpixAsicArray.QpixAsicArray(
+                nrows=nrows, ncols=ncols, nPixs=nPix,
+                fNominal=fNominal, pctSpread=pctSpread, deltaT=deltaT,
+                timeEpsilon=timeEpsilon, timeout=timeout,
+                hitsPerSec=hitsPerSec, debug=debug, tiledf=tiledf, **kwargs)
+    qpa.Route("Snake", transact=False)
+    for asic in qpa:
+        asic.InjectHits(np.sort(np.random.uniform(1e-9, endTime, np.random.randint(1, 6))))
+
+    if push:
+        qpa.SetPushState(enabled=True, transact=False)
+        curT = 0
+        if idle:
+            qpa.IdleFor(endTime * 1.2)
+        while curT < endTime * 1.2 and not idle:
+            curT += qpa._deltaT
+            qpa.Process(curT)
+    else:
+        while qpa._timeNow < endTime * 1.2:
+            qpa.Interrogate(endTime / 4)
+    return qpa
+
+def same_simulation(a, b):
+    """
+    Helper function which checks that two arrays ran the same simulation
+    """
+    assert a._queue.processed == b._queue.processed, "different number of processed items"
+    assert daq_output(a) == daq_output(b), "different DAQ output"
+    for aAsic, bAsic in zip(a, b):
+        msg = f"ASIC ({aAsic.row},{aAsic.col}):"
+        assert aAsic.state_times == bAsic.state_times, f"{msg} different state transitions"
+        assert aAsic._absTimeNow == bAsic._absTimeNow, f"{msg} different final time"
+        assert aAsic.relTicksNow == bAsic.relTicksNow, f"{msg} different final ticks"
+        assert aAsic._localFifo._totalWrites == bAsic._localFifo._totalWrites, f"{msg} different local writes"
+        assert aAsic._remoteFifo._totalWrites == bAsic._remoteFifo._totalWrites, f"{msg} different remote writes"
+
+@pytest.mark.parametrize("push", [False, True])
+def test_lane_scheduler_matches_heap(push):
+    """
+    The per-link LaneProcQueue scheduler must produce the same simulation as the
+    default heap ProcQueue
+    """
+    heap = run_seeded_array(push=push, scheduler="heap")
+    lanes = run_seeded_array(push=push, scheduler="lanes")
+    assert isinstance(lanes._queue, QpixAsic.LaneProcQueue), "lanes scheduler not selected"
+    same_simulation(heap, lanes)
+
+@pytest.mark.parametrize("push", [False, True])
+@pytest.mark.parametrize("seed", [3, 4])
+def test_wake_engine_matches_sweep(push, seed):
+    """
+    The event driven wake engine must produce the same simulation as sweeping
+    every ASIC
+    """
+    sweep = run_seeded_array(seed=seed, push=push)
+    wake = run_seeded_array(seed=seed, push=push, engine="wake")
+    same_simulation(sweep, wake)
+
+@pytest.mark.parametrize("push", [False, True])
+def test_wake_engine_sweep_buffers(monkeypatch, push):
+    """
+    The wake engine must produce the same simulation when its record of skipped
+    sweeps is compacted and grown during the run
+    """
+    monkeypatch.setattr(QpixAsicArray.QpixAsicArray, "_SWEEP_BUFFER", 2)
+    sweep = run_seeded_array(seed=3, push=push)
+    wake = run_seeded_array(seed=3, push=push, engine="wake")
+    assert len(wake._sweepTimes) > 2, "sweep buffers not grown"
+    same_simulation(sweep, wake)
+
+@pytest.mark.parametrize("push", [False, True])
+@pytest.mark.parametrize("engine,scheduler", [("sweep", "heap"), ("wake", "lanes")])
+def test_checkpoint_restore(push, engine, scheduler):
+    """
+    An array restored from a checkpoint, with a request still queued, must
+    continue with the same simulation as the array it was taken from
+    """
+    random.seed(4)
+    np.random.seed(4)
+    original = QpixAsicArray.QpixAsicArray(3, 4, deltaT=deltaT, engine=engine, scheduler=scheduler)
+    original.Route("snake", transact=False)
+    for asic in original:
+        asic.InjectHits(np.sort(np.random.uniform(1e-9, 0.06, 6)))
+    if push:
+        original.SetPushState(enabled=True, transact=False)
+        original.IdleFor(0.02)
+    else:
+        original.Interrogate(0.01)
+    original._Request("Interrogate")
+    state = (random.getstate(), np.random.get_state()[1].tolist())
+
+    blob = original.checkpoint()
+    random.seed(0)
+    np.random.seed(0)
+    restored = QpixAsicArray.QpixAsicArray.restore(blob)
+    assert (random.getstate(), np.random.get_state()[1].tolist()) == state, "random states not restored"
+    assert restored[1][2] is not original[1][2], "restored array shares its ASICs"
+
+    for tile in (original, restored):
+        tile.Process(tile._timeNow + 0.01)
+        if push:
+            tile.IdleFor(0.04)
+        else:
+            tile.Interrogate(0.02)
+            tile.Interrogate(0.02)
+    same_simulation(original, restored)
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+@pytest.mark.parametrize("push", [False, True])
+@pytest.mark.parametrize("workers", [2, 4])
+def test_parallel_engine_matches_sweep(push, workers):
+    """
+    The parallel engine must produce the same simulation as the serial engine,
+    whichever regions the array is split into
+    """
+    sweep = run_seeded_array(push=push, idle=push)
+    parallel = run_seeded_array(push=push, idle=push, engine="parallel", workers=workers)
+    assert parallel._parallel.workers == workers, "wrong number of regions"
+    same_simulation(sweep, parallel)
+
+    tiles = []
+    for kwargs in ({}, dict(engine="parallel", workers=workers)):
+        random.seed(7)
+        np.random.seed(7)
+        tile = QpixAsicArray.QpixAsicArray(4, 4, deltaT=deltaT, **kwargs)
+        tile.Route("left", transact=False)
+        for asic in tile:
+            asic.InjectHits(np.sort(np.random.uniform(1e-9, 0.04, np.random.randint(0, 4))))
+        tile.Interrogate(0.02, hard=True)
+        tile.Interrogate(0.02)
+        tiles.append(tile)
+    same_simulation(*tiles)
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+def test_parallel_workers_persist():
+    """
+    The workers of the parallel engine are kept across the calls of Process, and
+    must see the changes made to the array between the calls. A restored array
+    forks its own workers.
+    """
+    tiles = []
+    for kwargs in (dict(engine="wake"), dict(engine="parallel", workers=2)):
+        random.seed(5)
+        np.random.seed(5)
+        tile = QpixAsicArray.QpixAsicArray(3, 4, deltaT=deltaT, **kwargs)
+        tile.Route("snake", transact=False)
+        for asic in tile:
+            asic.InjectHits(np.sort(np.random.uniform(1e-9, 0.02, 3)))
+        tile.Interrogate(0.02)
+        tile.Interrogate(0.02)
+        conns = tile._parallel._conns if tile._parallel is not None else None
+        tile[1][2].InjectHits(np.array([0.045, 0.05]))
+        tile.Route("left", transact=False)
+        tile.Interrogate(0.02)
+        tile.Interrogate(0.02)
+        tiles.append(tile)
+    assert tiles[1]._parallel._conns is conns, "workers forked again"
+    same_simulation(*tiles)
+
+    restored = QpixAsicArray.QpixAsicArray.restore(tiles[1].checkpoint())
+    for tile in tiles + [restored]:
+        tile[0][1].InjectHits(np.array([0.09]))
+        tile.Interrogate(0.02)
+    same_simulation(tiles[0], restored)
+    same_simulation(tiles[1], restored)
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+@pytest.mark.parametrize("push", [False, True])
+def test_parallel_adaptive_stepping(push):
+    """
+    The parallel engine steps to the earliest next event of all its regions, so
+    adaptive stepping must receive the same DAQ output as the serial engine
+    """
+    wake = run_seeded_array(push=push, idle=True, engine="wake", stepping="adaptive")
+    parallel = run_seeded_array(push=push, idle=True, engine="parallel", workers=2, stepping="adaptive")
+    assert wake._queue.processed == parallel._queue.processed, "different number of processed items"
+    assert daq_output(wake) == daq_output(parallel), "different DAQ output"
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+def test_parallel_same_arrival_order():
+    """
+    ASICs moved to the same sweep time send words which arrive at the same time,
+    the regions must process those in the order of the serial engines
+    """
+    sweep = run_seeded_array(seed=3, nrows=4, ncols=5)
+    parallel = run_seeded_array(seed=3, nrows=4, ncols=5, engine="parallel", workers=4)
+    assert parallel._parallel.grid == (2, 2), "regions not split across rows and columns"
+    same_simulation(sweep, parallel)
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+def test_parallel_push_timeout_rounding():
+    """
+    In the push state a sweep of the serial engines is repeated when any ASIC sends
+    a word, which moves ASICs that just timed out forward once more. A region only
+    repeats it for its own words, so ASICs (1,4) and (2,4) of this run are moved
+    forward one UpdateTime call less. Only their relative clocks may differ from
+    the serial engine, by rounding.
+    """
+    sweep = run_seeded_array(seed=3, push=True, nrows=4, ncols=5)
+    parallel = run_seeded_array(seed=3, push=True, nrows=4, ncols=5, engine="parallel", workers=2)
+    assert sweep._queue.processed == parallel._queue.processed, "different number of processed items"
+    assert daq_output(sweep) == daq_output(parallel), "different DAQ output"
+
+    rounded = set()
+    for aAsic, bAsic in zip(sweep, parallel):
+        msg = f"ASIC ({aAsic.row},{aAsic.col}):"
+        assert aAsic._absTimeNow == bAsic._absTimeNow, f"{msg} different final time"
+        assert aAsic.relTicksNow == bAsic.relTicksNow, f"{msg} different final ticks"
+        assert aAsic._localFifo._totalWrites == bAsic._localFifo._totalWrites, f"{msg} different local writes"
+        assert aAsic._remoteFifo._totalWrites == bAsic._remoteFifo._totalWrites, f"{msg} different remote writes"
+        aStates, aRel, aAbs = aAsic.state_times.to_arrays()
+        bStates, bRel, bAbs = bAsic.state_times.to_arrays()
+        assert np.array_equal(aStates, bStates), f"{msg} different state transitions"
+        assert np.array_equal(aAbs, bAbs), f"{msg} different state transition times"
+        if aAsic.relTimeNow != bAsic.relTimeNow or not np.array_equal(aRel, bRel):
+            rounded.add((aAsic.row, aAsic.col))
+            assert np.allclose(aRel, bRel, rtol=1e-15, atol=0), f"{msg} relative clock differs by more than rounding"
+            assert np.isclose(aAsic.relTimeNow, bAsic.relTimeNow, rtol=1e-15, atol=0), f"{msg} relative clock differs by more than rounding"
+    assert rounded == {(1, 4), (2, 4)}, "relative clocks of other ASICs differ"
+
+def _sweepPoint(tile, nInt, interval):
+    """
+    forkSweep point of test_fork_sweep, the DAQ output of nInt interrogations
+    """
+    for _ in range(nInt):
+        tile.Interrogate(interval)
+    return daq_output(tile)
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+def test_fork_sweep():
+    """
+    forkSweep should run every point on its own copy of the tile built before
+    the sweep, and return the same results as running the points in order on
+    fresh copies, with no more than ncpu children at once
+    """
+    random.seed(6)
+    np.random.seed(6)
+    tile = QpixAsicArray.QpixAsicArray(2, 3, deltaT=deltaT)
+    tile.Route("snake", transact=False)
+    for asic in tile:
+        asic.InjectHits(np.sort(np.random.uniform(1e-9, 0.04, 4)))
+    blob = tile.checkpoint()
+
+    points = [(nInt, interval) for nInt in (1, 2, 3) for interval in (0.01, 0.02)]
+    results, startups = QpixMPAnalysis.forkSweep(lambda *p: _sweepPoint(tile, *p), points, ncpu=2)
+    expected = [_sweepPoint(QpixAsicArray.QpixAsicArray.restore(blob), *p) for p in points]
+    assert results == expected, "forked sweep results differ"
+    assert tile._timeNow == 0 and tile._queue.processed == 0, "sweep points changed the parent tile"
+    assert len(startups) == len(points) and all(s >= 0 for s in startups), "missing startup times"
+
+    with pytest.raises(RuntimeError, match="ZeroDivisionError"):
+        QpixMPAnalysis.forkSweep(lambda x: 1 / x, [(1,), (0,)])
+
+def test_run_detector():
+    """
+    runDetector should summarize every tile of the catalog built by tileCatalog
+    the same as running its tiles one after the other
+    """
+    np.random.seed(7)
+    pX, pY = np.random.randint(1, 25, 200), np.random.randint(1, 17, 200)
+    df = pd.DataFrame({"Reset": np.random.uniform(0, 0.1, 200)})
+    df["tileX"], df["AsicX"] = (pX - 1) // 12, (pX - 1) // 4
+    df["tileY"], df["AsicY"] = (pY - 1) // 8, (pY - 1) // 4
+    df["tileN"] = df["tileX"] + df["tileY"] * 2
+    catalog = QpixMPAnalysis.tileCatalog(df, 3, 2)
+    assert [tile["tileN"] for tile in catalog] == [0, 1, 2, 3], "missing tiles"
+    assert sum(len(times) for tile in catalog for _, _, times in tile["hits"]) == len(df), "missing hits"
+
+    run = partial(QpixMPAnalysis.pullRun, r="left", t=15e3, periods=(0.05, 2), int_time=0.1)
+    tiles, detector = QpixMPAnalysis.runDetector(catalog, run, ncpu=2, int_time=0.1)
+    expected = [QpixMPAnalysis._detectorTile(run, {"deltaT": 20e-6}, 0.1, 2, tile) for tile in catalog]
+    assert tiles.to_dict("records") == expected, "tile summaries differ"
+    assert detector["nTiles"] == 4 and detector["DaqWords"] == tiles["DaqWords"].sum()
+    assert detector["Local Max"] == max(tile["Local Max"] for tile in expected)
+
+def test_push_next_hit_index():
+    """
+    In the push state the wake engine should only process the ASICs with a
+    matured hit, and still step the others as the sweep engine does
+    """
+    def run(engine):
+        random.seed(5)
+        qpa = QpixAsicArray.QpixAsicArray(3, 3, deltaT=deltaT, engine=engine)
+        qpa.Route("Snake", transact=False)
+        qpa[0][0].InjectHits([5e-4])
+        qpa[2][2].InjectHits([1.5e-3])
+        qpa.SetPushState(enabled=True, transact=False)
+        calls = {}
+        for asic in qpa:
+            def counted(targetTime, asic=asic, process=asic.Process):
+                calls[(asic.row, asic.col)] = calls.get((asic.row, asic.col), 0) + 1
+                return process(targetTime)
+            asic.Process = counted
+        curT = 0
+        while curT < 2e-3:
+            curT += qpa._deltaT
+            qpa.Process(curT)
+        return qpa, calls
+
+    sweep, sweepCalls = run("sweep")
+    wake, wakeCalls = run("wake")
+    same_simulation(sweep, wake)
+    assert wakeCalls.get((1, 1), 0) < sweepCalls[(1, 1)] / 10, "wake engine stepped an ASIC without hits"
+    data = [d for d in wake._daqNode._localFifo._data if d.wordType == AsicWord.DATA]
+    assert [(d.row, d.col) for d in data] == [(0, 0)], "pushed hit did not reach the DAQ"
+
+def test_inject_hits_merge():
+    """
+    Repeated injections should merge into sorted hits, with masks built from
+    channel lists, mask arrays or the default channels
+    """
+    asic = QpixAsic.QPixAsic(row=0, col=0)
+    asic.InjectHits([0.4, 0.2], [[0, 2], [1]])
+    asic.InjectHits(np.array([0.5, 0.1]), np.array([0x8, 0x10]))
+    asic.InjectHits([0.3])
+    asic.InjectHits([0.6], [[]])
+
+    assert list(asic._times) == [0.1, 0.2, 0.3, 0.4, 0.5, 0.6], "hits not merged in order"
+    assert list(asic._channels) == [0x10, 0x2, 0x10A, 0x5, 0x8, 0x0], "wrong channel masks"
+
+    # hits still to be read merge with the remaining view
+    asic._ReadHits(0.35)
+    asic.InjectHits([0.45], [[15]])
+    assert list(asic._times) == [0.4, 0.45, 0.5, 0.6], "hits not merged after a read"
+    assert list(asic._channels) == [0x5, 0x8000, 0x8, 0x0], "masks not merged after a read"
+
+    # hits appended after the tail are written into spare room of the same buffer
+    asic.InjectHits([0.7], [[1]])
+    buffer = asic._hitBuffer
+    asic.InjectHits([0.8], [[2]])
+    assert asic._hitBuffer is buffer and asic._times.base is buffer[0], "append reallocated the hits"
+    asic._ReadHits(0.55)
+    asic.InjectHits(np.linspace(0.9, 1.0, 20))
+    assert list(asic._times) == [0.6, 0.7, 0.8] + list(np.linspace(0.9, 1.0, 20)), "hits not appended in order"
+    assert list(asic._channels[:3]) == [0x0, 0x2, 0x4], "masks not appended in order"
+    assert not asic._times.flags.writeable, "appended hits are writeable"
+
+@pytest.mark.parametrize("engine", ["sweep", "wake"])
+@pytest.mark.parametrize("push", [False, True])
+def test_stream_hits(engine, push):
+    """
+    An array reading its hits from a windowed hit source should run the same
+    simulation as one with every hit injected before the run, receiving the same
+    hits in the push state, and only read the windows it has reached
+    """
+    tiles = []
+    for stream in (False, True):
+        random.seed(8)
+        np.random.seed(8)
+        tile = QpixAsicArray.QpixAsicArray(3, 3, deltaT=deltaT, engine=engine, stepping="adaptive")
+        hits = [(i, j, np.random.uniform(0, 0.06, 10)) for i in range(3) for j in range(3)]
+        if stream:
+            tile.StreamHits(QpixAsic.hit_windows(hits, 0.005))
+            assert tile._hitHorizon == 0.005, "windows read ahead of the array"
+        else:
+            tile._InjectHits(hits)
+        tile.Route("left", transact=False)
+        if push:
+            tile.SetPushState(enabled=True, transact=False)
+            tile.IdleFor(0.03)
+        else:
+            tile.Interrogate(0.03, hard=True)
+        if stream:
+            assert tile._hitHorizon < 0.04, "windows read ahead of the array"
+        tile.Interrogate(0.04)
+        tiles.append(tile)
+    if push:
+        # pushing ASICs are stepped while they have hits left, which differ
+        # with the hits read so far, so only the received hits must match
+        hits = lambda qpa: sorted(d[2:] for d in daq_output(qpa) if d[1] == AsicWord.DATA)
+        assert hits(tiles[0]) == hits(tiles[1]), "different hits received"
+    else:
+        same_simulation(*tiles)
+    assert tiles[1]._hitSource is None, "hit source not exhausted"
+
+@pytest.mark.parametrize("engine", ["sweep", "wake"])
+def test_tile_file(tmp_path, engine):
+    """
+    A tile file converted from a tiledf json should hold the sorted hits of every
+    ASIC, and an array built from it should run the same simulation as one built
+    from the json
+    """
+    import json
+    np.random.seed(9)
+    tiledf = {"nrows": 2, "ncols": 3,
+              "hits": [[i, j, np.random.uniform(0, 0.04, 8).tolist()] for i in range(2) for j in range(3) if i or j]}
+    with open(tmp_path / "tile.json", "w") as f:
+        json.dump(tiledf, f)
+    QpixTileFile.convert_tiledf(tmp_path / "tile.json", tmp_path / "tile.qpt")
+
+    tile = QpixTileFile.TileFile(tmp_path / "tile.qpt")
+    assert (tile.nrows, tile.ncols, len(tile)) == (2, 3, 40), "wrong header"
+    assert list(tile.offsets) == [0, 0, 8, 16, 24, 32, 40], "wrong offsets"
+    times, masks = tile.hits(1, 2)
+    assert list(times) == sorted(tiledf["hits"][-1][2]), "hits not sorted"
+    assert np.all(masks == 0x10A), "wrong default channel masks"
+
+    tiles = []
+    for fromFile in (False, True):
+        random.seed(9)
+        if fromFile:
+            array = QpixAsicArray.QpixAsicArray.fromTileFile(tmp_path / "tile.qpt", deltaT=deltaT, engine=engine)
+        else:
+            array = QpixAsicArray.QpixAsicArray(0, 0, tiledf=tiledf, deltaT=deltaT, engine=engine)
+        array.Route("left", transact=False)
+        array.Interrogate(0.02, hard=True)
+        array.Interrogate(0.03)
+        tiles.append(array)
+    same_simulation(*tiles)
+
+def test_state_recorder():
+    """
+    A StateRecorder should keep every transition in full mode, the last size
+    transitions in ring mode and nothing when off, and an array recording rings
+    should see the end of the same transitions as one recording everything
+    """
+    states = [AsicState.Idle, AsicState.TransmitLocal, AsicState.Finish] * 20
+    records = {mode: QpixAsic.StateRecorder(mode, size=7) for mode in ("full", "ring", "off")}
+    for i, state in enumerate(states):
+        for record in records.values():
+            record.append(state, i * 0.5, float(i))
+
+    expected = np.array([state.value for state in states], dtype=np.int8)
+    full, ring, off = (records[mode].to_arrays() for mode in ("full", "ring", "off"))
+    assert np.array_equal(full[0], expected) and np.array_equal(full[2], np.arange(60)), "full record lost transitions"
+    assert np.array_equal(ring[0], expected[-7:]) and list(ring[1]) == [i * 0.5 for i in range(53, 60)], "wrong ring"
+    assert len(records["off"]) == 0 and len(off[0]) == 0, "off record kept transitions"
+
+    tiles = []
+    for stateRecord in ("full", "ring"):
+        random.seed(3)
+        tiles.append(QpixAsicArray.QpixAsicArray(2, 2, deltaT=deltaT, stateRecord=stateRecord, stateRingSize=3))
+        for asic in tiles[-1]:
+            asic.InjectHits([0.001, 0.002])
+        tiles[-1].Interrogate(0.01)
+    for full, ring in zip(*tiles):
+        assert all(np.array_equal(f[-3:], r) for f, r in zip(full.state_times.to_arrays(), ring.state_times.to_arrays()))
+
+@pytest.mark.parametrize("engine", ["sweep", "wake"])
+def test_subscribe(engine):
+    """
+    Subscribers should see every state transition, word, FIFO access and DAQ
+    receipt of a run without changing the simulation, and unsubscribing should
+    remove every hook
+    """
+    tiles, counts = [], {event: 0 for event in QpixAsicArray.QpixAsicArray.EVENTS}
+    def counter(event):
+        def count(*args):
+            counts[event] += 1
+        return count
+    callbacks = {event: counter(event) for event in counts}
+
+    for subscribe in (False, True):
+        random.seed(10)
+        tile = QpixAsicArray.QpixAsicArray(2, 3, deltaT=deltaT, engine=engine)
+        for asic in tile:
+            asic.InjectHits([0.001, 0.004])
+        if subscribe:
+            for event, callback in callbacks.items():
+                tile.Subscribe(event, callback)
+        tile.Interrogate(0.01, hard=True)
+        tiles.append(tile)
+    same_simulation(*tiles)
+
+    asics = list(tile)
+    assert counts["state"] == sum(len(asic.state_times) - 1 for asic in asics), "missed state transitions"
+    assert counts["daq"] == len(tile._daqNode._localFifo._data), "missed DAQ receipts"
+    assert counts["send"] == counts["receive"] + counts["daq"] == tile._queue.processed, "missed words"
+    assert counts["fifoWrite"] == sum(a._localFifo._totalWrites + a._remoteFifo._totalWrites for a in asics)
+    assert counts["fifoRead"] == counts["fifoWrite"] - sum(a._localFifo._curSize + a._remoteFifo._curSize for a in asics)
+
+    for event, callback in callbacks.items():
+        tile.Unsubscribe(event, callback)
+    assert not tile._observers, "events left subscribed"
+    hooked = {"_changeState", "ReceiveByte", "_AddQueueItem", "Write", "Read"}
+    for obj in asics + [tile._daqNode, tile._queue] + [a._localFifo for a in asics] + [a._remoteFifo for a in asics]:
+        assert not hooked & set(vars(obj)), "hook left behind"
+
+@pytest.mark.parametrize("engine", ["sweep", "wake"])
+def test_profiler(engine):
+    """
+    A profiled array should run the same simulation as one without a profiler,
+    and count every call of the phases of Process, also when subscribers come
+    and go, and makeData should include the profile
+    """
+    tiles = []
+    for profile in (False, True):
+        random.seed(11)
+        tile = QpixAsicArray.QpixAsicArray(2, 3, deltaT=deltaT, engine=engine, profile=profile)
+        for asic in tile:
+            asic.InjectHits([0.001, 0.004])
+        if profile:
+            tile.Subscribe("send", print)
+            tile.Unsubscribe("send", print)
+        tile.Interrogate(0.01, hard=True)
+        tile.Interrogate(0.01)
+        tiles.append(tile)
+    same_simulation(*tiles)
+
+    stats = tile.profiler.to_dict()
+    assert stats["process"]["calls"] == 2, "missed Process calls"
+    assert stats["pop"]["calls"] == stats["queue"]["calls"] == tile._queue.processed, "missed queue calls"
+    assert stats["sweep"]["calls"] == 2 * tile._queue.processed, "missed sweeps"
+    assert stats["receive"]["calls"] == tile._queue.processed, "missed receipts"
+    assert stats["TransmitLocalState"]["calls"] > 0 and stats["TransmitLocalState"]["kind"] == "state"
+    assert all(stats["process"]["ns"] >= stats[name]["ns"] for name in ("step", "sweep", "pop")), "phases outlast Process"
+    assert list(tile.profiler.to_dataframe().columns) == ["kind", "calls", "ns"]
+
+    data = QpixMPAnalysis.makeData(tile, "left", 0, 0.01, 1, profile=True)
+    profile = data[QpixMPAnalysis.PROFILE_KEY]
+    assert profile["Calls"][profile["Name"].index("pop")] == tile._queue.processed, "profile missing from makeData"
+    with pytest.raises(AssertionError):
+        tile.checkpoint()
+
+@pytest.mark.parametrize("engine", ["sweep", "wake"])
+def test_trace_exporter(tmp_path, engine):
+    """
+    TraceExporter should write a valid Chrome trace, with every state interval
+    of every ASIC, one link transfer per word and one event per DAQ receipt,
+    without changing the simulation
+    """
+    tiles = []
+    for trace in (False, True):
+        random.seed(12)
+        tile = QpixAsicArray.QpixAsicArray(2, 3, deltaT=deltaT, engine=engine)
+        for asic in tile:
+            asic.InjectHits([0.001, 0.004])
+        if trace:
+            with QpixTrace.TraceExporter(tile, tmp_path / "trace.json", bufferSize=7):
+                tile.Interrogate(0.01, hard=True)
+        else:
+            tile.Interrogate(0.01, hard=True)
+        tiles.append(tile)
+    same_simulation(*tiles)
+    assert not tile._observers, "exporter left subscribed"
+
+    with open(tmp_path / "trace.json") as f:
+        events = json.load(f)
+    assert all(e.get("ph") for e in events), "event without a phase"
+    states = [e for e in events if e["ph"] == "X" and e["pid"] == 0]
+    links = [e for e in events if e["ph"] == "X" and e["pid"] == 1]
+    daq = [e for e in events if e["ph"] == "i"]
+    asics = list(tile)
+    assert len(states) == sum(len(asic.state_times) for asic in asics), "missed state intervals"
+    assert len(daq) == len(tile._daqNode._localFifo._data), "missed DAQ receipts"
+    assert len(links) == tile._queue.processed, "missed link transfers"
+    assert all(e["dur"] >= 0 for e in states + links), "negative interval"
+    for i, asic in enumerate(asics):
+        track = [e for e in states if e["tid"] == i]
+        assert [e["name"] for e in track] == [AsicState(s).name for s in asic.state_times.to_arrays()[0]]
+        assert all(np.isclose(a["ts"] + a["dur"], b["ts"]) for a, b in zip(track, track[1:])), "gap between states"
+
+@pytest.mark.parametrize("engine", ["sweep", "wake"])
+def test_fifo_sampler(engine):
+    """
+    A sampled array should run the same simulation as one without a sampler,
+    and take every sample before the time it was processed to with depths the
+    FIFOs really had, also with subscribers on the FIFOs
+    """
+    tiles = []
+    for interval in (None, 2e-5):
+        random.seed(13)
+        tile = QpixAsicArray.QpixAsicArray(3, 3, deltaT=deltaT, engine=engine, fifoInterval=interval, fifoSamples=400)
+        for asic in tile:
+            asic.InjectHits([0.001, 0.002, 0.004])
+        if interval is not None:
+            tile.Subscribe("fifoWrite", print)
+            tile.Unsubscribe("fifoWrite", print)
+        tile.Interrogate(0.005, hard=True)
+        tiles.append(tile)
+    same_simulation(*tiles)
+
+    sampler = tile.fifoSampler
+    times, _, remote = sampler.to_arrays()
+    assert len(sampler) == 250, "missed samples"
+    assert np.all(np.diff(times) > 0) and times[-1] < tile._timeNow
+    asics = list(tile)
+    current = np.array([[asic._localFifo._curSize, asic._remoteFifo._curSize] for asic in asics])
+    assert np.array_equal(sampler._local.reshape(-1), current[:, 0]), "local depths out of date"
+    assert np.array_equal(sampler._remote.reshape(-1), current[:, 1]), "remote depths out of date"
+    maxSizes = np.array([asic._remoteFifo._maxSize for asic in asics]).reshape(3, 3)
+    assert np.all(remote.max(axis=0) <= maxSizes) and remote.max() > 0, "remote depths never sampled"
+
+    tile.Interrogate(0.01)
+    assert len(sampler) == 400 and sampler.Sample(1.0) == np.inf, "sampled past the last sample"
+    with pytest.raises(AssertionError):
+        tile.checkpoint()
+
+def test_generate_background():
+    """
+    GenerateBackground should inject Poisson hits at randomRate per pixel into
+    every ASIC, with same tick hits grouped into one channel mask
+    """
+    np.random.seed(2)
+    qpa = QpixAsicArray.QpixAsicArray(2, 2, hitsPerSec=hitsPerSec)
+    qpa.GenerateBackground(2.5, window=1.0)
+    qpa.GenerateBackground(5.0, window=1.0)
+    assert qpa._bgTime == 5.0, "background not generated up to the end time"
+
+    nChannelHits = 0
+    for asic in qpa:
+        assert np.all(np.diff(asic._times) >= 0), "background hits not sorted"
+        assert 0 < asic._times[0] and asic._times[-1] < 5.0, "background hits out of range"
+        ticks = ((asic._times - asic._startTime) / asic.tOsc).astype(np.int64) + 1
+        assert len(np.unique(ticks)) == len(ticks), "same tick hits not grouped"
+        nChannelHits += sum(bin(int(m)).count("1") for m in asic._channels)
+
+    expected = 4 * 16 * hitsPerSec * 5.0
+    assert abs(nChannelHits - expected) < 5 * np.sqrt(expected), "wrong background rate"
+
+    # the ASIC generator feeds the same InjectHits / _ReadHits path
+    asic = QpixAsic.QPixAsic(row=0, col=0, randomRate=hitsPerSec)
+    nHits = asic._GeneratePoissonHits(1.0, rng=np.random.default_rng(2))
+    assert nHits > 0 and asic._ReadHits(1.0) > 0, "generated hits not read"
+    assert asic._GeneratePoissonHits(0.5) == 0, "hits generated twice"
+
+def test_read_hits_cursor():
+    """
+    _ReadHits should read every hit up to and including the target time, and
+    leave the rest as a view of the injected hits
+    """
+    asic = QpixAsic.QPixAsic(row=0, col=0)
+    asic.InjectHits([0.3, 0.1, 0.2, 0.4])
+    injected = asic._times
+
+    assert asic._ReadHits(0.1) == 0, "hit read before its time"
+    assert asic._ReadHits(0.2) == 2, "hits up to target time not read"
+    assert list(asic._times) == [0.3, 0.4], "wrong hits left"
+    assert np.shares_memory(asic._times, injected), "remaining hits were copied"
+    assert [asic._localFifo.Read().data for _ in range(2)] == [0.1, 0.2], "hits read out of order"
+    assert asic._ReadHits(1.0) == 2 and len(asic._times) == 0, "last hits not read"
+
+@pytest.mark.parametrize("push", [False, True])
+@pytest.mark.parametrize("engine", ["sweep", "wake"])
+def test_adaptive_stepping_matches_fixed(push, engine):
+    """
+    Adaptive stepping, with deltaT as the largest step, should jump over the
+    empty steps without changing which hits the DAQ receives. Hits are read at
+    their own time instead of the next step, so only arrival times can change.
+    """
+    steps = []
+    nextStepTime = QpixAsicArray.QpixAsicArray._NextStepTime
+    def countingNextStepTime(self, timeEnd):
+        steps.append(timeEnd)
+        return nextStepTime(self, timeEnd)
+
+    fixed = run_seeded_array(push=push, engine=engine)
+    QpixAsicArray.QpixAsicArray._NextStepTime = countingNextStepTime
+    try:
+        adaptive = run_seeded_array(push=push, idle=True, engine=engine, stepping="adaptive")
+    finally:
+        QpixAsicArray.QpixAsicArray._NextStepTime = nextStepTime
+
+    hits = lambda qpa: sorted(d[2:] for d in daq_output(qpa) if d[1] == AsicWord.DATA)
+    assert hits(fixed) == hits(adaptive), "different hits received"
+    assert len(steps) < 0.05 * 1.2 / deltaT, "adaptive stepping took every step"
+
 if __name__ == "__main__":
 
     qpix_array = QpixAsicArray.QpixAsicArray(
@@ -0,0 +1,102 @@
+#!/usr/bin/python3
+
+"""
+Binary tile files, a memory mapped replacement of the tiledf json files made
+by radiogenicNB.ipynb, read with QpixAsicArray.fromTileFile.
+
+A tile file is, in native byte order:
+
+    header   b"QPXT", uint32 version, uint32 nrows, uint32 ncols, uint64 nHits
+    offsets  uint64[nrows * ncols + 1], CSR offsets of the hits of every ASIC,
+             in row major order
+    times    float64[nHits], the sorted hit times of every ASIC
+    masks    uint16[nHits], the channel mask of every hit
+
+Reading a tile only reads the header and offsets. The hit times and masks are
+views of the mapped file, so every process reading the same tile shares its
+pages, and a page is only read once the simulation reaches its hits.
+"""
+
+import json
+import numpy as np
+from QpixAsic import channel_masks
+
+MAGIC = b"QPXT"
+VERSION = 1
+_HEADER = np.dtype([("magic", "S4"), ("version", np.uint32), ("nrows", np.uint32),
+                    ("ncols", np.uint32), ("nHits", np.uint64)])
+
+
+class TileFile:
+    """
+    read only view of a tile file
+    VARS:
+      nrows, ncols - size of the tile
+      offsets      - CSR offsets of the hits of every ASIC, in row major order
+      times        - hit times of every ASIC, sorted within each ASIC
+      masks        - channel masks of every hit
+    """
+    def __init__(self, path):
+        raw = np.memmap(path, dtype=np.uint8, mode="r")
+        header = raw[:_HEADER.itemsize].view(_HEADER)[0]
+        assert header["magic"] == MAGIC, f"{path} is not a tile file"
+        assert header["version"] == VERSION, f"unknown tile file version {header['version']}"
+        self.nrows, self.ncols = int(header["nrows"]), int(header["ncols"])
+        nHits = int(header["nHits"])
+
+        start = _HEADER.itemsize
+        end = start + 8 * (self.nrows * self.ncols + 1)
+        self.offsets = raw[start:end].view(np.uint64)
+        start, end = end, end + 8 * nHits
+        self.times = raw[start:end].view(np.float64)
+        start, end = end, end + 2 * nHits
+        self.masks = raw[start:end].view(np.uint16)
+
+    def __len__(self):
+        return len(self.times)
+
+    def hits(self, row, col):
+        """
+        views of the hit times and channel masks of the ASIC at (row, col)
+        """
+        i = row * self.ncols + col
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return self.times[start:end], self.masks[start:end]
+
+
+def write_tile(path, nrows, ncols, hits):
+    """
+    write a tile file of nrows x ncols ASICs, with the (asicX, asicY, times[, channels])
+    hits of a tiledf. channels are as for QPixAsic.InjectHits, and an ASIC may
+    appear more than once.
+    """
+    times, masks = [[] for _ in range(nrows * ncols)], [[] for _ in range(nrows * ncols)]
+    for hit in hits:
+        asicTimes = np.asarray(hit[2], dtype=np.float64)
+        times[hit[0] * ncols + hit[1]].append(asicTimes)
+        masks[hit[0] * ncols + hit[1]].append(channel_masks(hit[3] if len(hit) > 3 else None, len(asicTimes)))
+
+    for i in range(nrows * ncols):
+        times[i] = np.concatenate(times[i]) if times[i] else np.zeros(0)
+        masks[i] = np.concatenate(masks[i]) if masks[i] else np.zeros(0, dtype=np.int64)
+        assert np.all((masks[i] >= 0) & (masks[i] < 1 << 16)), "channel masks must fit in 16 bits"
+        order = np.argsort(times[i], kind="stable")
+        times[i], masks[i] = times[i][order], masks[i][order]
+
+    offsets = np.zeros(nrows * ncols + 1, dtype=np.uint64)
+    offsets[1:] = np.cumsum([len(t) for t in times])
+    header = np.array([(MAGIC, VERSION, nrows, ncols, offsets[-1])], dtype=_HEADER)
+    with open(path, "wb") as f:
+        f.write(header.tobytes())
+        f.write(offsets.tobytes())
+        f.write(np.concatenate(times).astype(np.float64).tobytes())
+        f.write(np.concatenate(masks).astype(np.uint16).tobytes())
+
+
+def convert_tiledf(jsonPath, path):
+    """
+    convert the tiledf json file of radiogenicNB.ipynb at jsonPath into a tile file
+    """
+    with open(jsonPath) as f:
+        tiledf = json.load(f)
+    write_tile(path, tiledf["nrows"], tiledf["ncols"], tiledf["hits"])
@@ -0,0 +1,150 @@
+#!/usr/bin/python3
+
+"""
+Streaming Chrome trace export of a QpixAsicArray run, to inspect large arrays
+in chrome://tracing or https://ui.perfetto.dev instead of viewAsicState.
+
+TraceExporter subscribes to the state, send and daq events of the array, see
+QpixAsicArray.Subscribe, and writes trace events to the file as the run goes,
+in the JSON array format of the Trace Event Format. Only a bounded buffer of
+events is held in memory, along with the start of the current state of every
+ASIC and the track number of every link.
+
+Tracks, with times in simulated microseconds:
+  ASICs     - one track per ASIC, with the interval of every state it was in,
+              and a DaqNode track with an instant event for every received word
+  Links     - one track per directed link, with the transfer of every word sent
+              on it, ending when it arrives
+"""
+
+import json
+
+_ASICS, _LINKS = 0, 1
+
+
+def _nodeName(node):
+    return "DaqNode" if node.isDaqNode else f"({node.row}, {node.col})"
+
+
+def _origin(byte):
+    """
+    json args of the ASIC a word comes from, none for register words
+    """
+    if byte.originRow is None:
+        return ""
+    return f',"args":{{"row":{byte.originRow},"col":{byte.originCol}}}'
+
+
+class TraceExporter:
+    """
+    write the activity of array into the Chrome trace file path, from now until
+    Close. Can also be used as a context manager.
+    ARGS:
+      array      - sweep or wake engine QpixAsicArray to trace
+      path       - trace file to write
+      bufferSize - number of events held before they are written to the file
+    """
+
+    def __init__(self, array, path, bufferSize=4096):
+        self._array = array
+        self._file = open(path, "w")
+        self._bufferSize = bufferSize
+        self._buffer = []
+        self._links = {}
+        # whether an event was written to the file, the next one needs a comma
+        self._written = False
+        self._file.write("[\n")
+
+        asics = array._asicList
+        self._tids = {id(asic): i for i, asic in enumerate(asics)}
+        self._stateStart = [asic._absTimeNow for asic in asics]
+        self._daqTid = len(asics)
+        self._Meta(_ASICS, None, "process_name", "ASICs")
+        self._Meta(_LINKS, None, "process_name", "Links")
+        for i, asic in enumerate(asics):
+            self._Meta(_ASICS, i, "thread_name", f"({asic.row}, {asic.col})")
+        self._Meta(_ASICS, self._daqTid, "thread_name", "DaqNode")
+
+        array.Subscribe("state", self._OnState)
+        array.Subscribe("send", self._OnSend)
+        array.Subscribe("daq", self._OnDaq)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.Close()
+
+    def _Write(self, event):
+        """
+        add the json text of an event to the buffer
+        """
+        self._buffer.append(event)
+        if len(self._buffer) >= self._bufferSize:
+            self._Flush()
+
+    def _Flush(self):
+        if self._buffer:
+            if self._written:
+                self._file.write(",\n")
+            self._file.write(",\n".join(self._buffer))
+            self._buffer.clear()
+            self._written = True
+
+    def _Meta(self, pid, tid, name, value):
+        event = {"ph": "M", "pid": pid, "name": name, "args": {"name": value}}
+        if tid is not None:
+            event["tid"] = tid
+        self._Write(json.dumps(event, separators=(",", ":")))
+
+    def _State(self, i, state, endTime):
+        """
+        the interval of ASIC i in state, from its last transition until endTime
+        """
+        start = self._stateStart[i]
+        self._Write(f'{{"ph":"X","pid":{_ASICS},"tid":{i},"name":"{state.name}",'
+                    f'"ts":{start * 1e6:.4f},"dur":{(endTime - start) * 1e6:.4f}}}')
+        self._stateStart[i] = endTime
+
+    def _OnState(self, asic, oldState, newState):
+        self._State(self._tids[id(asic)], oldState, asic._absTimeNow)
+
+    def _OnSend(self, item):
+        # the DaqNode only knows its link to (0, 0) from the other side
+        if item.asic.isDaqNode:
+            sender = self._array[0][0]
+        else:
+            sender = item.asic.connections[item.dir.value].asic
+        key = (id(sender), id(item.asic))
+        tid = self._links.get(key)
+        if tid is None:
+            tid = self._links[key] = len(self._links)
+            self._Meta(_LINKS, tid, "thread_name", f"{_nodeName(sender)} -> {_nodeName(item.asic)}")
+        byte = item.QPByte
+        duration = byte.transferTicks * sender.tOsc
+        self._Write(f'{{"ph":"X","pid":{_LINKS},"tid":{tid},"name":"{byte.wordType.name}",'
+                    f'"ts":{(item.inTime - duration) * 1e6:.4f},"dur":{duration * 1e6:.4f}{_origin(byte)}}}')
+
+    def _OnDaq(self, item):
+        byte = item.QPByte
+        self._Write(f'{{"ph":"i","s":"t","pid":{_ASICS},"tid":{self._daqTid},"name":"{byte.wordType.name}",'
+                    f'"ts":{item.inTime * 1e6:.4f}{_origin(byte)}}}')
+
+    def Close(self):
+        """
+        end the current state of every ASIC at its current time, stop tracing
+        and finish the file
+        """
+        if self._file.closed:
+            return
+        array = self._array
+        array.Unsubscribe("state", self._OnState)
+        array.Unsubscribe("send", self._OnSend)
+        array.Unsubscribe("daq", self._OnDaq)
+        if array._wake:
+            array._CatchUpAll()
+        for i, asic in enumerate(array._asicList):
+            self._State(i, asic.state, asic._absTimeNow)
+        self._Flush()
+        self._file.write("\n]\n")
+        self._file.close()